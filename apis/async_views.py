@@ -0,0 +1,266 @@
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, get_hasher, identify_hasher, make_password
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, StreamingHttpResponse
+from django.views import View
+from rest_framework.exceptions import APIException, NotAuthenticated
+
+from apis.authentication import CachedJWTAuthentication
+from apis.events import hub, latest_seq, read_events
+from apis.models import User, Department, DoctorProfile, PatientProfile, PatientRecords
+from apis.pagination import KeysetPagination
+from apis.renderers import dumps
+from apis.scoping import department_scope
+from apis.serializers import (
+    UserRegistrationSerializer, UserLoginSerializer, DepartmentSerializer, DoctorListSerializer,
+    PatientListSerializer, PatientRecordSerializer, PatientProfileSerializer,
+)
+from apis.views import get_tokens_for_user
+
+# PBKDF2 releases the GIL, so a small thread pool hashes in parallel while the
+# event loop keeps serving other requests. The pool size bounds how much CPU a
+# login storm can take.
+password_executor = ThreadPoolExecutor(max_workers=settings.PASSWORD_HASH_WORKERS,
+                                       thread_name_prefix='password-hash')
+
+
+async def run_hasher(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(password_executor, func, *args)
+
+
+class AsyncAPIView(View):
+    """
+    Base for the native async views served through greylabs.asgi. Mirrors the
+    bits of APIView these endpoints need: CSRF exemption, JWT authentication,
+    JSON/form bodies and the UserRenderer output format.
+    """
+    authentication_required = False
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+        view.csrf_exempt = True
+        return view
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            if self.authentication_required:
+                result = await CachedJWTAuthentication().aauthenticate(request)
+                if result is None:
+                    raise NotAuthenticated()
+                request.user, request.auth = result
+            return await super().dispatch(request, *args, **kwargs)
+        except APIException as exc:
+            detail = exc.detail if isinstance(exc.detail, (dict, list)) else {'detail': exc.detail}
+            return self.error(detail, status=exc.status_code)
+
+    def get_data(self, request):
+        if request.content_type == 'application/json':
+            try:
+                return json.loads(request.body or b'{}')
+            except ValueError:
+                return None
+        return request.POST.dict()
+
+    def respond(self, data, status=200):
+        return HttpResponse(dumps(data), content_type='application/json', status=status)
+
+    def error(self, errors, status=400):
+        return self.respond({'errors': errors}, status=status)
+
+
+class AsyncUserRegistrationView(AsyncAPIView):
+    async def post(self, request, format=None):
+        data = self.get_data(request)
+        if not isinstance(data, dict):
+            return self.error({'non_field_errors': ['Invalid JSON body.']})
+
+        serializer = UserRegistrationSerializer(data=data)
+        # Validation checks email uniqueness, which queries the database
+        if not await sync_to_async(serializer.is_valid)():
+            return self.error(serializer.errors)
+
+        validated = serializer.validated_data
+        user = User(
+            email=User.objects.normalize_email(validated['email']),
+            name=validated['name'],
+            role=validated['role'],
+            password=await run_hasher(make_password, validated['password']),
+        )
+        await user.asave()
+        token = await sync_to_async(get_tokens_for_user)(user)
+        return self.respond({'token': token, 'msg': 'Registration Successful'}, status=201)
+
+
+class AsyncUserLoginView(AsyncAPIView):
+    async def post(self, request, format=None):
+        data = self.get_data(request)
+        if not isinstance(data, dict):
+            return self.error({'non_field_errors': ['Invalid JSON body.']})
+
+        serializer = UserLoginSerializer(data=data)
+        if not serializer.is_valid():
+            return self.error(serializer.errors)
+        email = serializer.data.get('email')
+        password = serializer.data.get('password')
+
+        user = await User.objects.filter(email=email).afirst()
+        if user is None:
+            # Hash anyway so unknown emails take as long as wrong passwords
+            await run_hasher(make_password, password)
+        elif await run_hasher(check_password, password, user.password) and user.is_active:
+            await self.upgrade_password(user, password)
+            token = await sync_to_async(get_tokens_for_user)(user)
+            return self.respond({'token': token, 'msg': 'Login Success'})
+
+        return self.error({'non_field_errors': ['Email or Password is not Valid']}, status=404)
+
+    async def upgrade_password(self, user, password):
+        # What check_password's setter does for the sync login, done without blocking
+        preferred = get_hasher('default')
+        if identify_hasher(user.password).algorithm != preferred.algorithm or preferred.must_update(user.password):
+            user.password = await run_hasher(make_password, password)
+            await user.asave(update_fields=['password'])
+
+
+class AsyncDepartmentListView(AsyncAPIView):
+    async def get(self, request, *args, **kwargs):
+        departments = [department async for department in Department.objects.all()]
+        return self.respond(DepartmentSerializer(departments, many=True).data)
+
+
+class AsyncDoctorListView(AsyncAPIView):
+    async def get(self, request, *args, **kwargs):
+        fields = DoctorListSerializer.get_requested_fields(request)
+        doctors = DoctorListSerializer.setup_eager_loading(DoctorProfile.objects.all())
+        doctors = [doctor async for doctor in doctors]
+        return self.respond(DoctorListSerializer(doctors, many=True, fields=fields).data)
+
+
+class AsyncPatientListView(AsyncAPIView):
+    async def get(self, request, *args, **kwargs):
+        fields = PatientListSerializer.get_requested_fields(request)
+        patients = PatientListSerializer.setup_eager_loading(PatientProfile.objects.all())
+        patients = [patient async for patient in patients]
+        return self.respond(PatientListSerializer(patients, many=True, fields=fields).data)
+
+
+class AsyncPatientRecordView(AsyncAPIView):
+    authentication_required = True
+
+    async def get(self, request, *args, **kwargs):
+        department_id = request.user.doctorprofile.department_id
+        fields = PatientRecordSerializer.get_requested_fields(request)
+        records = PatientRecords.objects.filter(department_id=department_id)
+        paginator = KeysetPagination(ordering=('created_date', 'id'))
+        records = PatientRecordSerializer.restrict_queryset(records, fields, always=('id', 'created_date'))
+        page = await paginator.apaginate_queryset(records, request, view=self)
+
+        if not page and paginator.cursor_query_param not in request.GET:
+            return self.respond({"message": "No records exist for your department."})
+
+        serializer = PatientRecordSerializer(page, many=True, fields=fields)
+        return self.respond(paginator.get_paginated_data(serializer.data))
+
+
+class AsyncPatientRecordDetailView(AsyncAPIView):
+    authentication_required = True
+
+    async def get(self, request, pk, *args, **kwargs):
+        # One query when permitted, a second only to tell 403 from 404
+        scope = department_scope(request.user.doctorprofile.department_id)
+        record = await PatientRecords.objects.filter(scope, pk=pk).afirst()
+        if record is None:
+            if await PatientRecords.objects.filter(pk=pk).aexists():
+                return self.respond({"message": "You do not have permission to access this record."}, status=403)
+            return self.respond({"message": "Record does not exist."}, status=404)
+
+        return self.respond(PatientRecordSerializer(record).data)
+
+
+class AsyncPatientDetailView(AsyncAPIView):
+    authentication_required = True
+
+    async def get(self, request, pk, *args, **kwargs):
+        # Allow fetching if the department is the same or NULL
+        scope = department_scope(request.user.doctorprofile.department_id, allow_unassigned=True)
+        patient = await PatientProfile.objects.select_related('user', 'department').filter(scope, pk=pk).afirst()
+        if patient is None:
+            if await PatientProfile.objects.filter(pk=pk).aexists():
+                return self.respond({"error": "You do not have permission to view this patient profile."}, status=403)
+            return self.error({"detail": "Not found."}, status=404)
+
+        return self.respond(PatientProfileSerializer(patient).data)
+
+
+async def stream_events(subscription, since):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.EVENTS_MAX_STREAM_SECONDS
+    try:
+        # Catch up from the change log first; the subscription already
+        # queues live events, which are skipped up to where the log read ended
+        if since is None:
+            last_seq = await sync_to_async(latest_seq)()
+        else:
+            last_seq, more = since, True
+            while more:
+                events, last_seq, more = await sync_to_async(read_events)([subscription.department_id], last_seq)
+                for event in events:
+                    yield event.encode()
+        # Gives the client an id to resume from, even before the first event
+        yield b'id: %d\nevent: ready\ndata: {}\n\n' % last_seq
+
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                # Django 4.2 does not notice a client going away mid-stream,
+                # so streams are bounded and clients reconnect
+                return
+            try:
+                event = await subscription.get(min(settings.EVENTS_KEEPALIVE_SECONDS, remaining))
+            except asyncio.TimeoutError:
+                yield b': keepalive\n\n'
+                continue
+            if event is None:
+                # Fell too far behind, the client resumes from the log
+                return
+            if event.seq > last_seq:
+                yield event.encode()
+    finally:
+        subscription.close()
+
+
+class RecordEventStreamView(AsyncAPIView):
+    """
+    Server-sent events for the records of the doctor's department: a
+    `record` event with the record for every create and update, a `deleted`
+    event with the id for every delete. Resumes after Last-Event-ID (or
+    ?since=, a sync token) when given. See apis/events.py.
+    """
+    authentication_required = True
+
+    async def get(self, request, *args, **kwargs):
+        # Under WSGI the endless response would take a worker and never be sent
+        if not isinstance(request, ASGIRequest):
+            return self.error({'detail': 'Event streams are only served through greylabs.asgi.'}, status=501)
+
+        since = request.headers.get('Last-Event-ID', request.GET.get('since'))
+        if since is not None:
+            try:
+                since = int(since)
+            except ValueError:
+                since = -1
+            if since < 0:
+                return self.error({'detail': 'Invalid Last-Event-ID.'})
+
+        subscription = await hub.subscribe(request.user.doctorprofile.department_id)
+        response = StreamingHttpResponse(stream_events(subscription, since), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # Tells nginx not to buffer the stream
+        response['X-Accel-Buffering'] = 'no'
+        return response
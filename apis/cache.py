@@ -0,0 +1,92 @@
+import hashlib
+import time
+
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.http import HttpResponse
+from rest_framework.response import Response
+
+# Cached list responses are keyed by a version counter per model. Saving or
+# deleting a row bumps its model's counter (see apis/signals.py), so every
+# response built from the old data stops being addressable at once. Old
+# entries simply age out of the backend. Bumps happen once the write has
+# committed, a reader in between would cache the old rows under the new
+# version.
+#
+# Invalidation reaches the processes that share the cache backend. The
+# default file-based cache is shared by every worker and management command
+# on the host. The local-memory backend works too, but is per process: a
+# write seen by one worker, or made by a management command, leaves the other
+# workers' lists stale for up to cache_timeout.
+VERSION_KEY = 'apis:version:{}'
+RESPONSE_KEY = 'apis:response:{}:{}'
+
+
+def cache_is_shared():
+    """False for backends that live in one process and cannot be invalidated by the others."""
+    return not isinstance(caches[DEFAULT_CACHE_ALIAS], (LocMemCache, DummyCache))
+
+
+def _fresh_version():
+    # A counter that went missing (eviction, cache restart) must not restart
+    # from a value an older response might still be stored under
+    return time.time_ns()
+
+
+def get_versions(labels):
+    keys = [VERSION_KEY.format(label) for label in labels]
+    versions = cache.get_many(keys)
+    missing = {key: _fresh_version() for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, timeout=None)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+def bump_version(label):
+    key = VERSION_KEY.format(label)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, _fresh_version(), timeout=None)
+
+
+class VersionedCacheMixin:
+    """
+    Serves GET responses as pre-rendered bytes from the cache.
+
+    `cache_models` lists the models whose data the response is built from;
+    the cache key embeds their current versions. Only JSON responses are
+    cached, other renderers (e.g. the browsable API) depend on the request.
+    """
+    cache_models = ()
+    cache_timeout = 60 * 60
+
+    def get_cache_key(self, request):
+        versions = get_versions([model._meta.label_lower for model in self.cache_models])
+        path = hashlib.md5(request.get_full_path().encode('utf-8')).hexdigest()
+        return RESPONSE_KEY.format(path, '.'.join(str(version) for version in versions))
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.cache_key = None
+        if request.method == 'GET' and request.accepted_renderer.format == 'json':
+            self.cache_key = self.get_cache_key(request)
+
+    def cached_response(self):
+        # Returns the stored response for this request, or None on a miss
+        if not self.cache_key:
+            return None
+        cached = cache.get(self.cache_key)
+        if cached is None:
+            return None
+        content_type, content = cached
+        return HttpResponse(content, content_type=content_type)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if getattr(self, 'cache_key', None) and isinstance(response, Response) and response.status_code == 200:
+            response.render()
+            cache.set(self.cache_key, (response['Content-Type'], response.content), self.cache_timeout)
+        return response
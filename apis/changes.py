@@ -0,0 +1,66 @@
+from django.db import connections, router, transaction
+
+from apis.models import PatientRecords, RecordChange
+from apis.serializers import PatientRecordSerializer
+
+# Change log behind the delta sync feed (PatientRecordChangesView). Triggers
+# on apis_patientrecords give every insert, update and delete of a record the
+# next sequence number in apis_recordchange, including bulk_create,
+# generate_data's executemany and the purge's raw deletes. There is one row
+# per record and department, so the table grows with the records, not with
+# the writes, and a poll reads only the changes after its token through the
+# (department_id, seq) index.
+#
+# SQLite runs one write transaction at a time and the sequence is taken
+# inside it, so changes become visible in sequence order and a client never
+# skips one by holding a later token. Like the search index this is SQLite
+# only. The triggers are created by migration 0010; a migration that rebuilds
+# apis_patientrecords drops them and must create them again.
+TABLE = RecordChange._meta.db_table
+
+_UPSERT = 'ON CONFLICT(record_id, department_id) DO UPDATE SET seq = excluded.seq, deleted = excluded.deleted'
+
+
+def log_patient_deleted(patient_id, using):
+    """
+    Tombstones every record of a patient being soft-deleted: the rows stay
+    until the purge, so no trigger fires, but the records are gone from the
+    feeds at once.
+    """
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {TABLE}(record_id, department_id, seq, deleted) '
+            f'SELECT id, department_id, (SELECT COALESCE(MAX(seq), 0) FROM {TABLE}) + ROW_NUMBER() OVER (ORDER BY id), 1 '
+            f'FROM apis_patientrecords WHERE patient_id = %s {_UPSERT}',
+            [patient_id],
+        )
+
+
+def changes_since(department_id, since, limit, fields=None):
+    """
+    Reads up to limit changes of a department's records after sequence
+    number since, oldest first. Returns (records, deleted_ids, last_seq,
+    more): the changed records as they are now, and the ids deleted.
+
+    Both reads use one database and one snapshot, so every change read has
+    its record (a record deleted since then has a tombstone instead).
+    """
+    using = router.db_for_read(RecordChange)
+    with transaction.atomic(using=using):
+        changes = list(
+            RecordChange.objects.using(using).filter(department_id=department_id, seq__gt=since)
+            .order_by('seq').values_list('record_id', 'seq', 'deleted')[:limit + 1]
+        )
+        more = len(changes) > limit
+        changes = changes[:limit]
+        changed = [record_id for record_id, _, deleted in changes if not deleted]
+        records = PatientRecords.objects.using(using).filter(department_id=department_id, pk__in=changed)
+        records = {record.pk: record for record in PatientRecordSerializer.restrict_queryset(records, fields)}
+
+    deleted = [record_id for record_id, _, is_deleted in changes if is_deleted]
+    last_seq = changes[-1][1] if changes else since
+    # A record hidden with its patient has a tombstone from the same transaction
+    return [records[record_id] for record_id in changed if record_id in records], deleted, last_seq, more
@@ -0,0 +1,36 @@
+import hashlib
+
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+
+def make_etag(*parts):
+    return '"%s"' % hashlib.md5(':'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+
+class ConditionalGetMixin:
+    """
+    ETag / Last-Modified support for APIViews whose validators come from a
+    cheap query rather than from the rendered body.
+
+    A view computes its validators first and calls `not_modified()`; when the
+    client's If-None-Match / If-Modified-Since still match, it returns that
+    304 straight away and never builds the payload. Otherwise the validators
+    are attached to the final response by `finalize_response`.
+    """
+
+    def not_modified(self, request, etag=None, last_modified=None):
+        self.etag = etag
+        self.last_modified = int(last_modified.timestamp()) if last_modified else None
+        return get_conditional_response(request, etag=self.etag, last_modified=self.last_modified)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if request.method in ('GET', 'HEAD') and response.status_code in (200, 304):
+            if getattr(self, 'etag', None):
+                response['ETag'] = self.etag
+            if getattr(self, 'last_modified', None):
+                response['Last-Modified'] = http_date(self.last_modified)
+            # Clients may keep the body but must revalidate before using it
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
@@ -0,0 +1,35 @@
+from django.conf import settings
+
+from apis.fields import decompress
+
+
+def apply_pragmas(cursor, pragmas):
+    for name, value in pragmas.items():
+        cursor.execute(f'PRAGMA {name} = {value}')
+
+
+def configure_connection(connection):
+    """
+    Applies settings.SQLITE_PRAGMAS to a new SQLite connection. WAL lets
+    readers carry on while a writer commits, busy_timeout makes a writer wait
+    for the lock instead of failing with 'database is locked', and the cache
+    and mmap sizes keep more of the working set in memory.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        apply_pragmas(cursor, settings.SQLITE_PRAGMAS)
+    register_functions(connection.connection)
+
+
+def register_functions(sqlite_connection):
+    """
+    Registers the SQL functions the schema depends on on a sqlite3
+    connection. The search index triggers on apis_patientrecords call
+    apis_decompress() to index the compressed texts, so without it every
+    INSERT, UPDATE and DELETE of a record fails with "no such function".
+    Django's connections get it from configure_connection; scripts opening
+    the database with the sqlite3 module must call this first, and the
+    sqlite3 CLI (manage.py dbshell) cannot write records at all.
+    """
+    sqlite_connection.create_function('apis_decompress', 1, decompress, deterministic=True)
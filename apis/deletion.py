@@ -0,0 +1,84 @@
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+from apis import events, stats
+from apis.changes import log_patient_deleted
+from apis.models import User, DoctorProfile, PatientProfile, PatientRecords
+
+# Deleting a patient with Model.delete() makes Django's collector load every
+# one of their records before deleting them, all inside the request and
+# while holding SQLite's write lock. Instead the API only marks the patient
+# and their user as deleted, which hides both from every `objects` query
+# (see SoftDeleteManager), and the purge_deleted command removes the rows
+# later in small batches. The patient's records are hidden at once as well:
+# PatientRecords.objects leaves them out, and they are tombstoned in the
+# change log so the sync feed and the event streams report them deleted.
+
+
+def soft_delete_patient(patient):
+    now = timezone.now()
+    user = patient.user
+    with transaction.atomic():
+        # save() rather than update(), so the caches are evicted and bumped
+        patient.deleted_at = now
+        patient.save(update_fields=['deleted_at'])
+        user.deleted_at = now
+        user.save(update_fields=['deleted_at'])
+        # No longer counted; the post_delete from the purge is skipped
+        stats.adjust_department(patient.department_id, patients=-1)
+        log_patient_deleted(patient.pk, router.db_for_write(PatientRecords))
+        transaction.on_commit(events.notify)
+
+
+def delete_records_batch(field, value, batch_size):
+    """
+    Deletes up to batch_size records where field = value in one short
+    transaction, with a raw DELETE so the collector stays out of it.
+    Returns the number of rows deleted.
+    """
+    using = router.db_for_write(PatientRecords)
+    with transaction.atomic(using=using):
+        rows = list(PatientRecords.all_objects.using(using).filter(**{field: value})
+                    .values_list('id', 'department_id', 'created_date')[:batch_size])
+        if not rows:
+            return 0
+        with connections[using].cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {PatientRecords._meta.db_table} WHERE id IN ({", ".join(["%s"] * len(rows))})',
+                [row[0] for row in rows],
+            )
+        # The FTS triggers see the DELETE, the department stats need telling
+        stats.apply_record_counts([row[1:] for row in rows], -1)
+    return len(rows)
+
+
+def purge_user(user, batch_size=500, on_batch=None):
+    """
+    Hard-deletes a soft-deleted user: first their records in batches, then,
+    with nothing left to cascade to, the user and their profile.
+    """
+    owners = [
+        ('patient_id', PatientProfile.all_objects.filter(user=user).values_list('pk', flat=True).first()),
+        ('doctor_id', DoctorProfile.objects.filter(user=user).values_list('pk', flat=True).first()),
+    ]
+    deleted = 0
+    for field, value in owners:
+        if value is None:
+            continue
+        while True:
+            count = delete_records_batch(field, value, batch_size)
+            if not count:
+                break
+            deleted += count
+            if on_batch is not None:
+                on_batch(count)
+    with transaction.atomic():
+        user.delete()
+    return deleted
+
+
+def users_to_purge(older_than=None):
+    users = User.all_objects.filter(deleted_at__isnull=False)
+    if older_than is not None:
+        users = users.filter(deleted_at__lte=timezone.now() - older_than)
+    return users.order_by('deleted_at')
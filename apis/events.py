@@ -0,0 +1,233 @@
+import asyncio
+import logging
+import threading
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import router, transaction
+from django.db.models import Max
+from django.utils.module_loading import import_string
+
+from apis.models import PatientRecords, RecordChange
+from apis.renderers import dumps
+from apis.serializers import PatientRecordSerializer
+
+logger = logging.getLogger(__name__)
+
+# Server-sent events for new, changed and deleted records, streamed by
+# RecordEventStreamView under greylabs.asgi.
+#
+# Events are read from the change log (apis/changes.py), so an event's id is
+# the change's sequence number and a client reconnecting with Last-Event-ID
+# resumes exactly where it stopped. Each process has one EventHub. When woken,
+# the hub reads the log once for all its subscribers, past the last change it
+# has seen, and fans the events out to per-subscriber queues by department.
+# A write therefore costs one query per process, however many clients listen.
+#
+# Saves and deletes in this process wake the hub on commit (see
+# apis/signals.py). What else wakes it is up to settings.EVENTS_BACKEND:
+# LocalBackend relies on those local wakes alone, PollingBackend also checks
+# the log every EVENTS_POLL_INTERVAL seconds, which picks up writes made by
+# the other workers and by management commands. Both need no broker. A
+# backend over a message broker would publish in notify() and wake the hub
+# from listen().
+
+EVENT_BATCH_SIZE = 500
+
+
+class RecordEvent:
+    __slots__ = ('seq', 'department_id', 'name', 'data')
+
+    def __init__(self, seq, department_id, name, data):
+        self.seq = seq
+        self.department_id = department_id
+        self.name = name
+        self.data = data
+
+    def encode(self):
+        return b'id: %d\nevent: %s\ndata: %s\n\n' % (self.seq, self.name.encode(), dumps(self.data))
+
+
+class Subscription:
+    def __init__(self, hub, department_id):
+        self.hub = hub
+        self.department_id = department_id
+        self.queue = asyncio.Queue(maxsize=settings.EVENTS_QUEUE_SIZE)
+        # The hub re-reads the log after a department joins, so an event can
+        # come round twice
+        self.last_seq = 0
+
+    def put(self, event):
+        if event.seq <= self.last_seq:
+            return
+        self.last_seq = event.seq
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # A client this far behind is cut off and resumes from the log
+            # with Last-Event-ID. Everything queued goes, so that is the last
+            # event it actually received
+            self.close()
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+    async def get(self, timeout):
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+
+class EventHub:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.loop = None
+        self.subscribers = {}
+        self.last_seq = 0
+        # Where the next read must start at the latest, see subscribe()
+        self.rewind = None
+        self.wakeup = None
+        self.started = None
+        self.tasks = []
+
+    def wake(self):
+        # Safe from any thread; does nothing while nobody is subscribed
+        with self.lock:
+            loop, wakeup = self.loop, self.wakeup
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(wakeup.set)
+
+    async def subscribe(self, department_id):
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            # First subscriber, or the loop the hub ran on has gone. Claimed
+            # before the first await, so clients connecting at once share
+            # one start instead of each resetting the hub.
+            with self.lock:
+                self.loop, self.wakeup = loop, asyncio.Event()
+            self.subscribers, self.rewind, self.tasks = {}, None, []
+            self.started = loop.create_task(self.start())
+        elif department_id not in self.subscribers:
+            # A read in flight leaves this department out but may move
+            # last_seq past its changes; the next read starts no later than
+            # here, which is before anything the client has seen
+            self.rewind = self.last_seq if self.rewind is None else min(self.rewind, self.last_seq)
+
+        subscription = Subscription(self, department_id)
+        self.subscribers.setdefault(department_id, set()).add(subscription)
+        try:
+            # The stream reads its own starting point only after this
+            await asyncio.shield(self.started)
+        except BaseException:
+            subscription.close()
+            raise
+        return subscription
+
+    async def start(self):
+        self.last_seq = await sync_to_async(latest_seq)()
+        loop = asyncio.get_running_loop()
+        self.tasks = [loop.create_task(self.run()), loop.create_task(get_backend().listen(self))]
+
+    def unsubscribe(self, subscription):
+        subscribers = self.subscribers.get(subscription.department_id)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self.subscribers[subscription.department_id]
+        if not self.subscribers and self.loop is not None:
+            for task in [self.started, *self.tasks]:
+                task.cancel()
+            with self.lock:
+                self.loop = self.wakeup = None
+            self.started, self.tasks = None, []
+
+    async def run(self):
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            try:
+                await self.dispatch()
+            except Exception:
+                logger.exception('Reading record changes for the event streams failed')
+
+    async def dispatch(self):
+        while self.subscribers:
+            self.rewind = None
+            events, last_seq, more = await sync_to_async(read_events)(list(self.subscribers), self.last_seq)
+            if self.rewind is not None:
+                last_seq, more = min(last_seq, self.rewind), True
+            self.last_seq = last_seq
+            for event in events:
+                for subscription in list(self.subscribers.get(event.department_id, ())):
+                    subscription.put(event)
+            if not more:
+                return
+
+
+def latest_seq():
+    changes = RecordChange.objects.using(router.db_for_write(RecordChange))
+    return changes.aggregate(seq=Max('seq'))['seq'] or 0
+
+
+def read_events(department_ids, after):
+    """
+    Reads the changes after sequence number after in the given departments,
+    as events. Returns (events, last_seq, more). Reads the primary, replicas
+    may not have the change yet.
+    """
+    using = router.db_for_write(RecordChange)
+    with transaction.atomic(using=using):
+        changes = list(
+            RecordChange.objects.using(using).filter(seq__gt=after, department_id__in=department_ids)
+            .order_by('seq').values_list('record_id', 'department_id', 'seq', 'deleted')[:EVENT_BATCH_SIZE + 1]
+        )
+        more = len(changes) > EVENT_BATCH_SIZE
+        changes = changes[:EVENT_BATCH_SIZE]
+        if more:
+            last_seq = changes[-1][2]
+        else:
+            # Past the other departments' changes too, so they are not scanned again
+            last_seq = max(after, RecordChange.objects.using(using).aggregate(seq=Max('seq'))['seq'] or 0)
+        changed = [record_id for record_id, _, _, deleted in changes if not deleted]
+        records = PatientRecords.objects.using(using).in_bulk(changed)
+
+    events = [RecordEvent(seq, department_id, 'deleted', {'id': record_id})
+              for record_id, department_id, seq, deleted in changes if deleted]
+    live = [(seq, department_id, records[record_id])
+            for record_id, department_id, seq, deleted in changes if not deleted and record_id in records]
+    data = PatientRecordSerializer([record for _, _, record in live], many=True).data
+    events.extend(RecordEvent(seq, department_id, 'record', item) for (seq, department_id, _), item in zip(live, data))
+    events.sort(key=lambda event: event.seq)
+    return events, last_seq, more
+
+
+class LocalBackend:
+    """Only wakes the hub for writes made by this process."""
+
+    def notify(self, hub):
+        hub.wake()
+
+    async def listen(self, hub):
+        pass
+
+
+class PollingBackend(LocalBackend):
+    """Also wakes the hub every EVENTS_POLL_INTERVAL seconds, for writes by other processes."""
+
+    async def listen(self, hub):
+        while True:
+            await asyncio.sleep(settings.EVENTS_POLL_INTERVAL)
+            hub.wake()
+
+
+hub = EventHub()
+
+
+def get_backend():
+    return import_string(settings.EVENTS_BACKEND)()
+
+
+def notify():
+    """Called once a transaction that wrote records has committed."""
+    get_backend().notify(hub)
@@ -0,0 +1,91 @@
+import csv
+import datetime
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from apis.fields import CompressedValue, decompress
+from apis.models import PatientRecords
+from apis.renderers import dumps
+
+EXPORT_FIELDS = ['id', 'patient', 'doctor', 'department', 'created_date',
+                 'diagnostics', 'observations', 'treatments', 'misc']
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+CHUNK_SIZE = 2000
+
+
+def parse_bound(value):
+    """
+    Parses a created_date bound given as an ISO datetime or date.
+    Returns None when the value is not valid.
+    """
+    try:
+        parsed = parse_datetime(value)
+        if parsed is None:
+            date = parse_date(value)
+            if date is None:
+                return None
+            parsed = datetime.datetime.combine(date, datetime.time.min)
+    except ValueError:
+        return None
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, datetime.timezone.utc)
+    return parsed
+
+
+def export_queryset(department_id, since=None, until=None):
+    records = PatientRecords.objects.filter(department_id=department_id)
+    if since is not None:
+        records = records.filter(created_date__gte=since)
+    if until is not None:
+        records = records.filter(created_date__lt=until)
+    # values_list skips model instantiation; the column names are the FK names
+    columns = [field if field not in ('patient', 'doctor', 'department') else f'{field}_id' for field in EXPORT_FIELDS]
+    return records.order_by('created_date', 'id').values_list(*columns)
+
+
+def decode_row(row):
+    # values_list hands back the compressed texts as stored
+    return [decompress(value) if isinstance(value, CompressedValue) else value for value in row]
+
+
+class Echo:
+    # File-like object whose write() hands the line back to the caller
+    def write(self, value):
+        return value
+
+
+def iter_csv(rows, chunk_size=CHUNK_SIZE):
+    writer = csv.writer(Echo())
+    # The header goes out before the query has produced a row
+    yield writer.writerow(EXPORT_FIELDS)
+    buffer = []
+    for row in rows.iterator(chunk_size=chunk_size):
+        buffer.append(writer.writerow([value.isoformat() if hasattr(value, 'isoformat') else value for value in decode_row(row)]))
+        if len(buffer) >= chunk_size:
+            yield ''.join(buffer)
+            buffer = []
+    if buffer:
+        yield ''.join(buffer)
+
+
+def iter_ndjson(rows, chunk_size=CHUNK_SIZE):
+    buffer = []
+    for row in rows.iterator(chunk_size=chunk_size):
+        buffer.append(dumps(dict(zip(EXPORT_FIELDS, decode_row(row)))))
+        if len(buffer) >= chunk_size:
+            buffer.append(b'')
+            yield b'\n'.join(buffer)
+            buffer = []
+    if buffer:
+        buffer.append(b'')
+        yield b'\n'.join(buffer)
+
+
+def iter_export(rows, export_format, chunk_size=CHUNK_SIZE):
+    if export_format == 'csv':
+        return iter_csv(rows, chunk_size)
+    return iter_ndjson(rows, chunk_size)
@@ -0,0 +1,145 @@
+import zlib
+
+from django.conf import settings
+from django.db import models
+from django.db.models.query_utils import DeferredAttribute
+
+# Stored values start with a one-byte tag naming the codec that wrote them,
+# so rows written with different codecs (or before a codec change) can all
+# be read back. Text that does not get smaller is stored under 'p'.
+
+
+class PlainCodec:
+    name = 'plain'
+    tag = b'p'
+
+    def compress(self, data):
+        return data
+
+    def decompress(self, data):
+        return data
+
+
+class ZlibCodec:
+    # Raw deflate, without zlib's header and checksum: 6 bytes matter on short texts
+    name = 'zlib'
+    tag = b'z'
+    level = 6
+
+    def compress(self, data):
+        return zlib.compress(data, self.level, wbits=-15)
+
+    def decompress(self, data):
+        return zlib.decompress(data, wbits=-15)
+
+
+CODECS = {}
+
+
+def register_codec(codec):
+    """Makes a codec (an object with name, a one-byte tag, compress and decompress) available."""
+    CODECS[codec.tag] = codec
+    return codec
+
+
+register_codec(PlainCodec())
+register_codec(ZlibCodec())
+
+
+def get_codec(name):
+    for codec in CODECS.values():
+        if codec.name == name:
+            return codec
+    raise ValueError(f'Unknown compression codec {name!r}')
+
+
+def compress(text, codec):
+    data = text.encode('utf-8')
+    packed = codec.compress(data)
+    if len(packed) >= len(data):
+        return PlainCodec.tag + data
+    return codec.tag + packed
+
+
+def decompress(value):
+    # Rows not yet converted by migration 0009 still hold plain text
+    if value is None or isinstance(value, str):
+        return value
+    value = bytes(value)
+    return CODECS[value[:1]].decompress(value[1:]).decode('utf-8')
+
+
+class CompressedValue(bytes):
+    """The stored bytes of a compressed field, not decompressed yet."""
+
+
+class CompressedTextDescriptor(DeferredAttribute):
+    # A data descriptor, so every attribute access passes through __get__
+    def __get__(self, instance, cls=None):
+        if instance is None:
+            return self
+        value = super().__get__(instance, cls)
+        if isinstance(value, CompressedValue):
+            value = instance.__dict__[self.field.attname] = decompress(value)
+        return value
+
+    def __set__(self, instance, value):
+        instance.__dict__[self.field.attname] = value
+
+
+class CompressedTextField(models.TextField):
+    """
+    A TextField stored compressed as a BLOB. Text is compressed on save and
+    decompressed on first attribute access; a loaded value that is never read
+    is saved back as the same bytes. values()/values_list() return the
+    CompressedValue, pass it to decompress().
+
+    The codec defaults to settings.COMPRESSED_TEXT_CODEC.
+    """
+    descriptor_class = CompressedTextDescriptor
+
+    def __init__(self, *args, codec=None, **kwargs):
+        self.codec_name = codec
+        super().__init__(*args, **kwargs)
+
+    @property
+    def codec(self):
+        return get_codec(self.codec_name or settings.COMPRESSED_TEXT_CODEC)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if self.codec_name is not None:
+            kwargs['codec'] = self.codec_name
+        return name, path, args, kwargs
+
+    def get_internal_type(self):
+        return 'BinaryField'
+
+    def from_db_value(self, value, expression, connection):
+        if value is None or isinstance(value, str):
+            return value
+        return CompressedValue(value)
+
+    def to_python(self, value):
+        if isinstance(value, CompressedValue):
+            return decompress(value)
+        return super().to_python(value)
+
+    def pre_save(self, model_instance, add):
+        # The raw value, reading the attribute would decompress it
+        return model_instance.__dict__.get(self.attname)
+
+    def get_prep_value(self, value):
+        if value is None or isinstance(value, CompressedValue):
+            return value
+        return compress(str(value), self.codec)
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if not prepared:
+            value = self.get_prep_value(value)
+        if value is not None:
+            return connection.Database.Binary(value)
+        return value
+
+    def value_to_string(self, obj):
+        return self.value_from_object(obj)
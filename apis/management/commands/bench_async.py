@@ -0,0 +1,99 @@
+import asyncio
+import statistics
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.tokens import AccessToken
+
+from apis.models import DoctorProfile, PatientRecords
+
+
+class Command(BaseCommand):
+    help = ('Drive the ASGI application in-process with concurrent requests and compare the sync views '
+            'with their /async/ counterparts on one event loop (a single ASGI worker).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=400, help='Requests per path and concurrency level.')
+        parser.add_argument('--concurrency', default='1,8,32,64', help='Comma separated concurrency levels.')
+        parser.add_argument('--path', action='append', dest='paths',
+                            help='Sync path to compare (repeatable). Defaults to the record feed and a record detail.')
+
+    def handle(self, *args, **options):
+        doctor = DoctorProfile.objects.select_related('user').exclude(department=None).first()
+        if doctor is None:
+            raise CommandError('Needs at least one doctor with a department, e.g. from generate_data.')
+        paths = options['paths']
+        if not paths:
+            record = PatientRecords.objects.filter(department_id=doctor.department_id).first()
+            paths = ['/patient_records/?page_size=50'] + ([f'/patient_records/{record.pk}/'] if record else [])
+
+        token = str(AccessToken.for_user(doctor.user))
+        levels = [int(level) for level in options['concurrency'].split(',')]
+        asyncio.run(self.run(paths, token, levels, options['requests']))
+
+    async def run(self, paths, token, levels, count):
+        app = get_asgi_application()
+        host = settings.ALLOWED_HOSTS[0] if settings.ALLOWED_HOSTS else 'localhost'
+        headers = [(b'host', host.encode()), (b'authorization', f'Bearer {token}'.encode())]
+
+        # The ORM cannot be used from the event loop thread, close the connection
+        # opened while picking a doctor so requests open their own
+        await sync_to_async(self.close_connection)()
+
+        self.stdout.write(f'{"path":<45}{"concurrency":>12}{"req/s":>10}{"p50 ms":>10}{"p95 ms":>10}')
+        for path in paths:
+            for variant in (path, '/async' + path):
+                await self.call(app, variant, headers)  # warm up caches
+                for level in levels:
+                    throughput, latencies = await self.measure(app, variant, headers, level, count)
+                    self.stdout.write(f'{variant:<45}{level:>12}{throughput:>10.0f}'
+                                      f'{statistics.median(latencies) * 1000:>10.1f}'
+                                      f'{statistics.quantiles(latencies, n=20)[-1] * 1000:>10.1f}')
+
+    def close_connection(self):
+        from django.db import connections
+        connections.close_all()
+
+    async def measure(self, app, path, headers, concurrency, count):
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+
+        async def one():
+            async with semaphore:
+                started = time.perf_counter()
+                await self.call(app, path, headers)
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(count)))
+        return count / (time.perf_counter() - started), latencies
+
+    async def call(self, app, path, headers):
+        path, _, query = path.partition('?')
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+            'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': query.encode(),
+            'root_path': '', 'headers': headers, 'server': ('localhost', 80), 'client': ('127.0.0.1', 0),
+        }
+        received = False
+        status = None
+
+        async def receive():
+            nonlocal received
+            if not received:
+                received = True
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            # The client never disconnects
+            await asyncio.Event().wait()
+
+        async def send(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+
+        await app(scope, receive, send)
+        if status != 200:
+            raise CommandError(f'GET {path} returned {status}')
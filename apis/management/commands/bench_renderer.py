@@ -0,0 +1,53 @@
+import json
+import timeit
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from rest_framework.response import Response
+
+from apis.models import PatientRecords
+from apis.renderers import UserRenderer, orjson
+from apis.serializers import PatientRecordSerializer
+
+
+def legacy_render(data):
+    # UserRenderer.render as it was before the single-pass rewrite
+    if 'ErrorDetail' in str(data):
+        return json.dumps({'errors': data})
+    return json.dumps(data)
+
+
+class Command(BaseCommand):
+    help = 'Compare the JSON renderer against the legacy str()+json.dumps renderer on large record lists.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000, help='Number of records in the payload.')
+        parser.add_argument('--text-size', type=int, default=400, help='Characters per text column.')
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs per renderer; the best is reported.')
+
+    def build_payload(self, rows, text_size):
+        # Unsaved instances are enough, the serializer only reads attributes
+        text = ('Lorem ipsum dolor sit amet, consectetur adipiscing elit. ' * (text_size // 56 + 1))[:text_size]
+        now = timezone.now()
+        records = [
+            PatientRecords(id=i, patient_id=i % 500, doctor_id=i % 50, department_id=i % 10, created_date=now,
+                           diagnostics=text, observations=text, treatments=text, misc=text)
+            for i in range(rows)
+        ]
+        return PatientRecordSerializer(records, many=True).data
+
+    def handle(self, *args, **options):
+        data = self.build_payload(options['rows'], options['text_size'])
+        renderer = UserRenderer()
+        context = {'response': Response(data)}
+
+        legacy = min(timeit.repeat(lambda: legacy_render(data), number=1, repeat=options['repeat']))
+        current = min(timeit.repeat(lambda: renderer.render(data, renderer_context=context),
+                                    number=1, repeat=options['repeat']))
+        size = len(renderer.render(data, renderer_context=context))
+
+        self.stdout.write(f"{options['rows']} records, {size / 1024 / 1024:.1f} MiB rendered")
+        self.stdout.write(f'legacy:  {legacy * 1000:.1f} ms')
+        self.stdout.write(f"current: {current * 1000:.1f} ms ({'orjson' if orjson is not None else 'json'} backend)")
+        self.stdout.write(f'speedup: {legacy / current:.1f}x')
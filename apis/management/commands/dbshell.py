@@ -0,0 +1,12 @@
+from django.core.management.commands.dbshell import Command as DbShellCommand
+from django.db import connections
+
+
+class Command(DbShellCommand):
+    def handle(self, **options):
+        # The sqlite3 CLI lacks apis_decompress(), see apis.db.register_functions
+        if connections[options['database']].vendor == 'sqlite':
+            self.stderr.write(self.style.WARNING(
+                'Records cannot be written from this shell: the search index triggers on apis_patientrecords '
+                'call apis_decompress(), which only Django registers. Use manage.py shell for writes.'))
+        super().handle(**options)
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from apis.models import User, Department, DoctorProfile, PatientProfile, PatientRecords
+from apis.serializers import DoctorListSerializer, PatientListSerializer
+
+
+class Command(BaseCommand):
+    help = "Print the query plan of each view's main query, to check the planner uses the indexes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--department', type=int, help='Department id to plan against (defaults to the first one).')
+        parser.add_argument('--patient', type=int, help='Patient profile id to plan against (defaults to the first one).')
+
+    def get_queries(self, department_id, patient_id):
+        # Mirrors the querysets built in apis/views.py
+        return [
+            ('DepartmentListCreateView.get', Department.objects.all()),
+            ('DoctorListView.get', DoctorListSerializer.setup_eager_loading(DoctorProfile.objects.all())),
+            ('PatientListView.get', PatientListSerializer.setup_eager_loading(PatientProfile.objects.all())),
+            ('PatientRecordView.get',
+             PatientRecords.objects.filter(department_id=department_id).order_by('created_date', 'id')[:101]),
+            ('PatientRecords by patient',
+             PatientRecords.objects.filter(patient_id=patient_id).order_by('created_date')),
+            ('DepartmentDoctorListView.get',
+             DoctorListSerializer.setup_eager_loading(
+                 DoctorProfile.objects.filter(department_id=department_id)).order_by('id')[:101]),
+            ('DepartmentPatientListView.get',
+             PatientListSerializer.setup_eager_loading(
+                 PatientProfile.objects.filter(department_id=department_id)).order_by('id')[:101]),
+            ('User by name', User.objects.filter(name='')),
+        ]
+
+    def handle(self, *args, **options):
+        department_id = options['department'] or Department.objects.values_list('pk', flat=True).first() or 0
+        patient_id = options['patient'] or PatientProfile.objects.values_list('pk', flat=True).first() or 0
+
+        self.stdout.write(f'Query plans on {connection.vendor} (department={department_id}, patient={patient_id})')
+        for name, queryset in self.get_queries(department_id, patient_id):
+            self.stdout.write('')
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            self.stdout.write(queryset.explain())
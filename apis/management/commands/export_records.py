@@ -0,0 +1,40 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apis.export import EXPORT_FORMATS, export_queryset, iter_export, parse_bound
+from apis.models import Department
+
+
+class Command(BaseCommand):
+    help = "Stream a department's patient records as NDJSON or CSV."
+
+    def add_arguments(self, parser):
+        parser.add_argument('department', type=int, help='Department id.')
+        parser.add_argument('--output-format', choices=list(EXPORT_FORMATS), default='ndjson')
+        parser.add_argument('--since', help='Only records created at or after this ISO date/datetime.')
+        parser.add_argument('--until', help='Only records created before this ISO date/datetime.')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+        parser.add_argument('-o', '--output', help='File to write to (defaults to stdout).')
+
+    def handle(self, *args, **options):
+        if not Department.objects.filter(pk=options['department']).exists():
+            raise CommandError(f"Department {options['department']} does not exist.")
+
+        bounds = {}
+        for param in ('since', 'until'):
+            if options[param]:
+                bounds[param] = parse_bound(options[param])
+                if bounds[param] is None:
+                    raise CommandError(f'Invalid --{param} date.')
+
+        rows = export_queryset(options['department'], **bounds)
+        out = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        try:
+            for chunk in iter_export(rows, options['output_format'], options['chunk_size']):
+                out.write(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+        finally:
+            if options['output']:
+                out.close()
+            else:
+                out.flush()
@@ -0,0 +1,203 @@
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, router, transaction
+
+from apis.cache import bump_version
+from apis.fields import compress
+from apis.models import User, Department, DoctorProfile, PatientProfile, PatientRecords
+from apis.search import deferred_index
+from apis.stats import reconcile
+
+SPECIALIZATIONS = [
+    'Cardiology', 'Neurology', 'Oncology', 'Orthopedics', 'Pediatrics', 'Dermatology', 'Gastroenterology',
+    'Nephrology', 'Pulmonology', 'Endocrinology', 'Rheumatology', 'Urology', 'Ophthalmology', 'Psychiatry',
+    'Radiology', 'Hematology', 'Geriatrics', 'Obstetrics', 'Otolaryngology', 'Emergency Medicine',
+]
+DIAGNOSTICS = ['ECG', 'MRI', 'CT scan', 'X-ray', 'ultrasound', 'blood panel', 'biopsy', 'EEG', 'spirometry',
+               'urinalysis', 'endoscopy', 'echocardiogram', 'lipid profile', 'HbA1c', 'thyroid panel']
+FIRST_NAMES = ['Aarav', 'Maya', 'Liam', 'Olivia', 'Noah', 'Emma', 'Arjun', 'Sofia', 'Ethan', 'Zara', 'Lucas',
+               'Amara', 'Mateo', 'Priya', 'Leo', 'Chloe', 'Omar', 'Isla', 'Kenji', 'Nadia']
+LAST_NAMES = ['Sharma', 'Smith', 'Garcia', 'Chen', 'Okafor', 'Müller', 'Silva', 'Kim', 'Patel', 'Nguyen',
+              'Johnson', 'Rossi', 'Haddad', 'Kowalski', 'Tanaka', 'Brown', 'Ivanova', 'Mensah', 'Lopez', 'Singh']
+FINDINGS = ['chest pain', 'shortness of breath', 'persistent cough', 'headache', 'fatigue', 'fever', 'dizziness',
+            'joint pain', 'lower back pain', 'abdominal pain', 'rash', 'palpitations', 'nausea', 'insomnia',
+            'elevated blood pressure', 'high blood sugar', 'swelling of the ankles', 'blurred vision',
+            'weight loss', 'numbness in the left arm']
+OBSERVATIONS = ['stable vitals', 'mild tachycardia', 'normal reflexes', 'tenderness on palpation',
+                'reduced range of motion', 'clear lungs', 'wheezing on expiration', 'pale skin', 'afebrile',
+                'irregular heartbeat', 'elevated temperature', 'no acute distress', 'oedema noted']
+TREATMENTS = ['rest and fluids', 'ibuprofen 400mg', 'amoxicillin 500mg', 'physiotherapy', 'metformin 500mg',
+              'lisinopril 10mg', 'follow-up in two weeks', 'referral to specialist', 'inhaler as needed',
+              'low-salt diet', 'further imaging', 'compression stockings', 'cognitive behavioural therapy']
+
+
+def zipf_weights(count, exponent):
+    # The k-th largest department gets a share proportional to 1 / k^exponent
+    return [1 / (rank ** exponent) for rank in range(1, count + 1)]
+
+
+def assign(rng, count, cum_weights):
+    """
+    Department index for each of `count` rows: one per department first, so
+    none is left empty, the rest drawn by weight.
+    """
+    departments = len(cum_weights)
+    guaranteed = list(range(min(count, departments)))
+    return guaranteed + rng.choices(range(departments), cum_weights=cum_weights, k=count - len(guaranteed))
+
+
+class Command(BaseCommand):
+    help = ('Generate a seeded synthetic dataset: departments of Zipf-skewed sizes, doctors, patients and '
+            'patient records, inserted in batches with the search index rebuilt once at the end. The same '
+            'seed and options always produce the same data. All users share one password.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--departments', type=int, default=20)
+        parser.add_argument('--doctors', type=int, default=500)
+        parser.add_argument('--patients', type=int, default=50000)
+        parser.add_argument('--records', type=int, default=1000000)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--skew', type=float, default=1.0,
+                            help='Zipf exponent of department sizes, 0 for equally sized departments.')
+        parser.add_argument('--start', default='2022-01-01', help='Date of the first record.')
+        parser.add_argument('--days', type=int, default=730, help='Days the records are spread over.')
+        parser.add_argument('--batch-size', type=int, default=10000, help='Rows per transaction.')
+        parser.add_argument('--password', default='password')
+
+    def handle(self, *args, **options):
+        if options['departments'] < 1:
+            raise CommandError('--departments must be at least 1.')
+        if options['records'] and not (options['doctors'] and options['patients']):
+            raise CommandError('Records need at least one doctor and one patient.')
+        self.rng = random.Random(options['seed'])
+        self.seed = options['seed']
+        self.batch_size = options['batch_size']
+        self.start = datetime.fromisoformat(options['start']).replace(tzinfo=timezone.utc)
+        self.span = timedelta(days=options['days'])
+
+        # Emails embed the seed, run again with another seed to add more data
+        if User.all_objects.filter(email=self.email('doctor', 0)).exists():
+            raise CommandError(f'Data for seed {self.seed} already exists, pass another --seed.')
+
+        started = time.monotonic()
+        cum_weights = list(accumulate(zipf_weights(options['departments'], options['skew'])))
+        password = make_password(options['password'])
+
+        departments = self.create_departments(options['departments'])
+        doctors = self.create_users('Doctor', DoctorProfile, options['doctors'], departments, cum_weights, password)
+        patients = self.create_users('Patient', PatientProfile, options['patients'], departments, cum_weights, password)
+        with deferred_index():
+            self.create_records(options['records'], departments, doctors, patients)
+
+        # None of the inserts sent post_save: bump the list caches and count
+        # the department stats ourselves
+        for model in (User, Department, DoctorProfile, PatientProfile):
+            bump_version(model._meta.label_lower)
+        reconcile()
+
+        elapsed = time.monotonic() - started
+        total = options['departments'] + 2 * (options['doctors'] + options['patients']) + options['records']
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated {total} rows in {elapsed:.1f}s ({total / elapsed if elapsed else 0:.0f} rows/s)'))
+
+    def email(self, role, index):
+        return f'{role}{index}.s{self.seed}@example.com'
+
+    def timestamp(self, fraction):
+        return self.start + self.span * fraction
+
+    def create_departments(self, count):
+        departments = []
+        for i in range(count):
+            specialization = SPECIALIZATIONS[i % len(SPECIALIZATIONS)]
+            departments.append(Department(
+                name=specialization if i < len(SPECIALIZATIONS) else f'{specialization} {i // len(SPECIALIZATIONS) + 1}',
+                diagnostics=', '.join(self.rng.sample(DIAGNOSTICS, 3)),
+                location=f'Block {chr(65 + i % 26)}, Floor {i // 26 + 1}',
+                specialization=specialization,
+            ))
+        Department.objects.bulk_create(departments)
+        return [department.pk for department in departments]
+
+    def create_users(self, role, profile_model, count, departments, cum_weights, password):
+        """
+        Creates the users and, as create_user_profile would, their profiles.
+        Returns the profile ids of each department, by department index.
+        """
+        by_department = [[] for _ in departments]
+        assignment = assign(self.rng, count, cum_weights)
+        joined = self.timestamp(0)
+        for offset in range(0, count, self.batch_size):
+            indexes = range(offset, min(offset + self.batch_size, count))
+            users = [User(email=self.email(role.lower(), i), name=f'{self.rng.choice(FIRST_NAMES)} '
+                          f'{self.rng.choice(LAST_NAMES)}', role=role, password=password) for i in indexes]
+            with transaction.atomic():
+                User.objects.bulk_create(users)
+                profiles = [profile_model(user=user, department_id=departments[assignment[i]])
+                            for i, user in zip(indexes, users)]
+                profile_model.objects.bulk_create(profiles)
+                # bulk_create stamps the auto_now fields with the current time;
+                # generated rows carry their own (seeded) timestamps instead. The
+                # write transaction gives the batch consecutive ids.
+                User.objects.filter(pk__range=(users[0].pk, users[-1].pk)).update(
+                    created_at=joined, updated_at=joined)
+                profile_model.objects.filter(pk__range=(profiles[0].pk, profiles[-1].pk)).update(updated_at=joined)
+            for i, profile in zip(indexes, profiles):
+                by_department[assignment[i]].append(profile.pk)
+            self.stdout.write(f'{indexes.stop} {role.lower()}s created')
+        return by_department
+
+    def create_records(self, count, departments, doctors, patients):
+        # Records go to departments by the same skew, but only to ones that
+        # have both doctors and patients
+        usable = [i for i in range(len(departments)) if doctors[i] and patients[i]]
+        if count and not usable:
+            raise CommandError('No department has both doctors and patients, add more of either.')
+        cum_weights = list(accumulate(len(patients[i]) for i in usable))
+
+        # bulk_create prepares every value of every instance through the ORM,
+        # which costs more than SQLite's insert itself at these volumes; the
+        # records go in as plain tuples through executemany instead
+        fields = ['patient_id', 'doctor_id', 'department_id', 'created_date', 'updated_at',
+                  'diagnostics', 'observations', 'treatments', 'misc']
+        connection = connections[router.db_for_write(PatientRecords)]
+        quote = connection.ops.quote_name
+        sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+            quote(PatientRecords._meta.db_table),
+            ', '.join(quote(PatientRecords._meta.get_field(field).column) for field in fields),
+            ', '.join(['%s'] * len(fields)),
+        )
+        adapt = connection.ops.adapt_datetimefield_value
+        # The text columns are stored compressed, see apis.fields
+        codec = PatientRecords._meta.get_field('diagnostics').codec
+
+        rng = self.rng
+        started = time.monotonic()
+        for offset in range(0, count, self.batch_size):
+            size = min(self.batch_size, count - offset)
+            rows = []
+            for i, index in enumerate(rng.choices(usable, cum_weights=cum_weights, k=size), start=offset):
+                # Records arrive in time order, as they would in production
+                created = adapt(self.timestamp(i / count))
+                department_patients = patients[index]
+                department_doctors = doctors[index]
+                rows.append((
+                    department_patients[int(rng.random() * len(department_patients))],
+                    department_doctors[int(rng.random() * len(department_doctors))],
+                    departments[index],
+                    created,
+                    created,
+                    compress(f'{rng.choice(FINDINGS)} with {rng.choice(FINDINGS)}, {rng.choice(DIAGNOSTICS)} ordered', codec),
+                    compress(f'{rng.choice(OBSERVATIONS)}; {rng.choice(OBSERVATIONS)}', codec),
+                    compress(f'{rng.choice(TREATMENTS)}, {rng.choice(TREATMENTS)}', codec),
+                    None,
+                ))
+            with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+                cursor.executemany(sql, rows)
+            done = offset + size
+            self.stdout.write(f'{done} records created ({done / (time.monotonic() - started):.0f} rows/s)')
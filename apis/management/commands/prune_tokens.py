@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections, router, transaction
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.utils import aware_utcnow
+
+
+class Command(BaseCommand):
+    help = ('Delete expired OutstandingToken and BlacklistedToken rows in bounded batches. '
+            'Run it from cron, or keep it running with --every.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--every', type=int, help='Repeat every this many seconds instead of exiting.')
+
+    def prune(self, model, expired, batch_size):
+        # Raw batched deletes keep each write transaction short and skip the
+        # collector, which would load every row first
+        using = router.db_for_write(model)
+        deleted = 0
+        while True:
+            with transaction.atomic(using=using):
+                ids = list(model.objects.using(using).filter(**expired).values_list('id', flat=True)[:batch_size])
+                if not ids:
+                    return deleted
+                with connections[using].cursor() as cursor:
+                    cursor.execute(
+                        f'DELETE FROM {model._meta.db_table} WHERE id IN ({", ".join(["%s"] * len(ids))})', ids)
+            deleted += len(ids)
+
+    def handle(self, *args, **options):
+        while True:
+            now = aware_utcnow()
+            blacklisted = self.prune(BlacklistedToken, {'token__expires_at__lte': now}, options['batch_size'])
+            outstanding = self.prune(OutstandingToken, {'expires_at__lte': now}, options['batch_size'])
+            self.stdout.write(f'Pruned {outstanding} expired outstanding and {blacklisted} blacklisted tokens')
+            if not options['every']:
+                break
+            time.sleep(options['every'])
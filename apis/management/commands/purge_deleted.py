@@ -0,0 +1,38 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from apis.deletion import purge_user, users_to_purge
+
+
+class Command(BaseCommand):
+    help = ('Hard-delete soft-deleted users, their profiles and records. Records go in bounded batches, '
+            'each in its own short transaction, so other writers get the database lock in between. '
+            'With --loop this runs as a background worker.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Records deleted per transaction.')
+        parser.add_argument('--older-than', type=int, default=0, help='Only purge users deleted this many seconds ago.')
+        parser.add_argument('--pause', type=float, default=0.0, help='Seconds to sleep between batches.')
+        parser.add_argument('--loop', action='store_true', help='Keep running, checking every --interval seconds.')
+        parser.add_argument('--interval', type=int, default=60)
+
+    def handle(self, *args, **options):
+        older_than = timedelta(seconds=options['older_than'])
+        while True:
+            self.purge(options['batch_size'], older_than, options['pause'])
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+    def purge(self, batch_size, older_than, pause):
+        def on_batch(count):
+            if pause:
+                time.sleep(pause)
+
+        # Listed up front, the batches below write to the tables being read
+        for user in list(users_to_purge(older_than)):
+            started = time.monotonic()
+            records = purge_user(user, batch_size, on_batch)
+            self.stdout.write(f'Purged user {user.pk} and {records} records in {time.monotonic() - started:.1f}s')
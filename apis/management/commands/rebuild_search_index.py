@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from apis.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild and optimize the FTS5 search index over patient records.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', help='Database alias (defaults to the primary).')
+
+    def handle(self, *args, **options):
+        rebuild_index(options['database'])
+        self.stdout.write(self.style.SUCCESS('Search index rebuilt'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from apis.stats import reconcile
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the department statistics tables from the profiles and records, e.g. after a bulk '
+            'load that bypassed the signals which keep them current.')
+
+    def handle(self, *args, **options):
+        stale, stale_days = reconcile()
+        self.stdout.write(self.style.SUCCESS(
+            f'Department stats rebuilt, {stale} department and {stale_days} daily rows were out of date'))
@@ -0,0 +1,195 @@
+import bisect
+import contextvars
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+
+# Upper bounds of the histogram buckets, +Inf is implied
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# Offsets into a series: request count, latency sum, size count, size sum,
+# query count, query seconds, then the latency and size bucket counts
+COUNT, LATENCY_SUM, SIZE_COUNT, SIZE_SUM, QUERIES, QUERY_TIME = range(6)
+LATENCY_OFFSET = 6
+SIZE_OFFSET = LATENCY_OFFSET + len(LATENCY_BUCKETS) + 1
+SERIES_LENGTH = SIZE_OFFSET + len(SIZE_BUCKETS) + 1
+
+# Query count and time of the request being served, see record_query
+request_metrics = contextvars.ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.query_time = 0.0
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Database execute wrapper, installed on every connection as it opens.
+    The context variable follows a request into sync_to_async threads, so
+    queries made on behalf of the async views are counted too.
+    """
+    current = request_metrics.get()
+    if current is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        current.queries += 1
+        current.query_time += time.perf_counter() - started
+
+
+class MetricsRegistry:
+    """
+    Per-process request statistics keyed by (view, method, status).
+
+    Each thread writes only to its own shard, so recording takes no lock;
+    snapshot() sums the shards when /metrics is scraped. With METRICS_DIR
+    set every worker process also writes its snapshot there, and /metrics
+    adds up the files of all workers, like the multiprocess mode of the
+    Prometheus client.
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+        self.shards = []
+        self.flushed = 0.0
+
+    def shard(self):
+        try:
+            return self.local.shard
+        except AttributeError:
+            self.local.shard = {}
+            self.shards.append(self.local.shard)
+            return self.local.shard
+
+    def observe(self, key, latency, size, queries, query_time):
+        shard = self.shard()
+        series = shard.get(key)
+        if series is None:
+            series = shard[key] = [0] * SERIES_LENGTH
+        series[COUNT] += 1
+        series[LATENCY_SUM] += latency
+        series[LATENCY_OFFSET + bisect.bisect_left(LATENCY_BUCKETS, latency)] += 1
+        if size is not None:
+            series[SIZE_COUNT] += 1
+            series[SIZE_SUM] += size
+            series[SIZE_OFFSET + bisect.bisect_left(SIZE_BUCKETS, size)] += 1
+        series[QUERIES] += queries
+        series[QUERY_TIME] += query_time
+
+    def snapshot(self):
+        merged = {}
+        for shard in list(self.shards):
+            for key, series in list(shard.items()):
+                merge_series(merged, key, series)
+        return merged
+
+    def clear(self):
+        for shard in list(self.shards):
+            shard.clear()
+
+    def maybe_flush(self):
+        directory = settings.METRICS_DIR
+        now = time.monotonic()
+        if not directory or now - self.flushed < settings.METRICS_FLUSH_INTERVAL:
+            return
+        self.flushed = now
+        self.flush(directory)
+
+    def flush(self, directory):
+        data = [[list(key), series] for key, series in self.snapshot().items()]
+        descriptor, path = tempfile.mkstemp(dir=directory, prefix='.metrics-')
+        with os.fdopen(descriptor, 'w') as fh:
+            json.dump(data, fh)
+        os.replace(path, os.path.join(directory, f'metrics-{os.getpid()}.json'))
+
+    def collect(self):
+        """
+        Statistics of all workers. This process contributes its live numbers,
+        the others their last flushed file. Files of exited workers are kept
+        so counters never go backwards.
+        """
+        merged = self.snapshot()
+        directory = settings.METRICS_DIR
+        if not directory:
+            return merged
+        own = os.path.join(directory, f'metrics-{os.getpid()}.json')
+        for path in glob.glob(os.path.join(directory, 'metrics-*.json')):
+            if path == own:
+                continue
+            try:
+                with open(path) as fh:
+                    rows = json.load(fh)
+            except (OSError, ValueError):
+                continue
+            for key, series in rows:
+                merge_series(merged, tuple(key), series)
+        return merged
+
+
+def merge_series(merged, key, series):
+    total = merged.get(key)
+    if total is None:
+        merged[key] = list(series)
+    else:
+        for i, value in enumerate(series):
+            total[i] += value
+
+
+registry = MetricsRegistry()
+
+
+def label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def histogram_lines(name, labels, buckets, counts, total, count):
+    lines = []
+    cumulative = 0
+    for bound, bucket in zip(buckets + ('+Inf',), counts):
+        cumulative += bucket
+        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+    lines.append(f'{name}_sum{{{labels}}} {total}')
+    lines.append(f'{name}_count{{{labels}}} {count}')
+    return lines
+
+
+def render_prometheus(stats):
+    """Formats collect() output in the Prometheus text exposition format."""
+    latency, size, queries, query_time = [], [], [], []
+    for (view, method, status), series in sorted(stats.items()):
+        labels = f'view="{label(view)}",method="{label(method)}",status="{status}"'
+        latency += histogram_lines(
+            'apis_request_duration_seconds', labels, LATENCY_BUCKETS,
+            series[LATENCY_OFFSET:SIZE_OFFSET], series[LATENCY_SUM], series[COUNT])
+        size += histogram_lines(
+            'apis_response_size_bytes', labels, SIZE_BUCKETS,
+            series[SIZE_OFFSET:], series[SIZE_SUM], series[SIZE_COUNT])
+        queries.append(f'apis_db_queries_total{{{labels}}} {series[QUERIES]}')
+        query_time.append(f'apis_db_query_duration_seconds_total{{{labels}}} {series[QUERY_TIME]}')
+
+    lines = [
+        '# HELP apis_request_duration_seconds Time spent serving requests.',
+        '# TYPE apis_request_duration_seconds histogram',
+        *latency,
+        '# HELP apis_response_size_bytes Size of response bodies, streamed responses excluded.',
+        '# TYPE apis_response_size_bytes histogram',
+        *size,
+        '# HELP apis_db_queries_total Database queries made while serving requests.',
+        '# TYPE apis_db_queries_total counter',
+        *queries,
+        '# HELP apis_db_query_duration_seconds_total Time spent in database queries.',
+        '# TYPE apis_db_query_duration_seconds_total counter',
+        *query_time,
+    ]
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,72 @@
+import time
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.decorators import sync_and_async_middleware
+
+from apis import routers
+from apis.metrics import RequestMetrics, registry, request_metrics
+
+
+@sync_and_async_middleware
+def replica_routing_middleware(get_response):
+    # Gives each request its own routing state for PrimaryReplicaRouter
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            token = routers.begin_request()
+            try:
+                return await get_response(request)
+            finally:
+                routers.end_request(token)
+    else:
+        def middleware(request):
+            token = routers.begin_request()
+            try:
+                return get_response(request)
+            finally:
+                routers.end_request(token)
+    return middleware
+
+
+def record_response(request, response, current):
+    elapsed = time.perf_counter() - current.started
+    match = request.resolver_match
+    view = match.view_name if match is not None else '<unmatched>'
+    size = None if response.streaming else len(response.content)
+    registry.observe((view, request.method, response.status_code), elapsed, size,
+                     current.queries, current.query_time)
+    registry.maybe_flush()
+
+    # Streamed bodies are produced after this point, so only the time to
+    # the first byte is reported for them
+    response['Server-Timing'] = (f'db;dur={current.query_time * 1000:.2f};desc="{current.queries} queries", '
+                                 f'app;dur={elapsed * 1000:.2f}')
+    return response
+
+
+@sync_and_async_middleware
+def metrics_middleware(get_response):
+    # Records latency, response size and database usage per resolved view
+    if not settings.METRICS_ENABLED:
+        raise MiddlewareNotUsed()
+
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            current = RequestMetrics()
+            token = request_metrics.set(current)
+            try:
+                response = await get_response(request)
+            finally:
+                request_metrics.reset(token)
+            return record_response(request, response, current)
+    else:
+        def middleware(request):
+            current = RequestMetrics()
+            token = request_metrics.set(current)
+            try:
+                response = get_response(request)
+            finally:
+                request_metrics.reset(token)
+            return record_response(request, response, current)
+    return middleware
@@ -0,0 +1,55 @@
+# Generated by Django 4.2.6 on 2026-10-18 09:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apis', '0002_alter_doctorprofile_department_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='doctorprofile',
+            name='department',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='apis.department'),
+        ),
+        migrations.AlterField(
+            model_name='patientprofile',
+            name='department',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='apis.department'),
+        ),
+        migrations.AlterField(
+            model_name='patientrecords',
+            name='department',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='apis.department'),
+        ),
+        migrations.AlterField(
+            model_name='patientrecords',
+            name='patient',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='apis.patientprofile'),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='name',
+            field=models.CharField(db_index=True, max_length=200),
+        ),
+        migrations.AddIndex(
+            model_name='doctorprofile',
+            index=models.Index(fields=['department', 'id'], name='doctor_department_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patientprofile',
+            index=models.Index(fields=['department', 'id'], name='patient_department_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patientrecords',
+            index=models.Index(fields=['department', 'created_date', 'id'], name='record_department_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patientrecords',
+            index=models.Index(fields=['patient', 'created_date'], name='record_patient_created_idx'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+from django.db import NotSupportedError, migrations
+
+COLUMNS = 'department_id, diagnostics, observations, treatments'
+OLD = 'old.department_id, old.diagnostics, old.observations, old.treatments'
+NEW = 'new.department_id, new.diagnostics, new.observations, new.treatments'
+
+# The department is indexed as well, so a search matches within one
+# department instead of across every department's records
+CREATE = [
+    f"CREATE VIRTUAL TABLE apis_patientrecords_fts USING fts5({COLUMNS}, "
+    f"content='apis_patientrecords', content_rowid='id', tokenize='porter unicode61')",
+    f"CREATE TRIGGER apis_patientrecords_fts_insert AFTER INSERT ON apis_patientrecords BEGIN "
+    f"INSERT INTO apis_patientrecords_fts(rowid, {COLUMNS}) VALUES (new.id, {NEW}); END",
+    f"CREATE TRIGGER apis_patientrecords_fts_delete AFTER DELETE ON apis_patientrecords BEGIN "
+    f"INSERT INTO apis_patientrecords_fts(apis_patientrecords_fts, rowid, {COLUMNS}) VALUES ('delete', old.id, {OLD}); END",
+    f"CREATE TRIGGER apis_patientrecords_fts_update AFTER UPDATE OF {COLUMNS} ON apis_patientrecords BEGIN "
+    f"INSERT INTO apis_patientrecords_fts(apis_patientrecords_fts, rowid, {COLUMNS}) VALUES ('delete', old.id, {OLD}); "
+    f"INSERT INTO apis_patientrecords_fts(rowid, {COLUMNS}) VALUES (new.id, {NEW}); END",
+    "INSERT INTO apis_patientrecords_fts(apis_patientrecords_fts) VALUES ('rebuild')",
+]
+
+DROP = [
+    'DROP TRIGGER IF EXISTS apis_patientrecords_fts_update',
+    'DROP TRIGGER IF EXISTS apis_patientrecords_fts_delete',
+    'DROP TRIGGER IF EXISTS apis_patientrecords_fts_insert',
+    'DROP TABLE IF EXISTS apis_patientrecords_fts',
+]
+
+
+def run(statements):
+    def operation(apps, schema_editor):
+        # FTS5 is SQLite only, and search_records relies on it
+        if schema_editor.connection.vendor != 'sqlite':
+            raise NotSupportedError('The record search index is only supported on SQLite')
+        for statement in statements:
+            schema_editor.execute(statement)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apis', '0003_access_path_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(run(CREATE), run(DROP)),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 4.2.6 on 2026-10-18 09:18
+
+from django.db import NotSupportedError, migrations, models
+
+COLUMNS = 'department_id, diagnostics, observations, treatments'
+OLD = 'old.department_id, old.diagnostics, old.observations, old.treatments'
+NEW = 'new.department_id, new.diagnostics, new.observations, new.treatments'
+
+# The search index triggers as 0004 created them
+TRIGGERS = [
+    f"CREATE TRIGGER IF NOT EXISTS apis_patientrecords_fts_insert AFTER INSERT ON apis_patientrecords BEGIN "
+    f"INSERT INTO apis_patientrecords_fts(rowid, {COLUMNS}) VALUES (new.id, {NEW}); END",
+    f"CREATE TRIGGER IF NOT EXISTS apis_patientrecords_fts_delete AFTER DELETE ON apis_patientrecords BEGIN "
+    f"INSERT INTO apis_patientrecords_fts(apis_patientrecords_fts, rowid, {COLUMNS}) VALUES ('delete', old.id, {OLD}); END",
+    f"CREATE TRIGGER IF NOT EXISTS apis_patientrecords_fts_update AFTER UPDATE OF {COLUMNS} ON apis_patientrecords BEGIN "
+    f"INSERT INTO apis_patientrecords_fts(apis_patientrecords_fts, rowid, {COLUMNS}) VALUES ('delete', old.id, {OLD}); "
+    f"INSERT INTO apis_patientrecords_fts(rowid, {COLUMNS}) VALUES (new.id, {NEW}); END",
+    "INSERT INTO apis_patientrecords_fts(apis_patientrecords_fts) VALUES ('rebuild')",
+]
+
+
+def restore_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        raise NotSupportedError('The record search index is only supported on SQLite')
+    for statement in TRIGGERS:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apis', '0004_patientrecords_fts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='doctorprofile',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='patientprofile',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='patientrecords',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        # Adding the column rebuilt apis_patientrecords without its FTS triggers
+        migrations.RunPython(restore_triggers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 4.2.6 on 2026-10-18 09:26
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+import django.db.models.deletion
+
+
+def populate_stats(apps, schema_editor):
+    # Counts the existing rows once; the signals keep the counts from here on
+    Department = apps.get_model('apis', 'Department')
+    DepartmentStats = apps.get_model('apis', 'DepartmentStats')
+    DepartmentDailyRecords = apps.get_model('apis', 'DepartmentDailyRecords')
+
+    def per_department(model_name):
+        rows = apps.get_model('apis', model_name).objects.exclude(department=None)
+        return dict(rows.values_list('department_id').annotate(Count('id')).order_by())
+
+    doctors, patients = per_department('DoctorProfile'), per_department('PatientProfile')
+    records = per_department('PatientRecords')
+    DepartmentStats.objects.bulk_create([
+        DepartmentStats(department_id=pk, doctors=doctors.get(pk, 0), patients=patients.get(pk, 0),
+                        records=records.get(pk, 0))
+        for pk in Department.objects.values_list('pk', flat=True)
+    ])
+    days = (
+        apps.get_model('apis', 'PatientRecords').objects.annotate(day=TruncDate('created_date'))
+        .values_list('department_id', 'day').annotate(Count('id')).order_by()
+    )
+    DepartmentDailyRecords.objects.bulk_create([
+        DepartmentDailyRecords(department_id=department_id, day=day, records=count)
+        for department_id, day, count in days
+    ], batch_size=10000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apis', '0005_modification_tracking'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DepartmentStats',
+            fields=[
+                ('department', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='apis.department')),
+                ('doctors', models.IntegerField(default=0)),
+                ('patients', models.IntegerField(default=0)),
+                ('records', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DepartmentDailyRecords',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('records', models.IntegerField(default=0)),
+                ('department', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='apis.department')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='departmentdailyrecords',
+            constraint=models.UniqueConstraint(fields=('department', 'day'), name='daily_records_department_day_uniq'),
+        ),
+        migrations.RunPython(populate_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.6 on 2026-10-18 09:35
+
+import apis.fields
+from django.db import NotSupportedError, migrations
+
+COLUMNS = {
+    'diagnostics': {},
+    'observations': {},
+    'treatments': {},
+    'misc': {'blank': True, 'null': True},
+}
+
+
+def require_sqlite(apps, schema_editor):
+    # SQLite keeps BLOBs as they are in TEXT columns, so it needs no ALTER;
+    # skipping it there saves four rebuilds of the largest table. Elsewhere
+    # the columns would have to change type and 0009 convert their contents,
+    # which is only implemented for SQLite.
+    if schema_editor.connection.vendor != 'sqlite':
+        raise NotSupportedError('Compressing the record texts is only supported on SQLite')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apis', '0007_soft_delete'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='patientrecords',
+                    name=name,
+                    field=apis.fields.CompressedTextField(**kwargs),
+                )
+                for name, kwargs in COLUMNS.items()
+            ],
+            database_operations=[
+                migrations.RunPython(require_sqlite, migrations.RunPython.noop),
+            ],
+        ),
+    ]
@@ -0,0 +1,123 @@
+import zlib
+from importlib import import_module
+
+from django.db import NotSupportedError, migrations, transaction
+
+COLUMNS = ['diagnostics', 'observations', 'treatments', 'misc']
+BATCH_SIZE = 2000
+
+# The index reads the compressed columns through a view and apis_decompress(),
+# the SQL function apis.db registers on every connection
+TEXT_COLUMNS = ['diagnostics', 'observations', 'treatments']
+FTS_COLUMNS = ', '.join(['department_id', *TEXT_COLUMNS])
+OLD = ', '.join(['old.department_id', *(f'apis_decompress(old.{column})' for column in TEXT_COLUMNS)])
+NEW = ', '.join(['new.department_id', *(f'apis_decompress(new.{column})' for column in TEXT_COLUMNS)])
+DECOMPRESSED = ', '.join(['department_id', *(f'apis_decompress({column}) AS {column}' for column in TEXT_COLUMNS)])
+CREATE = [
+    f'CREATE VIEW apis_patientrecords_text AS SELECT id, {DECOMPRESSED} FROM apis_patientrecords',
+    f"CREATE VIRTUAL TABLE apis_patientrecords_fts USING fts5({FTS_COLUMNS}, "
+    f"content='apis_patientrecords_text', content_rowid='id', tokenize='porter unicode61')",
+    f"CREATE TRIGGER IF NOT EXISTS apis_patientrecords_fts_insert AFTER INSERT ON apis_patientrecords BEGIN "
+    f"INSERT INTO apis_patientrecords_fts(rowid, {FTS_COLUMNS}) VALUES (new.id, {NEW}); END",
+    f"CREATE TRIGGER IF NOT EXISTS apis_patientrecords_fts_delete AFTER DELETE ON apis_patientrecords BEGIN "
+    f"INSERT INTO apis_patientrecords_fts(apis_patientrecords_fts, rowid, {FTS_COLUMNS}) VALUES ('delete', old.id, {OLD}); END",
+    f"CREATE TRIGGER IF NOT EXISTS apis_patientrecords_fts_update AFTER UPDATE OF {FTS_COLUMNS} ON apis_patientrecords BEGIN "
+    f"INSERT INTO apis_patientrecords_fts(apis_patientrecords_fts, rowid, {FTS_COLUMNS}) VALUES ('delete', old.id, {OLD}); "
+    f"INSERT INTO apis_patientrecords_fts(rowid, {FTS_COLUMNS}) VALUES (new.id, {NEW}); END",
+    "INSERT INTO apis_patientrecords_fts(apis_patientrecords_fts) VALUES ('rebuild')",
+]
+DROP = [
+    'DROP TRIGGER IF EXISTS apis_patientrecords_fts_insert',
+    'DROP TRIGGER IF EXISTS apis_patientrecords_fts_delete',
+    'DROP TRIGGER IF EXISTS apis_patientrecords_fts_update',
+    'DROP TABLE IF EXISTS apis_patientrecords_fts',
+    'DROP VIEW IF EXISTS apis_patientrecords_text',
+]
+
+# SQLite only, see 0008. Not atomic: each batch commits on its own, so the
+# write lock is never held for long and an interrupted run picks up where it
+# stopped, as converted rows are BLOBs and skipped. The search index is
+# dropped first, its triggers would index the compressed bytes, and rebuilt
+# from the view at the end.
+
+
+def require_sqlite(schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        raise NotSupportedError('Compressing the record texts is only supported on SQLite')
+
+
+def convert_rows(convert):
+    def operation(apps, schema_editor):
+        require_sqlite(schema_editor)
+        connection = schema_editor.connection
+        table = apps.get_model('apis', 'PatientRecords')._meta.db_table
+        assignments = ', '.join(f'{column} = %s' for column in COLUMNS)
+        last_id = 0
+        while True:
+            with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+                cursor.execute(
+                    f'SELECT id, {", ".join(COLUMNS)} FROM {table} WHERE id > %s ORDER BY id LIMIT %s',
+                    [last_id, BATCH_SIZE],
+                )
+                rows = cursor.fetchall()
+                if not rows:
+                    return
+                changed = []
+                for row in rows:
+                    values = [convert(value) for value in row[1:]]
+                    if values != list(row[1:]):
+                        changed.append([*values, row[0]])
+                if changed:
+                    cursor.executemany(f'UPDATE {table} SET {assignments} WHERE id = %s', changed)
+            last_id = rows[-1][0]
+    return operation
+
+
+def compress(value):
+    # The format of apis.fields.CompressedTextField: a one-byte codec tag,
+    # then raw deflate ('z'), or the UTF-8 text itself when that is no smaller ('p')
+    if not isinstance(value, str):
+        return value
+    data = value.encode('utf-8')
+    packed = zlib.compress(data, 6, wbits=-15)
+    if len(packed) >= len(data):
+        return b'p' + data
+    return b'z' + packed
+
+
+def decompress(value):
+    if value is None or isinstance(value, str):
+        return value
+    value = bytes(value)
+    tag, data = value[:1], value[1:]
+    if tag == b'z':
+        data = zlib.decompress(data, wbits=-15)
+    elif tag != b'p':
+        raise ValueError(f'Values written with codec tag {tag!r} must be rewritten as zlib first')
+    return data.decode('utf-8')
+
+
+def run(statements):
+    def operation(apps, schema_editor):
+        require_sqlite(schema_editor)
+        for statement in statements:
+            schema_editor.execute(statement)
+    return operation
+
+
+# The index as 0004 created it, over the plain text columns
+create_plain_search_table = run(import_module('apis.migrations.0004_patientrecords_fts').CREATE)
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('apis', '0008_compressed_record_text'),
+    ]
+
+    operations = [
+        migrations.RunPython(run(DROP), create_plain_search_table),
+        migrations.RunPython(convert_rows(compress), convert_rows(decompress)),
+        migrations.RunPython(run(CREATE), run(DROP)),
+    ]
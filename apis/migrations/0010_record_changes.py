@@ -0,0 +1,69 @@
+# Generated by Django 4.2.6 on 2026-10-18 09:39
+
+from django.db import NotSupportedError, migrations, models
+
+# Every insert, update and delete of a record takes the next sequence number
+# in the change log (see apis/changes.py). SQLite only, like the search index.
+TABLE = 'apis_recordchange'
+NEXT_SEQ = f'(SELECT COALESCE(MAX(seq), 0) + 1 FROM {TABLE})'
+UPSERT = 'ON CONFLICT(record_id, department_id) DO UPDATE SET seq = excluded.seq, deleted = excluded.deleted'
+TRIGGERS = [
+    f"CREATE TRIGGER IF NOT EXISTS {TABLE}_insert AFTER INSERT ON apis_patientrecords BEGIN "
+    f"INSERT INTO {TABLE}(record_id, department_id, seq, deleted) "
+    f"VALUES (new.id, new.department_id, {NEXT_SEQ}, 0) {UPSERT}; END",
+    # A record moved to another department leaves a tombstone in the old one
+    f"CREATE TRIGGER IF NOT EXISTS {TABLE}_update AFTER UPDATE ON apis_patientrecords BEGIN "
+    f"INSERT INTO {TABLE}(record_id, department_id, seq, deleted) "
+    f"SELECT old.id, old.department_id, {NEXT_SEQ}, 1 WHERE old.department_id IS NOT new.department_id {UPSERT}; "
+    f"INSERT INTO {TABLE}(record_id, department_id, seq, deleted) "
+    f"VALUES (new.id, new.department_id, {NEXT_SEQ}, 0) {UPSERT}; END",
+    f"CREATE TRIGGER IF NOT EXISTS {TABLE}_delete AFTER DELETE ON apis_patientrecords BEGIN "
+    f"INSERT INTO {TABLE}(record_id, department_id, seq, deleted) "
+    f"VALUES (old.id, old.department_id, {NEXT_SEQ}, 1) {UPSERT}; END",
+]
+
+
+def start_log(apps, schema_editor):
+    # Logs every existing record as changed, in id order, then installs the triggers
+    if schema_editor.connection.vendor != 'sqlite':
+        raise NotSupportedError('The record change log is only supported on SQLite')
+    schema_editor.execute(
+        f'INSERT INTO {TABLE}(record_id, department_id, seq, deleted) '
+        f'SELECT id, department_id, id, 0 FROM apis_patientrecords')
+    for statement in TRIGGERS:
+        schema_editor.execute(statement)
+
+
+def drop_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        raise NotSupportedError('The record change log is only supported on SQLite')
+    for suffix in ('insert', 'update', 'delete'):
+        schema_editor.execute(f'DROP TRIGGER IF EXISTS {TABLE}_{suffix}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apis', '0009_compress_record_text'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecordChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('record_id', models.BigIntegerField()),
+                ('department_id', models.BigIntegerField()),
+                ('seq', models.BigIntegerField(unique=True)),
+                ('deleted', models.BooleanField(default=False)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['department_id', 'seq'], name='record_change_department_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='recordchange',
+            constraint=models.UniqueConstraint(fields=('record_id', 'department_id'), name='record_change_record_department_uniq'),
+        ),
+        migrations.RunPython(start_log, drop_triggers),
+    ]
@@ -3,7 +3,25 @@ from django.contrib.auth.models import BaseUserManager, AbstractBaseUser
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 
+from .fields import CompressedTextField
+
+class SoftDeleteManager(models.Manager):
+    # Soft-deleted rows are invisible to every query through `objects`;
+    # `all_objects` still sees them, for the purge
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at=None)
+
+
+class PatientRecordsManager(models.Manager):
+    # Records of a soft-deleted patient are hidden with the patient
+    def get_queryset(self):
+        return super().get_queryset().filter(patient__deleted_at=None)
+
+
 class UserManager(BaseUserManager):
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at=None)
+
     def create_user(self, email, name, role, password=None, password2=None):
         if not email:
             raise ValueError('User must have an email address')
@@ -45,18 +63,27 @@ class User(AbstractBaseUser):
         max_length=255,
         unique=True,
     )
-    name = models.CharField(max_length=200)
+    name = models.CharField(max_length=200, db_index=True)
     role = models.CharField(max_length=50, choices=ROLE_CHOICES)
     is_active = models.BooleanField(default=True)
     is_admin = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Set by apis.deletion.soft_delete_patient, the row is purged later
+    deleted_at = models.DateTimeField(null=True, blank=True)
 
     objects = UserManager()
+    all_objects = models.Manager()
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['name', 'role']
 
+    class Meta:
+        indexes = [
+            # The purge's work queue, only soft-deleted rows are indexed
+            models.Index(fields=['deleted_at'], name='user_deleted_idx', condition=models.Q(deleted_at__isnull=False)),
+        ]
+
     def __str__(self):
         return self.email
 
@@ -86,31 +113,121 @@ class Department(models.Model):
     
 class DoctorProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
-    department = models.ForeignKey(Department, on_delete=models.CASCADE, null=True, blank=True)
+    department = models.ForeignKey(Department, on_delete=models.CASCADE, null=True, blank=True, db_index=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Department listings filter on department and page on id
+            models.Index(fields=['department', 'id'], name='doctor_department_id_idx'),
+        ]
 
     def __str__(self):
         return f'Dr. {self.user.name} - {self.department.name if self.department else "No Department"}'
 
 class PatientProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
-    department = models.ForeignKey(Department, on_delete=models.CASCADE, null=True, blank=True)
+    department = models.ForeignKey(Department, on_delete=models.CASCADE, null=True, blank=True, db_index=False)
+    updated_at = models.DateTimeField(auto_now=True)
+    deleted_at = models.DateTimeField(null=True, blank=True)
+
+    objects = SoftDeleteManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['department', 'id'], name='patient_department_id_idx'),
+        ]
 
     def __str__(self):
         return self.user.name
     
 
 class PatientRecords(models.Model):
-    patient = models.ForeignKey(PatientProfile, on_delete=models.CASCADE)
+    patient = models.ForeignKey(PatientProfile, on_delete=models.CASCADE, db_index=False)
     doctor = models.ForeignKey(DoctorProfile, on_delete=models.CASCADE)
     created_date = models.DateTimeField(auto_now_add=True)
-    diagnostics = models.TextField()
-    observations = models.TextField()
-    treatments = models.TextField()
-    department = models.ForeignKey(Department, on_delete=models.CASCADE)
-    misc = models.TextField(null=True, blank=True)
+    # The free-text columns are most of the table, they are stored compressed
+    diagnostics = CompressedTextField()
+    observations = CompressedTextField()
+    treatments = CompressedTextField()
+    department = models.ForeignKey(Department, on_delete=models.CASCADE, db_index=False)
+    misc = CompressedTextField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = PatientRecordsManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        indexes = [
+            # The department feed pages on (created_date, id) within a department
+            models.Index(fields=['department', 'created_date', 'id'], name='record_department_created_idx'),
+            models.Index(fields=['patient', 'created_date'], name='record_patient_created_idx'),
+        ]
 
     def __str__(self):
         return f'Record {self.id} - {self.patient.user.name}'
+
+
+class DepartmentStats(models.Model):
+    """
+    Per-department counts kept current by the signals in apis/signals.py
+    (see apis/stats.py), so dashboards never count the big tables.
+    Profiles without a department are not counted.
+    """
+    department = models.OneToOneField(Department, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    doctors = models.IntegerField(default=0)
+    patients = models.IntegerField(default=0)
+    records = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'Stats for department {self.department_id}'
+
+
+class DepartmentDailyRecords(models.Model):
+    # Records created per department and day (in TIME_ZONE)
+    department = models.ForeignKey(Department, on_delete=models.CASCADE, db_index=False)
+    day = models.DateField()
+    records = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            # Also the index for a department's recent days
+            models.UniqueConstraint(fields=['department', 'day'], name='daily_records_department_day_uniq'),
+        ]
+
+    def __str__(self):
+        return f'{self.day}: {self.records} records in department {self.department_id}'
+
+
+class RecordChange(models.Model):
+    """
+    The latest change of each record in each department, for the delta sync
+    feed. Kept by the SQLite triggers in apis/changes.py, so every write is
+    covered. Rows of deleted records stay as tombstones, and a record moved
+    to another department leaves one in the old department.
+
+    record_id and department_id are plain columns, not foreign keys, because
+    tombstones outlive both.
+    """
+    record_id = models.BigIntegerField()
+    department_id = models.BigIntegerField()
+    # Unique, and so indexed, which makes MAX(seq) for the next one cheap
+    seq = models.BigIntegerField(unique=True)
+    deleted = models.BooleanField(default=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['record_id', 'department_id'], name='record_change_record_department_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['department_id', 'seq'], name='record_change_department_idx'),
+        ]
+
+    def __str__(self):
+        return f'Record {self.record_id} {"deleted" if self.deleted else "changed"} at {self.seq}'
+
   
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
@@ -0,0 +1,119 @@
+import base64
+import json
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ParseError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Forward-only cursor pagination over a unique ordering, e.g. ('created_date', 'id').
+
+    The cursor holds the ordering values of the last row of the previous page,
+    so every page is a single `WHERE (a, b) > (x, y) ORDER BY a, b LIMIT n`
+    query whose cost does not depend on how deep the client has paged.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def __init__(self, ordering=('id',)):
+        self.ordering = tuple(ordering)
+        self.page_size = settings.PAGINATION_PAGE_SIZE
+        self.max_page_size = settings.PAGINATION_MAX_PAGE_SIZE
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.GET[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if size <= 0:
+            return self.page_size
+        return min(size, self.max_page_size)
+
+    def get_page_queryset(self, queryset, request):
+        self.request = request
+        self.limit = self.get_page_size(request)
+
+        position = self.decode_cursor(request)
+        if position is not None:
+            queryset = queryset.filter(self.after(position))
+
+        # One extra row tells us whether there is a next page without a COUNT
+        return queryset.order_by(*self.ordering)[:self.limit + 1]
+
+    def set_page(self, rows):
+        self.has_next = len(rows) > self.limit
+        self.page = rows[:self.limit]
+        return self.page
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.set_page(list(self.get_page_queryset(queryset, request)))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        return self.set_page([row async for row in self.get_page_queryset(queryset, request)])
+
+    def after(self, position):
+        # Expands the row-value comparison (a, b, c) > (x, y, z) into
+        # a >= x AND (a > x OR (a = x AND b > y) OR (a = x AND b = y AND c > z)).
+        # The OR alone is no index range to SQLite, which would scan every row
+        # before the cursor; the redundant leading a >= x is, and keeps the
+        # cost of a page independent of its depth.
+        condition = Q()
+        for i, field in enumerate(self.ordering):
+            term = Q(**{f'{field}__gt': position[i]})
+            for prev_field, value in zip(self.ordering[:i], position[:i]):
+                term &= Q(**{prev_field: value})
+            condition |= term
+        return Q(**{f'{self.ordering[0]}__gte': position[0]}) & condition
+
+    def decode_cursor(self, request):
+        encoded = request.GET.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            position = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+        except (TypeError, ValueError, UnicodeError):
+            raise ParseError(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise ParseError(self.invalid_cursor_message)
+
+        for i, field in enumerate(self.ordering):
+            if field.endswith('_date') or field.endswith('_at'):
+                value = parse_datetime(position[i]) if isinstance(position[i], str) else None
+                if value is None:
+                    raise ParseError(self.invalid_cursor_message)
+                position[i] = value
+            elif not isinstance(position[i], int):
+                raise ParseError(self.invalid_cursor_message)
+        return position
+
+    def encode_cursor(self, instance):
+        position = []
+        for field in self.ordering:
+            value = instance
+            for attr in field.split('__'):
+                value = getattr(value, attr)
+            position.append(value.isoformat() if hasattr(value, 'isoformat') else value)
+        return base64.urlsafe_b64encode(json.dumps(position).encode('utf-8')).decode('ascii')
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[-1]))
+
+    def get_paginated_data(self, data):
+        return OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ])
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
@@ -1,16 +1,48 @@
 from rest_framework import renderers
+from rest_framework.exceptions import ErrorDetail
+from rest_framework.utils import encoders
 import json
 
+try:
+  import orjson
+except ImportError:  # optional, falls back to the stdlib encoder
+  orjson = None
+
+
+def contains_error_detail(data):
+  # Validation and exception payloads are small nested dicts/lists of ErrorDetail
+  if isinstance(data, ErrorDetail):
+    return True
+  if isinstance(data, dict):
+    return any(contains_error_detail(value) for value in data.values())
+  if isinstance(data, (list, tuple)):
+    return any(contains_error_detail(value) for value in data)
+  return False
+
+
+def dumps(data):
+  # Encodes straight to utf-8 bytes, using orjson when it is installed.
+  # OPT_UTC_Z writes UTC datetimes with 'Z' like DRF's encoder does.
+  if orjson is not None:
+    return orjson.dumps(data, default=encoders.JSONEncoder().default,
+                        option=orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z)
+  return json.dumps(data, cls=encoders.JSONEncoder, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
 class UserRenderer(renderers.JSONRenderer):
   charset='utf-8'
   def render(self, data, accepted_media_type=None, renderer_context=None):
-    response = ''
-    if 'ErrorDetail' in str(data):
-      response = json.dumps({'errors':data})
-    else:
-      response = json.dumps(data)
-    
-    return response
-  
-
-# The UserRenderer class allows you to customize the JSON rendering process.
\ No newline at end of file
+    if data is None:
+      return b''
+
+    # Only error responses can carry ErrorDetail, so successful payloads
+    # (including the large record lists) are never scanned
+    response = (renderer_context or {}).get('response')
+    if response is None or response.exception or response.status_code >= 400:
+      if contains_error_detail(data):
+        data = {'errors': data}
+
+    return dumps(data)
+
+
+# The UserRenderer class allows you to customize the JSON rendering process.
@@ -0,0 +1,77 @@
+import contextvars
+import random
+
+from django.conf import settings
+from django.core.cache import cache
+
+from apis.cache import cache_is_shared
+
+PIN_KEY = 'apis:replica-pin:{}'
+
+# Routing state of the current request, set up by ReplicaRoutingMiddleware
+routing_state = contextvars.ContextVar('routing_state', default=None)
+
+
+class RoutingState:
+    def __init__(self):
+        self.user_id = None
+        self.pinned = False
+        self.wrote = False
+
+
+def begin_request():
+    return routing_state.set(RoutingState())
+
+
+def end_request(token):
+    state = routing_state.get()
+    routing_state.reset(token)
+    # Keep this user's reads on the primary until the replicas have caught up
+    if state is not None and state.wrote and state.user_id is not None and settings.DATABASE_REPLICAS:
+        cache.set(PIN_KEY.format(state.user_id), True, settings.REPLICA_PIN_SECONDS)
+
+
+def set_user(user_id):
+    """
+    Called once the requesting user is known. Pins the rest of the request
+    to the primary if this user wrote recently.
+    """
+    state = routing_state.get()
+    if state is None or not settings.DATABASE_REPLICAS:
+        return
+    state.user_id = user_id
+    if cache.get(PIN_KEY.format(user_id)):
+        state.pinned = True
+
+
+class PrimaryReplicaRouter:
+    """
+    Sends writes to 'default' and reads to one of settings.DATABASE_REPLICAS.
+
+    Reads stay on the primary for the rest of a request once it has written,
+    and for REPLICA_PIN_SECONDS afterwards for requests by the same user, so
+    a doctor sees the record they just created.
+    """
+
+    def db_for_read(self, model, **hints):
+        # The pins are kept in the cache; one per process would not pin a
+        # user's next request if another worker serves it
+        if not settings.DATABASE_REPLICAS or not cache_is_shared():
+            return 'default'
+        state = routing_state.get()
+        if state is not None and (state.pinned or state.wrote):
+            return 'default'
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        state = routing_state.get()
+        if state is not None:
+            state.wrote = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return None
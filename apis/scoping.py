@@ -0,0 +1,60 @@
+from django.db.models import Q
+from django.http import Http404
+from rest_framework import status
+from rest_framework.response import Response
+
+
+def department_scope(department_id, allow_unassigned=False):
+    # Rows of the doctor's department, plus rows without one if allowed
+    scope = Q(department_id=department_id) if department_id is not None else Q(pk__in=[])
+    if allow_unassigned:
+        scope |= Q(department=None)
+    return scope
+
+
+class ScopedLookupFailed(Exception):
+    def __init__(self, response):
+        self.response = response
+
+
+class DepartmentScopedMixin:
+    """
+    Detail view lookups restricted to the requesting doctor's department.
+
+    The department check is part of the WHERE clause, so a permitted lookup
+    is a single query. Only when it finds nothing does a second, pk-only
+    query tell "not yours" (403) from "does not exist" (404).
+
+    `scope_not_found` is the 404 body (None for DRF's default) and
+    `scope_forbidden` the 403 body, formatted with the verb for the request
+    method from `scope_actions`.
+    """
+    scope_allow_unassigned = False
+    scope_not_found = None
+    scope_forbidden = {"error": "You do not have permission to {action} this object."}
+    scope_actions = {'GET': 'view', 'HEAD': 'view', 'PUT': 'update', 'PATCH': 'update', 'DELETE': 'delete'}
+
+    def get_scope_department_id(self):
+        # Served from the cached user, no query
+        doctor = getattr(self.request.user, 'doctorprofile', None)
+        return doctor.department_id if doctor is not None else None
+
+    def get_scoped_object(self, queryset, pk):
+        scope = department_scope(self.get_scope_department_id(), self.scope_allow_unassigned)
+        obj = queryset.filter(scope, pk=pk).first()
+        if obj is not None:
+            return obj
+
+        if queryset.model._default_manager.filter(pk=pk).exists():
+            action = self.scope_actions.get(self.request.method, 'access')
+            forbidden = {key: value.format(action=action) for key, value in self.scope_forbidden.items()}
+            raise ScopedLookupFailed(Response(forbidden, status=status.HTTP_403_FORBIDDEN))
+        if self.scope_not_found is None:
+            raise Http404
+        raise ScopedLookupFailed(Response(self.scope_not_found, status=status.HTTP_404_NOT_FOUND))
+
+    def handle_exception(self, exc):
+        # The lookup's 403/404 are plain responses, like the views used to return
+        if isinstance(exc, ScopedLookupFailed):
+            return exc.response
+        return super().handle_exception(exc)
@@ -0,0 +1,102 @@
+import re
+from contextlib import contextmanager
+
+from django.db import connections, router
+
+from apis.models import PatientRecords
+
+# FTS5 index over the text columns of PatientRecords, created by migration
+# 0004_patientrecords_fts. It is an external-content table: the text lives
+# only in apis_patientrecords and triggers keep the index in step with every
+# INSERT, UPDATE and DELETE, including bulk_create and raw deletes.
+#
+# The columns are stored compressed (apis.fields.CompressedTextField), so
+# since migration 0009 the index reads them through a view, and the triggers
+# through the apis_decompress() SQL function that apis.db registers on every
+# connection. A migration that rebuilds apis_patientrecords drops the
+# triggers and must create them again, as 0005 does.
+FTS_TABLE = 'apis_patientrecords_fts'
+FTS_COLUMNS = ['diagnostics', 'observations', 'treatments']
+
+# The department is an indexed column too, so MATCH itself narrows a search
+# to one department and its cost follows that department's matches, not the
+# whole corpus'. Moving a record to another department reindexes it.
+_COLUMNS = ', '.join(['department_id', *FTS_COLUMNS])
+_OLD = ', '.join(['old.department_id', *(f'apis_decompress(old.{column})' for column in FTS_COLUMNS)])
+_NEW = ', '.join(['new.department_id', *(f'apis_decompress(new.{column})' for column in FTS_COLUMNS)])
+FTS_TRIGGERS = [
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert AFTER INSERT ON apis_patientrecords BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, {_COLUMNS}) VALUES (new.id, {_NEW}); END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete AFTER DELETE ON apis_patientrecords BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {_COLUMNS}) VALUES ('delete', old.id, {_OLD}); END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update AFTER UPDATE OF {_COLUMNS} ON apis_patientrecords BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {_COLUMNS}) VALUES ('delete', old.id, {_OLD}); "
+    f"INSERT INTO {FTS_TABLE}(rowid, {_COLUMNS}) VALUES (new.id, {_NEW}); END",
+]
+
+# Column filter limiting the user's terms to the text columns
+_TEXT_COLUMNS = '{%s}' % ' '.join(FTS_COLUMNS)
+
+TERM_RE = re.compile(r'\w+\*?')
+
+
+def build_match_query(text):
+    """
+    Turns free text into an FTS5 query matching records that contain every
+    term. Terms are quoted so user input cannot inject FTS5 syntax; a
+    trailing * is kept as a prefix match.
+    """
+    terms = []
+    for term in TERM_RE.findall(text):
+        prefix = term.endswith('*')
+        terms.append('"%s"%s' % (term.rstrip('*'), '*' if prefix else ''))
+    return ' '.join(terms)
+
+
+def search_records(department_id, text, limit, offset=0):
+    match = build_match_query(text)
+    if not match:
+        return []
+    # The terms only match the text columns, or a search for "12" would
+    # return all of department 12. The department term scores the same for
+    # every row, so it does not change the order.
+    match = f'department_id : "{department_id}" AND {_TEXT_COLUMNS} : ({match})'
+    # bm25 rank: lower is a better match
+    return list(PatientRecords.objects.raw(
+        f'SELECT r.*, f.rank AS rank FROM {FTS_TABLE} f '
+        f'JOIN apis_patientrecords r ON r.id = f.rowid '
+        f'JOIN apis_patientprofile p ON p.id = r.patient_id '
+        f'WHERE {FTS_TABLE} MATCH %s AND r.department_id = %s AND p.deleted_at IS NULL '
+        f'ORDER BY f.rank LIMIT %s OFFSET %s',
+        [match, department_id, limit, offset],
+    ))
+
+
+def rebuild_index(using=None):
+    using = using or router.db_for_write(PatientRecords)
+    with connections[using].cursor() as cursor:
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+
+
+@contextmanager
+def deferred_index(using=None):
+    """
+    Drops the sync triggers for the duration of a bulk load and rebuilds the
+    index once at the end, which is much faster than indexing row by row.
+    """
+    using = using or router.db_for_write(PatientRecords)
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        yield
+        return
+    with connection.cursor() as cursor:
+        for suffix in ('insert', 'delete', 'update'):
+            cursor.execute(f'DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}')
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            for statement in FTS_TRIGGERS:
+                cursor.execute(statement)
+        rebuild_index(using)
@@ -1,5 +1,57 @@
 from rest_framework import serializers
-from .models import User, Department, DoctorProfile, PatientProfile, PatientRecords
+from rest_framework.validators import UniqueValidator
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from .models import User, Department, DoctorProfile, PatientProfile, PatientRecords, DepartmentStats
+from .tokens import CachedRefreshToken
+
+
+class SparseFieldsMixin:
+    """
+    Lets list endpoints return a subset of fields with ?fields=a,b or a
+    preset with ?view=summary. Views pass the result of get_requested_fields()
+    as `fields=` and narrow their queryset with restrict_queryset(), so the
+    columns nobody asked for are not read from the database at all.
+    """
+    summary_fields = ()
+    # Keys added in to_representation rather than declared as fields
+    extra_fields = ()
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.requested_fields = fields
+        if fields is not None:
+            for name in list(self.fields):
+                if name not in fields:
+                    self.fields.pop(name)
+
+    def wants(self, name):
+        return self.requested_fields is None or name in self.requested_fields
+
+    @classmethod
+    def get_requested_fields(cls, request):
+        # DRF requests have query_params, the plain Django ones in async_views only GET
+        params = getattr(request, 'query_params', request.GET)
+        view = params.get('view')
+        if view is not None:
+            if view != 'summary':
+                raise serializers.ValidationError({'view': ['The only supported view is summary.']})
+            return list(cls.summary_fields)
+
+        value = params.get('fields')
+        if value is None:
+            return None
+        fields = [name.strip() for name in value.split(',') if name.strip()]
+        available = list(cls().fields) + list(cls.extra_fields)
+        unknown = [name for name in fields if name not in available]
+        if not fields or unknown:
+            raise serializers.ValidationError({'fields': [f"Choose from: {', '.join(available)}."]})
+        return fields
+
+    @classmethod
+    def restrict_queryset(cls, queryset, fields, always=('id',)):
+        if fields is None:
+            return queryset
+        return queryset.only(*dict.fromkeys([*always, *fields]))
 
 
 
@@ -10,7 +62,9 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
     model = User
     fields=['email', 'name', 'password', 'password2', 'role']
     extra_kwargs={
-      'password':{'write_only':True}
+      'password':{'write_only':True},
+      # Soft-deleted users keep their email until they are purged
+      'email':{'validators':[UniqueValidator(queryset=User.all_objects.all())]},
     }
 
   # Validating Password and Confirm Password while Registration
@@ -43,6 +97,11 @@ class LogoutSerializer(serializers.Serializer):
         return attrs
     
 
+class RefreshSerializer(TokenRefreshSerializer):
+    # Checks the blacklist against the in-process cache
+    token_class = CachedRefreshToken
+
+
 # User Serializer
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -56,6 +115,12 @@ class DepartmentSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'diagnostics', 'location', 'specialization']
 
 
+class DepartmentStatsSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DepartmentStats
+        fields = ['department', 'doctors', 'patients', 'records', 'updated_at']
+
+
 
 class PatientRecordSerializer(serializers.ModelSerializer):
     class Meta:
@@ -116,7 +181,10 @@ class DoctorProfileSerializer(serializers.ModelSerializer):
     
 
 
-class PatientRecordSerializer(serializers.ModelSerializer):
+class PatientRecordSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    # Enough for a table of records, without the large text columns
+    summary_fields = ('id', 'patient', 'doctor', 'department', 'created_date', 'updated_at')
+
     class Meta:
         model = PatientRecords
         fields = '__all__'
@@ -128,53 +196,61 @@ class PatientRecordSerializer(serializers.ModelSerializer):
         # Ensure the doctor is in the same department as the patient
         if 'patient' in data:
             patient_profile = data['patient']
-            if patient_profile.department != doctor.doctorprofile.department:
+            if patient_profile.department_id != doctor.doctorprofile.department_id:
                 raise serializers.ValidationError("Doctor and patient must be in the same department.")
 
         return data
     
-class DoctorListSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = DoctorProfile
-        fields = ['id', 'user']
-        read_only_fields = ['id', 'user']
+class PatientRecordBulkItemSerializer(serializers.ModelSerializer):
+    # A plain id, patients are fetched for the whole batch at once by the view
+    patient = serializers.IntegerField()
 
-    def to_representation(self, instance):
-        representation = super().to_representation(instance)
-        representation['name'] = instance.user.name  # Assuming `name` field in User model
-        return representation
-    
-class PatientListSerializer(serializers.ModelSerializer):
     class Meta:
-        model = PatientProfile
-        fields = ['id', 'user']
-        read_only_fields = ['id', 'user']
+        model = PatientRecords
+        fields = ['patient', 'diagnostics', 'observations', 'treatments', 'misc']
 
-    def to_representation(self, instance):
-        representation = super().to_representation(instance)
-        representation['name'] = instance.user.name  # Assuming `name` field in User model
-        return representation
 
+class DoctorListSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    summary_fields = ('id', 'name')
+    extra_fields = ('name',)
 
-class DoctorListSerializer(serializers.ModelSerializer):
     class Meta:
         model = DoctorProfile
         fields = ['id', 'user', 'department']
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        # name and department name are read per row, join them in up front;
+        # only() keeps the joined users' and departments' other columns out
+        return queryset.select_related('user', 'department').only(
+            'id', 'user', 'department', 'user__name', 'department__name')
+
     def to_representation(self, instance):
         representation = super().to_representation(instance)
-        representation['name'] = instance.user.name  # Assuming `name` field in User model
-        representation['department'] = instance.department.name  # Assuming `name` field in Department model
+        if self.wants('name'):
+            representation['name'] = instance.user.name  # Assuming `name` field in User model
+        if self.wants('department'):
+            representation['department'] = instance.department.name if instance.department else None
         return representation
     
 
-class PatientListSerializer(serializers.ModelSerializer):
+class PatientListSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    summary_fields = ('id', 'name')
+    extra_fields = ('name',)
+
     class Meta:
         model = PatientProfile
         fields = ['id', 'user', 'department']
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        return queryset.select_related('user', 'department').only(
+            'id', 'user', 'department', 'user__name', 'department__name')
+
     def to_representation(self, instance):
         representation = super().to_representation(instance)
-        representation['name'] = instance.user.name  # Assuming `username` field in User model
-        representation['department'] = instance.department.name  # Assuming `name` field in Department model
-        return representation
\ No newline at end of file
+        if self.wants('name'):
+            representation['name'] = instance.user.name  # Assuming `username` field in User model
+        if self.wants('department'):
+            representation['department'] = instance.department.name if instance.department else None
+        return representation
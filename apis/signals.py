@@ -0,0 +1,131 @@
+from functools import partial
+
+from django.db.backends.signals import connection_created
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.db import transaction
+from django.dispatch import receiver
+
+from .authentication import user_cache
+from .cache import bump_version
+from .db import configure_connection
+from .metrics import record_query
+from .models import User, Department, DoctorProfile, PatientProfile, PatientRecords, DepartmentStats
+from . import events, stats
+
+# Marks a save that cannot have moved the row to another department
+UNCHANGED = object()
+
+
+@receiver([post_save, post_delete], sender=User)
+@receiver([post_save, post_delete], sender=Department)
+@receiver([post_save, post_delete], sender=DoctorProfile)
+@receiver([post_save, post_delete], sender=PatientProfile)
+def bump_cache_version(sender, using, **kwargs):
+    # After the commit, or a reader could cache the old rows under the new version
+    transaction.on_commit(partial(bump_version, sender._meta.label_lower), using=using)
+
+
+def evict_now_and_on_commit(evict, using):
+    # Now, so the rest of the transaction sees the change, and again once
+    # committed: a request that missed the cache in between has put the old
+    # row back, and would be served it until the TTL
+    evict()
+    transaction.on_commit(evict, using=using)
+
+
+@receiver([post_save, post_delete], sender=User)
+def evict_cached_user(sender, instance, using, **kwargs):
+    evict_now_and_on_commit(partial(user_cache.evict, instance.pk), using)
+
+
+@receiver([post_save, post_delete], sender=DoctorProfile)
+@receiver([post_save, post_delete], sender=PatientProfile)
+def evict_cached_profile_user(sender, instance, using, **kwargs):
+    evict_now_and_on_commit(partial(user_cache.evict, instance.user_id), using)
+
+
+@receiver([post_save, post_delete], sender=Department)
+def clear_cached_users(sender, using, **kwargs):
+    # Any cached user may hold this department, departments change rarely
+    evict_now_and_on_commit(user_cache.clear, using)
+
+
+@receiver(connection_created)
+def configure_new_connection(sender, connection, **kwargs):
+    configure_connection(connection)
+    # Counts queries and their time for the request metrics
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@receiver(post_save, sender=Department)
+def create_department_stats(sender, instance, created, **kwargs):
+    if created:
+        DepartmentStats.objects.get_or_create(department=instance)
+
+
+@receiver(pre_save, sender=DoctorProfile)
+@receiver(pre_save, sender=PatientProfile)
+@receiver(pre_save, sender=PatientRecords)
+def remember_department(sender, instance, using, update_fields, **kwargs):
+    # The department the row is counted under, to move the count if the save
+    # changes it. Only updates that may write the department read it back.
+    instance._stats_department_id = UNCHANGED
+    if instance._state.adding:
+        return
+    if update_fields is not None and not {'department', 'department_id'} & update_fields:
+        return
+    instance._stats_department_id = (
+        sender._base_manager.using(using).filter(pk=instance.pk).values_list('department_id', flat=True).first())
+
+
+def moved_from(instance, created):
+    """The department a saved row was counted under, or UNCHANGED."""
+    old = instance.__dict__.pop('_stats_department_id', UNCHANGED)
+    if created or old is UNCHANGED or old == instance.department_id:
+        return UNCHANGED
+    return old
+
+
+@receiver(post_save, sender=DoctorProfile)
+@receiver(post_save, sender=PatientProfile)
+def count_profile(sender, instance, created, **kwargs):
+    field = 'doctors' if sender is DoctorProfile else 'patients'
+    old = moved_from(instance, created)
+    if created:
+        stats.adjust_department(instance.department_id, **{field: 1})
+    elif old is not UNCHANGED:
+        stats.adjust_department(old, **{field: -1})
+        stats.adjust_department(instance.department_id, **{field: 1})
+
+
+@receiver(post_delete, sender=DoctorProfile)
+@receiver(post_delete, sender=PatientProfile)
+def uncount_profile(sender, instance, origin=None, **kwargs):
+    # Soft-deleted patients were uncounted when they were marked
+    if getattr(instance, 'deleted_at', None) is None and not stats.deleting_department(origin):
+        field = 'doctors' if sender is DoctorProfile else 'patients'
+        stats.adjust_department(instance.department_id, **{field: -1})
+
+
+@receiver(post_save, sender=PatientRecords)
+def count_record(sender, instance, created, **kwargs):
+    old = moved_from(instance, created)
+    if created:
+        stats.count_records(instance.department_id, stats.record_day(instance), 1)
+    elif old is not UNCHANGED:
+        day = stats.record_day(instance)
+        stats.count_records(old, day, -1)
+        stats.count_records(instance.department_id, day, 1)
+
+
+@receiver(post_delete, sender=PatientRecords)
+def uncount_record(sender, instance, origin=None, **kwargs):
+    if not stats.deleting_department(origin):
+        stats.count_records(instance.department_id, stats.record_day(instance), -1)
+
+
+@receiver([post_save, post_delete], sender=PatientRecords)
+def notify_record_streams(sender, using, **kwargs):
+    # The change is in the log once committed
+    transaction.on_commit(events.notify, using=using)
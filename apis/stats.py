@@ -0,0 +1,143 @@
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, QuerySet
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from apis.models import Department, DepartmentDailyRecords, DepartmentStats, DoctorProfile, PatientProfile, PatientRecords
+
+# DepartmentStats and DepartmentDailyRecords are maintained incrementally:
+# the signals in apis/signals.py apply a +1/-1 for every profile and record
+# saved or deleted, and code that inserts with bulk_create calls
+# records_added() itself. reconcile() rebuilds both tables from scratch, for
+# bulk loads that bypass both and to repair any drift.
+
+
+def deleting_department(origin):
+    # Cascades from a department delete remove its stats rows too
+    if isinstance(origin, QuerySet):
+        return origin.model is Department
+    return isinstance(origin, Department)
+
+
+def adjust_department(department_id, **deltas):
+    """
+    Adds deltas to the doctors/patients/records counts of a department.
+    Returns False if the department had no stats row yet and was counted
+    from scratch instead, in which case the change is already included.
+    """
+    deltas = {field: delta for field, delta in deltas.items() if delta}
+    if department_id is None or not deltas:
+        return True
+    changes = {field: F(field) + delta for field, delta in deltas.items()}
+    if DepartmentStats.objects.filter(pk=department_id).update(updated_at=timezone.now(), **changes):
+        return True
+    # Departments bulk inserted since the last reconcile have no row
+    recount_department(department_id)
+    return False
+
+
+def adjust_day(department_id, day, delta):
+    if department_id is None or not delta:
+        return
+    rows = DepartmentDailyRecords.objects.filter(department_id=department_id, day=day)
+    if rows.update(records=F('records') + delta):
+        return
+    try:
+        with transaction.atomic():
+            DepartmentDailyRecords.objects.create(department_id=department_id, day=day, records=delta)
+    except IntegrityError:
+        # Created concurrently
+        rows.update(records=F('records') + delta)
+
+
+def record_day(record):
+    return timezone.localdate(record.created_date)
+
+
+def count_records(department_id, day, delta):
+    if adjust_department(department_id, records=delta):
+        adjust_day(department_id, day, delta)
+
+
+def records_added(records):
+    """Counts a batch of records inserted with bulk_create."""
+    apply_record_counts([(record.department_id, record.created_date) for record in records], 1)
+
+
+def apply_record_counts(rows, sign):
+    """Applies (department_id, created_date) rows added (+1) or removed (-1) without signals."""
+    departments = Counter()
+    days = Counter()
+    for department_id, created_date in rows:
+        departments[department_id] += sign
+        days[department_id, timezone.localdate(created_date)] += sign
+    recounted = {department_id for department_id, delta in departments.items()
+                 if not adjust_department(department_id, records=delta)}
+    for (department_id, day), delta in days.items():
+        if department_id not in recounted:
+            adjust_day(department_id, day, delta)
+
+
+def count_rows(department_ids=None):
+    def per_department(rows):
+        rows = rows.exclude(department=None)
+        if department_ids is not None:
+            rows = rows.filter(department_id__in=department_ids)
+        return dict(rows.values_list('department_id').annotate(Count('id')).order_by())
+
+    # Soft-deleted patients are not counted, but their records stay counted
+    # until the purge deletes them
+    records = PatientRecords.all_objects.all()
+    if department_ids is not None:
+        records = records.filter(department_id__in=department_ids)
+    days = {
+        (department_id, day): count for department_id, day, count in
+        records.annotate(day=TruncDate('created_date')).values_list('department_id', 'day')
+        .annotate(Count('id')).order_by()
+    }
+    return per_department(DoctorProfile.objects.all()), per_department(PatientProfile.objects.all()), per_department(records), days
+
+
+def recount_department(department_id):
+    if not Department.objects.filter(pk=department_id).exists():
+        return
+    doctors, patients, records, days = count_rows([department_id])
+    DepartmentStats.objects.update_or_create(department_id=department_id, defaults={
+        'doctors': doctors.get(department_id, 0),
+        'patients': patients.get(department_id, 0),
+        'records': records.get(department_id, 0),
+    })
+    for (_, day), count in days.items():
+        DepartmentDailyRecords.objects.update_or_create(department_id=department_id, day=day,
+                                                        defaults={'records': count})
+
+
+def reconcile():
+    """
+    Rebuilds the stats tables from the source rows. Returns the number of
+    department and day rows that were wrong or missing.
+    """
+    with transaction.atomic():
+        doctors, patients, records, days = count_rows()
+        expected = {
+            department_id: (doctors.get(department_id, 0), patients.get(department_id, 0), records.get(department_id, 0))
+            for department_id in Department.objects.values_list('pk', flat=True)
+        }
+        current = {row[0]: row[1:] for row in DepartmentStats.objects.values_list('department_id', 'doctors', 'patients', 'records')}
+        current_days = {(row[0], row[1]): row[2] for row in DepartmentDailyRecords.objects.values_list('department_id', 'day', 'records')}
+        stale = sum(1 for key, value in expected.items() if current.get(key) != value)
+        stale_days = sum(1 for key in days.keys() | current_days.keys() if days.get(key, 0) != current_days.get(key, 0))
+
+        DepartmentStats.objects.all().delete()
+        DepartmentStats.objects.bulk_create([
+            DepartmentStats(department_id=department_id, doctors=counts[0], patients=counts[1], records=counts[2])
+            for department_id, counts in expected.items()
+        ])
+        DepartmentDailyRecords.objects.all().delete()
+        DepartmentDailyRecords.objects.bulk_create([
+            DepartmentDailyRecords(department_id=department_id, day=day, records=count)
+            for (department_id, day), count in days.items()
+        ], batch_size=10000)
+    return stale, stale_days
@@ -1,3 +1,1315 @@
-from django.test import TestCase
+import asyncio
+import base64
+import csv
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from collections import Counter
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.db.models import F
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .authentication import user_cache
+from .db import apply_pragmas, register_functions
+from . import events
+from .events import hub, latest_seq, notify
+from .fields import CompressedValue
+from .metrics import registry
+from .search import search_records
+from .stats import reconcile
+from . import routers
+from .tokens import blacklist_cache
+from .renderers import dumps
+from .models import User, Department, DoctorProfile, PatientProfile, PatientRecords, DepartmentStats, DepartmentDailyRecords, RecordChange
+
+
+def create_department(name='Cardiology'):
+    return Department.objects.create(name=name, diagnostics='ECG', location='Block A', specialization='Heart')
+
+
+def create_doctor(email, department, name='Doctor'):
+    user = User.objects.create_user(email=email, name=name, role='Doctor', password='secret')
+    user.doctorprofile.department = department
+    user.doctorprofile.save()
+    return user
+
+
+def create_patient(email, department, name='Patient'):
+    user = User.objects.create_user(email=email, name=name, role='Patient', password='secret')
+    user.patientprofile.department = department
+    user.patientprofile.save()
+    return user.patientprofile
+
+
+def create_record(patient, doctor, **kwargs):
+    fields = {'diagnostics': 'diagnostics', 'observations': 'observations', 'treatments': 'treatments'}
+    fields.update(kwargs)
+    return PatientRecords.objects.create(
+        patient=patient, doctor=doctor.doctorprofile, department=patient.department, **fields)
+
+
+def authenticate(client, user):
+    client.credentials(HTTP_AUTHORIZATION='Bearer ' + str(RefreshToken.for_user(user).access_token))
+
+
+# A cache of their own: the configured one may be serving a dev server, and
+# it outlives the test database
+test_cache = override_settings(CACHES={'default': {
+    'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+    'LOCATION': tempfile.mkdtemp(prefix='apis-tests-cache-'),
+}})
+
+
+def setUpModule():
+    test_cache.enable()
+
+
+def tearDownModule():
+    shutil.rmtree(settings.CACHES['default']['LOCATION'], ignore_errors=True)
+    test_cache.disable()
+
+
+class QueryBudgetTests(TestCase):
+    # Each list endpoint has a fixed query budget that must not grow with the
+    # number of rows returned: auth (with a cold user cache) + one query for
+    # the page, plus the department lookup for the department lists and the
+    # validator aggregate for the record feed.
+    budgets = {
+        '/departments/': 2,
+        '/doctors/': 2,
+        '/patients/': 2,
+        '/patient_records/': 3,
+        '/department/{pk}/doctors/': 3,
+        '/department/{pk}/patients/': 3,
+    }
+
+    def setUp(self):
+        cache.clear()
+        self.department = create_department()
+        self.doctor = create_doctor('doctor@example.com', self.department)
+        self.client = APIClient()
+        authenticate(self.client, self.doctor)
+        self.seq = 0
+
+    def add_rows(self, count):
+        # The list caches are invalidated once the writes commit
+        with self.captureOnCommitCallbacks(execute=True):
+            for _ in range(count):
+                self.seq += 1
+                create_department(name=f'Department {self.seq}')
+                create_doctor(f'doctor{self.seq}@example.com', self.department)
+                patient = create_patient(f'patient{self.seq}@example.com', self.department)
+                create_record(patient, self.doctor)
+
+    def assertBudget(self, url):
+        user_cache.clear()
+        with self.assertNumQueries(self.budgets[url]):
+            response = self.client.get(url.format(pk=self.department.pk))
+        self.assertEqual(response.status_code, 200)
+
+    def test_list_endpoints_cost_constant_queries(self):
+        for rows in (1, 10):
+            self.add_rows(rows)
+            for url in self.budgets:
+                with self.subTest(url=url, rows=self.seq):
+                    self.assertBudget(url)
+
+    def test_profiles_without_department_are_listed(self):
+        User.objects.create_user(email='unassigned@example.com', name='Unassigned', role='Doctor', password='secret')
+        response = self.client.get('/doctors/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(None, [doctor['department'] for doctor in response.json()])
+
+
+class UserCacheTests(TestCase):
+    def setUp(self):
+        user_cache.clear()
+        self.department = create_department()
+        self.doctor = create_doctor('doctor@example.com', self.department)
+        self.client = APIClient()
+        authenticate(self.client, self.doctor)
+
+    def test_cached_user_resolves_profile_without_queries(self):
+        self.client.get('/patient_records/')
+        # only the validator and page queries remain
+        with self.assertNumQueries(2):
+            self.assertEqual(self.client.get('/patient_records/').status_code, 200)
+
+    def test_profile_change_evicts_user(self):
+        create_patient('patient@example.com', self.department)
+        self.assertEqual(len(self.client.get(f'/department/{self.department.pk}/patients/').json()['results']), 1)
+        other = create_department(name='Neurology')
+        profile = DoctorProfile.objects.get(user=self.doctor)
+        profile.department = other
+        profile.save()
+        self.assertEqual(self.client.get(f'/department/{self.department.pk}/patients/').status_code, 403)
+
+    def test_deactivated_user_is_rejected(self):
+        self.client.get('/patient_records/')
+        self.doctor.is_active = False
+        self.doctor.save()
+        self.assertEqual(self.client.get('/patient_records/').status_code, 401)
+
+
+    def test_user_cached_again_before_commit_is_evicted_on_commit(self):
+        self.client.get('/patient_records/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.doctor.is_active = False
+            self.doctor.save()
+            # A concurrent request, still seeing the active user, caches it again
+            user_cache.set(self.doctor.pk, User.objects.get(pk=self.doctor.pk))
+        self.assertIsNone(user_cache.get(self.doctor.pk))
+
+
+class VersionedCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.department = create_department()
+        self.client = APIClient()
+
+    def test_cached_list_is_served_without_queries(self):
+        first = self.client.get('/departments/')
+        with self.assertNumQueries(0):
+            second = self.client.get('/departments/')
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(second['Content-Type'], 'application/json')
+
+    def test_save_and_delete_invalidate(self):
+        self.client.get('/departments/')
+        with self.captureOnCommitCallbacks(execute=True):
+            create_department(name='Neurology')
+        self.assertEqual(len(self.client.get('/departments/').json()), 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.department.delete()
+        self.assertEqual(len(self.client.get('/departments/').json()), 1)
+
+    def test_related_models_invalidate(self):
+        doctor = create_doctor('doctor@example.com', self.department, name='Before')
+        self.client.get('/doctors/')
+        doctor.name = 'After'
+        with self.captureOnCommitCallbacks(execute=True):
+            doctor.save()
+        self.assertEqual(self.client.get('/doctors/').json()[0]['name'], 'After')
+        self.department.name = 'Renamed'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.department.save()
+        self.assertEqual(self.client.get('/doctors/').json()[0]['department'], 'Renamed')
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_local_memory_backend(self):
+        self.client.get('/departments/')
+        with self.assertNumQueries(0):
+            self.client.get('/departments/')
+        with self.captureOnCommitCallbacks(execute=True):
+            create_department(name='Neurology')
+        self.assertEqual(len(self.client.get('/departments/').json()), 2)
+
+    def test_versions_are_bumped_on_commit(self):
+        self.client.get('/departments/')
+        with self.captureOnCommitCallbacks() as callbacks:
+            create_department(name='Neurology')
+            # Not yet committed: still the old version
+            self.assertEqual(len(self.client.get('/departments/').json()), 1)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(len(self.client.get('/departments/').json()), 2)
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.department = create_department()
+        self.doctor = create_doctor('doctor@example.com', self.department)
+        patient = create_patient('patient@example.com', self.department)
+        self.records = [create_record(patient, self.doctor, diagnostics=str(i)) for i in range(5)]
+        self.client = APIClient()
+        authenticate(self.client, self.doctor)
+
+    def pages(self, url):
+        ids = []
+        while url:
+            page = self.client.get(url).json()
+            ids.extend(record['id'] for record in page['results'])
+            url = page['next']
+        return ids
+
+    def test_cursor_walks_every_record_once_in_order(self):
+        self.assertEqual(self.pages('/patient_records/?page_size=2'), [record.pk for record in self.records])
+
+    def test_equal_timestamps_are_ordered_by_id(self):
+        # Ties on created_date must neither repeat nor skip a row at a page boundary
+        PatientRecords.objects.update(created_date=self.records[0].created_date)
+        self.assertEqual(self.pages('/patient_records/?page_size=2'), [record.pk for record in self.records])
+
+    @override_settings(PAGINATION_MAX_PAGE_SIZE=3)
+    def test_page_size_is_capped(self):
+        page = self.client.get('/patient_records/?page_size=1000').json()
+        self.assertEqual(len(page['results']), 3)
+        self.assertIsNotNone(page['next'])
+
+    def test_malformed_cursor_is_rejected(self):
+        tampered = base64.urlsafe_b64encode(b'["not a date", 1]').decode('ascii')
+        for cursor in ('not-base64!', tampered, base64.urlsafe_b64encode(b'[1]').decode('ascii')):
+            self.assertEqual(self.client.get(f'/patient_records/?cursor={cursor}').status_code, 400)
+
+
+class RendererTests(TestCase):
+    def test_validation_errors_keep_envelope(self):
+        response = APIClient().post('/login/', {'email': 'not-an-email'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.json()), {'errors'})
+        self.assertIn('email', response.json()['errors'])
+
+    def test_success_payload_is_not_wrapped(self):
+        create_doctor('doctor@example.com', create_department())
+        response = APIClient().post('/login/', {'email': 'doctor@example.com', 'password': 'secret'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['msg'], 'Login Success')
+
+    def test_backends_encode_datetimes_alike(self):
+        created = timezone.now().replace(microsecond=123456)
+        data = {'created': created, 'day': created.date(), 'at': created.time()}
+        encoded = dumps(data)
+        with mock.patch('apis.renderers.orjson', None):
+            self.assertEqual(encoded, dumps(data))
+        self.assertTrue(json.loads(encoded)['created'].endswith('.123456Z'))
+
+
+class RecordExportTests(TestCase):
+    def setUp(self):
+        self.department = create_department()
+        self.doctor = create_doctor('doctor@example.com', self.department)
+        patient = create_patient('patient@example.com', self.department)
+        for i in range(3):
+            create_record(patient, self.doctor, diagnostics=f'diagnostics {i}')
+        other = create_department(name='Neurology')
+        create_record(create_patient('other.patient@example.com', other), create_doctor('other.doctor@example.com', other))
+        self.client = APIClient()
+        authenticate(self.client, self.doctor)
+
+    def export(self, query=''):
+        response = self.client.get('/patient_records/export/' + query)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode('utf-8')
+
+    def test_ndjson_is_scoped_to_department(self):
+        lines = self.export().splitlines()
+        self.assertEqual([json.loads(line)['diagnostics'] for line in lines],
+                         ['diagnostics 0', 'diagnostics 1', 'diagnostics 2'])
+
+    def test_csv_with_date_range(self):
+        rows = self.export('?output=csv&since=2000-01-01').splitlines()
+        self.assertEqual(rows[0].split(',')[0], 'id')
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(self.export('?output=csv&until=2000-01-01').splitlines()[1:], [])
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.client.get('/patient_records/export/?output=xml').status_code, 400)
+        self.assertEqual(self.client.get('/patient_records/export/?since=yesterday').status_code, 400)
+
+
+class RecordBulkCreateTests(TestCase):
+    def setUp(self):
+        self.department = create_department()
+        self.doctor = create_doctor('doctor@example.com', self.department)
+        self.patient = create_patient('patient@example.com', self.department)
+        self.outsider = create_patient('outsider@example.com', create_department(name='Neurology'))
+        self.client = APIClient()
+        authenticate(self.client, self.doctor)
+
+    def item(self, patient_id, **kwargs):
+        item = {'patient': patient_id, 'diagnostics': 'd', 'observations': 'o', 'treatments': 't'}
+        item.update(kwargs)
+        return item
+
+    def test_batch_is_validated_and_inserted_in_constant_queries(self):
+        items = [self.item(self.patient.pk, diagnostics=str(i)) for i in range(50)]
+        # auth, patients lookup, savepoint + insert + release, and per
+        # department the stats update plus the day's update (+ savepoint,
+        # insert, release for the day's first records)
+        user_cache.clear()
+        with self.assertNumQueries(10):
+            response = self.client.post('/patient_records/bulk/', items, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(PatientRecords.objects.filter(department=self.department).count(), 50)
+        self.assertTrue(all(result['record']['id'] for result in response.json()['results']))
+
+    def test_partial_failures_are_reported_per_item(self):
+        items = [self.item(self.patient.pk), self.item(self.outsider.pk), self.item(0), {'patient': self.patient.pk}]
+        response = self.client.post('/patient_records/bulk/', items, format='json')
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([result['status'] for result in response.json()['results']],
+                         ['created', 'error', 'error', 'error'])
+        self.assertEqual(PatientRecords.objects.count(), 1)
+
+    def test_rejects_non_list_body(self):
+        response = self.client.post('/patient_records/bulk/', self.item(self.patient.pk), format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_rejects_doctor_without_department(self):
+        doctor = create_doctor('unassigned@example.com', None)
+        patient = create_patient('unassigned-patient@example.com', None)
+        authenticate(self.client, doctor)
+        response = self.client.post('/patient_records/bulk/', [self.item(patient.pk)], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"error": "You must be assigned to a department to create records."})
+        self.assertFalse(PatientRecords.objects.exists())
+
+
+class TokenRefreshTests(TestCase):
+    def setUp(self):
+        blacklist_cache.clear()
+        self.doctor = create_doctor('doctor@example.com', create_department())
+        self.refresh = RefreshToken.for_user(self.doctor)
+        self.client = APIClient()
+
+    def test_refresh_skips_the_database_when_not_revoked(self):
+        self.client.post('/token/refresh/', {'refresh': str(self.refresh)}, format='json')
+        with self.assertNumQueries(0):
+            response = self.client.post('/token/refresh/', {'refresh': str(self.refresh)}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('access', response.json())
+
+    def test_logout_revokes_refresh_token(self):
+        authenticate(self.client, self.doctor)
+        response = self.client.post('/logout/', {'refresh': str(self.refresh)}, format='json')
+        self.assertEqual(response.status_code, 205)
+        response = self.client.post('/token/refresh/', {'refresh': str(self.refresh)}, format='json')
+        self.assertEqual(response.status_code, 401)
+
+    def test_blacklisting_elsewhere_is_picked_up_on_sync(self):
+        blacklist_cache.sync(force=True)
+        RefreshToken(str(self.refresh)).blacklist()
+        blacklist_cache.sync(force=True)
+        response = self.client.post('/token/refresh/', {'refresh': str(self.refresh)}, format='json')
+        self.assertEqual(response.status_code, 401)
+
+
+class PruneTokensTests(TestCase):
+    def test_expired_tokens_are_deleted_in_batches(self):
+        doctor = create_doctor('doctor@example.com', create_department())
+        for _ in range(3):
+            RefreshToken.for_user(doctor).blacklist()
+        live = RefreshToken.for_user(doctor)
+        OutstandingToken.objects.exclude(jti=live['jti']).update(expires_at=timezone.now() - timedelta(days=1))
+        out = io.StringIO()
+        call_command('prune_tokens', batch_size=2, stdout=out)
+        self.assertIn('Pruned 3 expired outstanding and 3 blacklisted tokens', out.getvalue())
+        self.assertEqual(list(OutstandingToken.objects.values_list('jti', flat=True)), [live['jti']])
+        self.assertFalse(BlacklistedToken.objects.exists())
+
+
+class AsyncAuthViewTests(TestCase):
+    def test_register_then_login(self):
+        response = self.client.post('/async/register/', {
+            'email': 'doctor@example.com', 'name': 'Doctor', 'role': 'Doctor',
+            'password': 'secret', 'password2': 'secret'}, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertIn('access', response.json()['token'])
+        user = User.objects.get(email='doctor@example.com')
+        self.assertTrue(user.check_password('secret'))
+        self.assertTrue(DoctorProfile.objects.filter(user=user).exists())
+
+        response = self.client.post('/async/login/', {'email': 'doctor@example.com', 'password': 'secret'},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['msg'], 'Login Success')
+
+    def test_errors_use_the_errors_envelope(self):
+        response = self.client.post('/async/register/', {
+            'email': 'doctor@example.com', 'name': 'Doctor', 'role': 'Doctor',
+            'password': 'secret', 'password2': 'other'}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('non_field_errors', response.json()['errors'])
+
+        response = self.client.post('/async/login/', {'email': 'nobody@example.com', 'password': 'secret'},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json(), {'errors': {'non_field_errors': ['Email or Password is not Valid']}})
+
+
+class AsyncReadViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.department = create_department()
+        self.doctor = create_doctor('doctor@example.com', self.department)
+        self.patient = create_patient('patient@example.com', self.department)
+        self.record = create_record(self.patient, self.doctor)
+        self.client = APIClient()
+        authenticate(self.client, self.doctor)
+
+    def test_async_views_match_sync_views(self):
+        for url in ['/departments/', '/doctors/', '/patients/', '/patient_records/',
+                    f'/patient_records/{self.record.pk}/', f'/patients/{self.patient.pk}/']:
+            with self.subTest(url=url):
+                expected = self.client.get(url)
+                response = self.client.get('/async' + url)
+                self.assertEqual(response.status_code, expected.status_code)
+                self.assertEqual(response.json(), expected.json())
+
+    def test_department_scoping_and_authentication(self):
+        outsider = create_patient('outsider@example.com', create_department(name='Neurology'))
+        self.assertEqual(self.client.get(f'/async/patients/{outsider.pk}/').status_code, 403)
+        self.assertEqual(self.client.get('/async/patient_records/0/').status_code, 404)
+        response = APIClient().get('/async/patient_records/')
+        self.assertEqual(response.status_code, 401)
+        self.assertIn('detail', response.json()['errors'])
+
+
+class SQLiteConcurrencyTests(SimpleTestCase):
+    def connect(self, path, pragmas):
+        connection = sqlite3.connect(path, timeout=0, isolation_level=None)
+        apply_pragmas(connection.cursor(), pragmas)
+        # Fail immediately instead of waiting, so a blocked read shows up as an error
+        connection.execute('PRAGMA busy_timeout = 0')
+        return connection
+
+    def read_during_write(self, pragmas):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'db.sqlite3')
+            writer = self.connect(path, pragmas)
+            writer.execute('CREATE TABLE records (id INTEGER PRIMARY KEY, body TEXT)')
+            writer.execute("INSERT INTO records (body) VALUES ('committed')")
+            reader = self.connect(path, pragmas)
+            try:
+                writer.execute('BEGIN EXCLUSIVE')
+                writer.execute("INSERT INTO records (body) VALUES ('pending')")
+                try:
+                    return reader.execute('SELECT body FROM records').fetchall()
+                finally:
+                    writer.execute('COMMIT')
+            finally:
+                writer.close()
+                reader.close()
+
+    def test_readers_are_not_blocked_by_writers_in_wal_mode(self):
+        self.assertEqual(self.read_during_write(settings.SQLITE_PRAGMAS), [('committed',)])
+
+    def test_readers_block_with_rollback_journal(self):
+        with self.assertRaisesMessage(sqlite3.OperationalError, 'database is locked'):
+            self.read_during_write(dict(settings.SQLITE_PRAGMAS, journal_mode='DELETE'))
+
+
+class ConnectionPragmaTests(TestCase):
+    def pragma(self, cursor, name):
+        cursor.execute(f'PRAGMA {name}')
+        return cursor.fetchone()[0]
+
+    def test_django_connection_is_configured(self):
+        with connection.cursor() as cursor:
+            self.assertEqual(self.pragma(cursor, 'busy_timeout'), settings.SQLITE_PRAGMAS['busy_timeout'])
+            self.assertEqual(self.pragma(cursor, 'cache_size'), settings.SQLITE_PRAGMAS['cache_size'])
+
+    def test_file_database_is_in_wal_mode(self):
+        # The test database is in memory, which has no WAL; open the same
+        # backend on a file so connection_created configures it the same way
+        with tempfile.TemporaryDirectory() as directory:
+            settings_dict = dict(connection.settings_dict, NAME=os.path.join(directory, 'db.sqlite3'))
+            wal_connection = type(connections['default'])(settings_dict, alias='wal')
+            try:
+                with wal_connection.cursor() as cursor:
+                    self.assertEqual(self.pragma(cursor, 'journal_mode'), 'wal')
+                    self.assertEqual(self.pragma(cursor, 'synchronous'), 1)  # NORMAL
+            finally:
+                wal_connection.close()
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.router = routers.PrimaryReplicaRouter()
+
+    def test_reads_go_to_replica_and_writes_to_primary(self):
+        token = routers.begin_request()
+        try:
+            self.assertEqual(self.router.db_for_read(PatientRecords), 'replica')
+            self.assertEqual(self.router.db_for_write(PatientRecords), 'default')
+            # the rest of the request reads its own writes
+            self.assertEqual(self.router.db_for_read(PatientRecords), 'default')
+        finally:
+            routers.end_request(token)
+
+    def test_writer_is_pinned_to_primary_on_later_requests(self):
+        token = routers.begin_request()
+        routers.set_user(42)
+        self.router.db_for_write(PatientRecords)
+        routers.end_request(token)
+
+        for user_id, expected in ((42, 'default'), (7, 'replica')):
+            token = routers.begin_request()
+            try:
+                routers.set_user(user_id)
+                self.assertEqual(self.router.db_for_read(PatientRecords), expected)
+            finally:
+                routers.end_request(token)
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_without_replicas_everything_uses_default(self):
+        self.assertEqual(self.router.db_for_read(PatientRecords), 'default')
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_process_local_cache_keeps_reads_on_primary(self):
+        # The pin would not reach the worker serving the user's next request
+        token = routers.begin_request()
+        try:
+            self.assertEqual(self.router.db_for_read(PatientRecords), 'default')
+        finally:
+            routers.end_request(token)
+
+
+class RecordSearchTests(TestCase):
+    def setUp(self):
+        self.department = create_department()
+        self.doctor = create_doctor('doctor@example.com', self.department)
+        patient = create_patient('patient@example.com', self.department)
+        self.chest = create_record(patient, self.doctor, diagnostics='Acute chest pain', treatments='Aspirin')
+        self.knee = create_record(patient, self.doctor, diagnostics='Knee injury', observations='Swelling, chest clear')
+        other = create_department(name='Neurology')
+        create_record(create_patient('other.patient@example.com', other),
+                      create_doctor('other.doctor@example.com', other), diagnostics='Chest pain')
+        self.client = APIClient()
+        authenticate(self.client, self.doctor)
+
+    def search(self, query):
+        response = self.client.get('/patient_records/search/' + query)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_ranked_and_scoped_to_department(self):
+        ids = [record['id'] for record in self.search('?q=chest')['results']]
+        self.assertEqual(ids, [self.chest.pk, self.knee.pk])
+        self.assertEqual([r['id'] for r in self.search('?q=chest+pains')['results']], [self.chest.pk])
+
+    def test_other_departments_do_not_match(self):
+        other = Department.objects.get(name='Neurology')
+        doctor = DoctorProfile.objects.get(department=other).user
+        patient = PatientProfile.objects.get(department=other)
+        # Better matches elsewhere take none of this department's page
+        for _ in range(3):
+            create_record(patient, doctor, diagnostics='Chest chest chest')
+        self.assertEqual([r['id'] for r in self.search('?q=chest&page_size=1')['results']], [self.chest.pk])
+        self.assertEqual(len(search_records(self.department.pk, 'chest', 10)), 2)
+        # nor does the department's id, it is not searched as text
+        self.assertEqual(search_records(self.department.pk, str(self.department.pk), 10), [])
+
+        # A record moved to another department is found there
+        self.knee.department = other
+        self.knee.save()
+        self.assertEqual([r.pk for r in search_records(self.department.pk, 'knee', 10)], [])
+        self.assertEqual([r.pk for r in search_records(other.pk, 'knee', 10)], [self.knee.pk])
+
+    def test_index_follows_updates_and_deletes(self):
+        self.knee.diagnostics = 'Fractured femur'
+        self.knee.save()
+        self.assertEqual([r['id'] for r in self.search('?q=femur')['results']], [self.knee.pk])
+        self.knee.delete()
+        self.assertEqual(self.search('?q=femur')['results'], [])
+
+    def test_pagination_and_prefix(self):
+        page = self.search('?q=ches*&page_size=1')
+        self.assertEqual(len(page['results']), 1)
+        self.assertIsNotNone(page['next'])
+        self.assertEqual(len(self.search('?q=ches*&page_size=1&page=2')['results']), 1)
+
+    def test_fts_syntax_is_not_injected(self):
+        # OR is searched for as a word, not parsed as an operator
+        self.assertEqual(self.search('?q=chest" OR "knee')['results'], [])
+        self.assertEqual(len(self.search('?q=chest)(')['results']), 2)
+        self.assertEqual(self.client.get('/patient_records/search/').status_code, 400)
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        self.department = create_department()
+        self.doctor = create_doctor('doctor@example.com', self.department)
+        self.patient = create_patient('patient@example.com', self.department)
+        self.record = create_record(self.patient, self.doctor)
+        self.client = APIClient()
+        authenticate(self.client, self.doctor)
+        self.client.get('/patient_records/')  # warm the user cache
+
+    def assertRevalidates(self, url, change, queries):
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        self.assertIn('ETag', first)
+        with self.assertNumQueries(queries):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+        change()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], first['ETag'])
+
+    def test_record_feed(self):
+        self.assertRevalidates('/patient_records/', lambda: create_record(self.patient, self.doctor), 1)
+
+    def test_record_feed_validator_does_not_read_records(self):
+        etag = self.client.get('/patient_records/')['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get('/patient_records/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual([query['sql'] for query in queries.captured_queries if 'apis_patientrecords' in query['sql']], [])
+
+    def test_record_feed_detects_deletes(self):
+        create_record(self.patient, self.doctor)
+        self.assertRevalidates('/patient_records/', self.record.delete, 1)
+
+    def test_record_detail(self):
+        def change():
+            self.record.treatments = 'Changed'
+            self.record.save()
+        self.assertRevalidates(f'/patient_records/{self.record.pk}/', change, 1)
+
+    def test_record_detail_if_modified_since(self):
+        first = self.client.get(f'/patient_records/{self.record.pk}/')
+        response = self.client.get(f'/patient_records/{self.record.pk}/', HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_patient_detail_follows_user_name(self):
+        def change():
+            user = self.patient.user
+            user.name = 'Renamed'
+            user.save()
+        self.assertRevalidates(f'/patients/{self.patient.pk}/', change, 1)
+
+    def test_patient_detail_follows_department_name(self):
+        def change():
+            self.department.name = 'Renamed'
+            self.department.save()
+        self.assertRevalidates(f'/patients/{self.patient.pk}/', change, 1)
+        self.assertNotIn('Last-Modified', self.client.get(f'/patients/{self.patient.pk}/'))
+
+
+class SparseFieldsTests(TestCase):
+    def setUp(self):
+        self.department = create_department()
+        self.doctor = create_doctor('doctor@example.com', self.department)
+        self.patient = create_patient('patient@example.com', self.department)
+        self.record = create_record(self.patient, self.doctor)
+        self.client = APIClient()
+        authenticate(self.client, self.doctor)
+
+    def test_summary_view_skips_text_columns(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/patient_records/?view=summary')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.json()['results'][0]),
+                         {'id', 'patient', 'doctor', 'department', 'created_date', 'updated_at'})
+        page_query = queries.captured_queries[-1]['sql']
+        self.assertNotIn('diagnostics', page_query)
+        self.assertNotIn('observations', page_query)
+
+    def test_requested_fields_and_paging(self):
+        create_record(self.patient, self.doctor)
+        page = self.client.get('/patient_records/?fields=id,treatments&page_size=1').json()
+        self.assertEqual(set(page['results'][0]), {'id', 'treatments'})
+        self.assertEqual(len(self.client.get(page['next']).json()['results']), 1)
+
+    def test_profile_lists(self):
+        response = self.client.get(f'/department/{self.department.pk}/patients/?fields=id,name')
+        self.assertEqual(response.json()['results'], [{'id': self.patient.pk, 'name': 'Patient'}])
+        response = self.client.get('/doctors/?view=summary')
+        self.assertEqual(set(response.json()[0]), {'id', 'name'})
+        response = self.client.get('/async/patients/?fields=department')
+        self.assertEqual(response.json(), [{'department': 'Cardiology'}])
+
+    def test_unknown_fields_are_rejected(self):
+        self.assertEqual(self.client.get('/patient_records/?fields=id,password').status_code, 400)
+        self.assertEqual(self.client.get('/patient_records/?view=full').status_code, 400)
+        self.assertEqual(self.client.get('/async/patient_records/?fields=secret').status_code, 400)
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        registry.clear()
+        self.department = create_department()
+        self.client = APIClient()
+
+    def scrape(self):
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def test_views_are_recorded_with_query_counts(self):
+        response = self.client.get('/departments/')
+        self.assertRegex(response['Server-Timing'], r'db;dur=[\d.]+;desc="\d+ queries", app;dur=[\d.]+')
+        self.client.get('/departments/')
+        self.client.get('/async/departments/')
+
+        text = self.scrape()
+        labels = 'view="department-list-create",method="GET",status="200"'
+        self.assertIn(f'apis_request_duration_seconds_count{{{labels}}} 2', text)
+        self.assertIn(f'apis_request_duration_seconds_bucket{{{labels},le="+Inf"}} 2', text)
+        self.assertIn(f'apis_response_size_bytes_count{{{labels}}} 2', text)
+        # The async view's query runs in a worker thread and is still counted
+        self.assertIn('apis_db_queries_total{view="async-department-list",method="GET",status="200"} 1', text)
+
+    def test_workers_are_merged_from_metrics_dir(self):
+        self.client.get('/departments/')
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            registry.flush(directory)
+            # Another worker's file, named after its pid
+            os.rename(os.path.join(directory, f'metrics-{os.getpid()}.json'),
+                      os.path.join(directory, 'metrics-1.json'))
+            registry.clear()
+            self.client.get('/departments/')
+            text = self.scrape()
+        self.assertIn('apis_request_duration_seconds_count{view="department-list-create",method="GET",status="200"} 2', text)
+
+    def test_scraping_is_restricted(self):
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.1').status_code, 403)
+
+    @override_settings(METRICS_TOKEN='scrape-secret')
+    def test_scraping_requires_token_when_set(self):
+        # What a reverse proxy on the same host forwards
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape-secret').status_code, 200)
+
+
+class ImportUsersTests(TestCase):
+    def setUp(self):
+        self.department = create_department()
+        create_doctor('existing@example.com', self.department)
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'users.csv')
+
+    def write(self, rows):
+        with open(self.path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['email', 'name', 'role', 'password', 'department'])
+            writer.writerows(rows)
+
+    def run_import(self, **options):
+        out, err = io.StringIO(), io.StringIO()
+        call_command('import_users', self.path, batch_size=2, workers=1, stdout=out, stderr=err, **options)
+        return out.getvalue(), err.getvalue()
+
+    def test_bad_rows_are_skipped_not_the_batch(self):
+        self.write([
+            ['doctor@example.com', 'Doctor', 'Doctor', 'secret', self.department.pk],
+            ['existing@example.com', 'Existing', 'Doctor', 'secret', self.department.pk],
+            ['unknown@example.com', 'Unknown', 'Patient', 'secret', 999],
+            ['patient@example.com', 'Patient', 'Patient', 'secret', self.department.pk],
+            ['named@example.com', 'Named', 'Patient', 'secret', 'Cardiology'],
+            ['unassigned@example.com', 'Unassigned', 'Patient', 'secret', ''],
+        ])
+        out, err = self.run_import()
+        self.assertIn('Imported 3 users', out)
+        self.assertIn('Row 3: department 999 does not exist', err)
+        self.assertIn("Row 5: department must be a department id, not 'Cardiology'", err)
+        self.assertEqual(set(User.objects.values_list('email', flat=True)), {
+            'existing@example.com', 'doctor@example.com', 'patient@example.com', 'unassigned@example.com'})
+        self.assertTrue(User.objects.get(email='doctor@example.com').check_password('secret'))
+        self.assertEqual(PatientProfile.objects.get(user__email='patient@example.com').department, self.department)
+        self.assertEqual(reconcile(), (0, 0))
+
+    def test_workers_start_under_spawn(self):
+        self.write([['spawned@example.com', 'Spawned', 'Doctor', 'secret', self.department.pk]])
+        with mock.patch('multiprocessing.get_context', return_value=multiprocessing.get_context('spawn')):
+            out, err = self.run_import()
+        self.assertIn('Imported 1 users', out)
+        self.assertTrue(User.objects.get(email='spawned@example.com').check_password('secret'))
+
+    def test_resume_starts_after_the_last_committed_batch(self):
+        self.write([
+            ['first@example.com', 'First', 'Patient', 'secret', self.department.pk],
+            ['second@example.com', 'Second', 'Patient', 'secret', self.department.pk],
+            ['third@example.com', 'Third', 'Patient', 'secret', self.department.pk],
+        ])
+        with open(f'{self.path}.checkpoint', 'w') as f:
+            f.write('2')
+        out, _ = self.run_import(resume=True)
+        self.assertIn('Resuming after row 2', out)
+        self.assertEqual(list(User.objects.filter(role='Patient').values_list('email', flat=True)), ['third@example.com'])
+        with open(f'{self.path}.checkpoint') as f:
+            self.assertEqual(f.read(), '3')
+
+
+class GenerateDataTests(TestCase):
+    def generate(self, seed=1):
+        call_command('generate_data', seed=seed, departments=4, doctors=6, patients=40, records=500,
+                     batch_size=120, stdout=io.StringIO())
+        return list(PatientRecords.objects.order_by('id').values_list(
+            'patient__user__email', 'doctor__user__email', 'department__name', 'created_date', 'diagnostics'))
+
+    def test_dataset_is_consistent_and_searchable(self):
+        self.generate()
+        self.assertEqual(PatientRecords.objects.count(), 500)
+        self.assertEqual(PatientProfile.objects.count(), 40)
+        for department in Department.objects.all():
+            self.assertTrue(department.doctorprofile_set.exists())
+            self.assertTrue(department.patientprofile_set.exists())
+        self.assertFalse(PatientRecords.objects.exclude(department=F('patient__department')).exists())
+        self.assertFalse(PatientRecords.objects.exclude(department=F('doctor__department')).exists())
+        # Skewed: the first department is the largest
+        sizes = Counter(PatientRecords.objects.values_list('department_id', flat=True))
+        self.assertEqual(max(sizes, key=sizes.get), Department.objects.order_by('id').first().pk)
+
+        # The search triggers are back and the index covers the generated rows
+        department = Department.objects.order_by('id').first()
+        self.assertTrue(search_records(department.pk, 'ordered', 10))
+
+        # Users and profiles joined when the first record was written
+        start = PatientRecords.objects.order_by('id').values_list('created_date', flat=True).first()
+        self.assertEqual(set(User.objects.values_list('created_at', flat=True)), {start})
+        self.assertEqual(set(PatientProfile.objects.values_list('updated_at', flat=True)), {start})
+        user = create_doctor('doctor@example.com', department)
+        self.assertGreater(user.created_at, start)
+        create_record(department.patientprofile_set.first(), user, diagnostics='zygomycosis')
+        self.assertEqual(len(search_records(department.pk, 'zygomycosis', 10)), 1)
+
+    def test_same_seed_same_data(self):
+        first = self.generate()
+        User.objects.all().delete()
+        Department.objects.all().delete()
+        self.assertEqual(self.generate(), first)
+        with self.assertRaises(CommandError):
+            self.generate()
+
+
+class DepartmentStatsTests(TestCase):
+    def setUp(self):
+        self.department = create_department()
+        self.other = create_department(name='Neurology')
+        self.doctor = create_doctor('doctor@example.com', self.department)
+        self.patient = create_patient('patient@example.com', self.department)
+        self.client = APIClient()
+        authenticate(self.client, self.doctor)
+
+    def stats(self, department=None):
+        return DepartmentStats.objects.get(pk=(department or self.department).pk)
+
+    def test_counts_follow_saves_moves_and_deletes(self):
+        create_patient('unassigned@example.com', None)
+        record = create_record(self.patient, self.doctor)
+        create_record(self.patient, self.doctor)
+        stats = self.stats()
+        self.assertEqual((stats.doctors, stats.patients, stats.records), (1, 1, 2))
+
+        self.patient.department = self.other
+        self.patient.save()
+        record.delete()
+        self.assertEqual((self.stats().patients, self.stats().records), (0, 1))
+        self.assertEqual(self.stats(self.other).patients, 1)
+
+        self.doctor.delete()  # cascades to the doctor's profile and records
+        stats = self.stats()
+        self.assertEqual((stats.doctors, stats.records), (0, 0))
+        self.assertEqual(DepartmentDailyRecords.objects.get(department=self.department).records, 0)
+
+        # Deleting a department takes its stats along
+        self.other.delete()
+        self.assertFalse(DepartmentStats.objects.filter(pk=self.other.pk).exists())
+        self.assertEqual(reconcile(), (0, 0))
+
+    def test_profiles_created_in_a_department_are_counted(self):
+        # Not through create_user, whose profiles start without a department
+        for index, model in enumerate((DoctorProfile, PatientProfile)):
+            user = User.objects.create(email=f'admin{index}@example.com', name='Admin', role='Admin')
+            model.objects.create(user=user, department=self.other)
+        stats = self.stats(self.other)
+        self.assertEqual((stats.doctors, stats.patients), (1, 1))
+        self.assertEqual(reconcile(), (0, 0))
+
+    def test_department_is_read_back_only_when_it_may_change(self):
+        record = create_record(self.patient, self.doctor)
+        record.treatments = 'rest'
+        with self.assertNumQueries(1):
+            record.save(update_fields=['treatments'])
+
+        record.department = self.other
+        record.save(update_fields=['department'])
+        self.assertEqual((self.stats().records, self.stats(self.other).records), (0, 1))
+
+        # A row loaded without its department is saved without it
+        patient = PatientProfile.objects.only('id').get(pk=self.patient.pk)
+        patient.save()
+        self.assertEqual(self.stats().patients, 1)
+        self.assertEqual(reconcile(), (0, 0))
+
+    def test_endpoint_reads_only_the_summary_tables(self):
+        for _ in range(3):
+            create_record(self.patient, self.doctor)
+        self.client.get(f'/department/{self.department.pk}/stats/')  # warm the user cache
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/department/{self.department.pk}/stats/?days=7')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual((data['doctors'], data['patients'], data['records']), (1, 1, 3))
+        self.assertEqual(len(data['records_per_day']), 7)
+        self.assertEqual(data['records_per_day'][-1]['records'], 3)
+
+        self.assertEqual(self.client.get(f'/department/{self.other.pk}/stats/').status_code, 403)
+
+    def test_reconcile_repairs_drift(self):
+        create_record(self.patient, self.doctor)
+        DepartmentStats.objects.filter(pk=self.department.pk).update(records=7)
+        DepartmentDailyRecords.objects.all().delete()
+        out = io.StringIO()
+        call_command('reconcile_stats', stdout=out)
+        self.assertIn('1 department and 1 daily rows', out.getvalue())
+        self.assertEqual(self.stats().records, 1)
+        self.assertEqual(DepartmentDailyRecords.objects.get().records, 1)
+
+
+class DepartmentScopedLookupTests(TestCase):
+    def setUp(self):
+        self.department = create_department()
+        other = create_department(name='Neurology')
+        self.doctor = create_doctor('doctor@example.com', self.department)
+        self.record = create_record(create_patient('patient@example.com', self.department), self.doctor)
+        other_doctor = create_doctor('other@example.com', other)
+        self.other_patient = create_patient('other-patient@example.com', other)
+        self.other_record = create_record(self.other_patient, other_doctor)
+        self.client = APIClient()
+        authenticate(self.client, self.doctor)
+        self.client.get('/patient_records/')  # warm the user cache
+
+    def test_permitted_lookup_is_one_query(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(f'/patient_records/{self.record.pk}/')
+        self.assertEqual(response.json()['id'], self.record.pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(f'/async/patient_records/{self.record.pk}/').status_code, 200)
+
+    def test_forbidden_and_missing_keep_their_responses(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/patient_records/{self.other_record.pk}/')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.json(), {"message": "You do not have permission to access this record."})
+        response = self.client.delete(f'/patient_records/{self.other_record.pk}/')
+        self.assertEqual(response.json(), {"message": "You do not have permission to delete this record."})
+        self.assertTrue(PatientRecords.objects.filter(pk=self.other_record.pk).exists())
+
+        response = self.client.get('/patient_records/999/')
+        self.assertEqual((response.status_code, response.json()), (404, {"message": "Record does not exist."}))
+        self.assertEqual(self.client.get('/async/patient_records/999/').status_code, 404)
+
+        response = self.client.put(f'/patients/{self.other_patient.pk}/', {}, format='json')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.json(), {"error": "You do not have permission to update this patient profile."})
+        self.assertEqual(self.client.get('/patients/999/').status_code, 404)
+
+    def test_unassigned_patients_are_visible(self):
+        patient = create_patient('unassigned@example.com', None)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(f'/patients/{patient.pk}/').status_code, 200)
+        self.assertEqual(self.client.get(f'/async/patients/{patient.pk}/').status_code, 200)
+        self.assertEqual(self.client.get(f'/async/patients/{self.other_patient.pk}/').status_code, 403)
+
+
+class SoftDeleteTests(TestCase):
+    def setUp(self):
+        self.department = create_department()
+        self.doctor = create_doctor('doctor@example.com', self.department)
+        self.patient = create_patient('patient@example.com', self.department)
+        self.records = [create_record(self.patient, self.doctor) for _ in range(5)]
+        self.client = APIClient()
+        authenticate(self.client, self.doctor)
+
+    def test_delete_hides_patient_user_and_records(self):
+        self.client.get('/patients/')  # cached, the delete must invalidate it
+        token = self.client.get('/patient_records/changes/').json()['token']
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete(f'/patients/{self.patient.pk}/')
+        self.assertEqual(response.status_code, 204)
+        # The records are only read, to tombstone them in the change log
+        self.assertFalse([query for query in queries.captured_queries
+                          if query['sql'].startswith(('UPDATE "apis_patientrecords"', 'DELETE FROM "apis_patientrecords"'))])
+
+        self.assertEqual(PatientRecords.all_objects.filter(patient_id=self.patient.pk).count(), 5)
+        self.assertFalse(PatientProfile.objects.filter(pk=self.patient.pk).exists())
+        self.assertFalse(User.objects.filter(email='patient@example.com').exists())
+        self.assertEqual(self.client.get(f'/patients/{self.patient.pk}/').status_code, 404)
+        self.assertEqual(self.client.get('/patients/').json(), [])
+        self.assertEqual(DepartmentStats.objects.get(pk=self.department.pk).patients, 0)
+
+        # Their records are gone from every record endpoint at once
+        self.assertFalse(PatientRecords.objects.exists())
+        self.assertEqual(self.client.get('/patient_records/').json(), {"message": "No records exist for your department."})
+        self.assertEqual(self.client.get(f'/patient_records/{self.records[0].pk}/').status_code, 404)
+        self.assertEqual(search_records(self.department.pk, 'diagnostics', 10), [])
+        export = self.client.get('/patient_records/export/')
+        self.assertEqual(b''.join(export.streaming_content), b'')
+        changes = self.client.get('/patient_records/changes/', {'since': token}).json()
+        self.assertEqual((changes['changed'], sorted(changes['deleted'])), ([], [record.pk for record in self.records]))
+
+        # The user can no longer log in and the email is still taken until the purge
+        response = self.client.post('/login/', {'email': 'patient@example.com', 'password': 'secret'}, format='json')
+        self.assertEqual(response.status_code, 404)
+        response = self.client.post('/register/', {'email': 'patient@example.com', 'name': 'New', 'role': 'Patient',
+                                                   'password': 'x', 'password2': 'x'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_purge_deletes_records_in_batches(self):
+        self.client.delete(f'/patients/{self.patient.pk}/')
+        out = io.StringIO()
+        call_command('purge_deleted', batch_size=2, stdout=out)
+        self.assertIn('and 5 records', out.getvalue())
+
+        self.assertFalse(PatientRecords.objects.exists())
+        self.assertFalse(PatientProfile.all_objects.filter(pk=self.patient.pk).exists())
+        self.assertFalse(User.all_objects.filter(email='patient@example.com').exists())
+        stats = DepartmentStats.objects.get(pk=self.department.pk)
+        self.assertEqual((stats.patients, stats.records), (0, 0))
+        self.assertEqual(reconcile(), (0, 0))
+        self.assertEqual(search_records(self.department.pk, 'diagnostics', 10), [])
+
+
+class CompressedTextTests(TestCase):
+    def setUp(self):
+        self.department = create_department()
+        self.doctor = create_doctor('doctor@example.com', self.department)
+        self.patient = create_patient('patient@example.com', self.department)
+        self.text = 'Patient reports intermittent chest pain on exertion. ' * 20
+        self.record = create_record(self.patient, self.doctor, observations=self.text, misc=None)
+
+    def stored(self, column):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT {column} FROM apis_patientrecords WHERE id = %s', [self.record.pk])
+            return cursor.fetchone()[0]
+
+    def test_record_writes_need_apis_decompress(self):
+        # A connection Django did not open, like the sqlite3 CLI's
+        raw = sqlite3.connect(':memory:')
+        self.addCleanup(raw.close)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT sql FROM sqlite_master WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%' "
+                "AND NOT (type = 'table' AND name GLOB 'apis_patientrecords_fts_*') "
+                "AND type IN ('table', 'view', 'trigger') ORDER BY type = 'trigger', type = 'view'")
+            raw.executescript(';'.join(sql for sql, in cursor.fetchall()))
+            cursor.execute('SELECT * FROM apis_patientrecords WHERE id = %s', [self.record.pk])
+            row = cursor.fetchone()
+        insert = 'INSERT INTO apis_patientrecords VALUES (%s)' % ', '.join('?' * len(row))
+        with self.assertRaisesMessage(sqlite3.OperationalError, 'no such function: apis_decompress'):
+            raw.execute(insert, row)
+        register_functions(raw)
+        raw.execute(insert, row)
+        matches = raw.execute("SELECT rowid FROM apis_patientrecords_fts WHERE apis_patientrecords_fts MATCH 'chest'")
+        self.assertEqual(matches.fetchall(), [(self.record.pk,)])
+
+    def test_stored_compressed_and_read_back(self):
+        stored = self.stored('observations')
+        self.assertIsInstance(stored, bytes)
+        self.assertLess(len(stored), len(self.text) / 5)
+        self.assertIsNone(self.stored('misc'))
+
+        record = PatientRecords.objects.get(pk=self.record.pk)
+        self.assertEqual(record.observations, self.text)
+        self.assertIsNone(record.misc)
+        self.assertIsInstance(PatientRecords.objects.values_list('observations', flat=True).get(), CompressedValue)
+
+        client = APIClient()
+        authenticate(client, self.doctor)
+        data = client.get(f'/patient_records/{self.record.pk}/').json()
+        self.assertEqual((data['observations'], data['diagnostics']), (self.text, 'diagnostics'))
+        self.assertEqual([r.pk for r in search_records(self.department.pk, 'exertion', 10)], [self.record.pk])
+
+    def test_unread_values_saved_as_stored(self):
+        stored = self.stored('observations')
+        record = PatientRecords.objects.get(pk=self.record.pk)
+        record.diagnostics = 'Angina'
+        record.save()
+        self.assertEqual(self.stored('observations'), stored)
+        self.assertEqual(PatientRecords.objects.get(pk=self.record.pk).diagnostics, 'Angina')
+
+    def test_plain_text_rows_still_readable(self):
+        # As left by an interrupted 0009, before its batch reached the row
+        with connection.cursor() as cursor:
+            cursor.execute('UPDATE apis_patientrecords SET diagnostics = %s WHERE id = %s', ['Legacy angina', self.record.pk])
+        self.assertEqual(PatientRecords.objects.get(pk=self.record.pk).diagnostics, 'Legacy angina')
+        self.assertEqual([r.pk for r in search_records(self.department.pk, 'angina', 10)], [self.record.pk])
+
+
+class RecordChangesTests(TestCase):
+    def setUp(self):
+        self.department = create_department()
+        self.doctor = create_doctor('doctor@example.com', self.department)
+        self.patient = create_patient('patient@example.com', self.department)
+        self.records = [create_record(self.patient, self.doctor, diagnostics=f'diagnostics {i}') for i in range(3)]
+        other = create_department(name='Neurology')
+        self.other_doctor = create_doctor('other.doctor@example.com', other)
+        self.other_patient = create_patient('other.patient@example.com', other)
+        create_record(self.other_patient, self.other_doctor)
+        self.client = APIClient()
+        authenticate(self.client, self.doctor)
+
+    def changes(self, token=None, **params):
+        if token is not None:
+            params['since'] = token
+        response = self.client.get('/patient_records/changes/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_full_sync_in_pages_then_nothing(self):
+        first = self.changes(limit=2)
+        self.assertTrue(first['more'])
+        second = self.changes(first['token'], limit=2)
+        self.assertFalse(second['more'])
+        self.assertEqual([record['id'] for record in first['changed'] + second['changed']],
+                         [record.pk for record in self.records])
+
+        idle = self.changes(second['token'])
+        self.assertEqual((idle['token'], idle['changed'], idle['deleted']), (second['token'], [], []))
+
+    def test_updates_and_deletes_since_token(self):
+        token = self.changes()['token']
+        record = self.records[0]
+        self.client.put(f'/patient_records/{record.pk}/', {'diagnostics': 'Updated'}, format='json')
+        self.client.put(f'/patient_records/{record.pk}/', {'diagnostics': 'Updated again'}, format='json')
+        self.assertEqual(self.client.delete(f'/patient_records/{self.records[1].pk}/').status_code, 204)
+        # Another department's writes are not in this feed
+        create_record(self.other_patient, self.other_doctor)
+
+        changes = self.changes(token, fields='id,diagnostics')
+        self.assertEqual(changes['changed'], [{'id': record.pk, 'diagnostics': 'Updated again'}])
+        self.assertEqual(changes['deleted'], [self.records[1].pk])
+        self.assertEqual(self.changes(changes['token'])['changed'], [])
+
+    def test_bulk_writes_and_department_moves(self):
+        token = self.changes()['token']
+        response = self.client.post('/patient_records/bulk/', [
+            {'patient': self.patient.pk, 'diagnostics': 'Bulk', 'observations': 'o', 'treatments': 't'},
+        ], format='json')
+        created = response.json()['results'][0]['record']['id']
+        moved = self.records[2]
+        PatientRecords.objects.filter(pk=moved.pk).update(department=self.other_patient.department)
+
+        changes = self.changes(token)
+        self.assertEqual([record['id'] for record in changes['changed']], [created])
+        self.assertEqual(changes['deleted'], [moved.pk])
+        self.assertTrue(RecordChange.objects.filter(record_id=moved.pk, deleted=False,
+                                                    department_id=self.other_patient.department_id).exists())
+
+    def test_invalid_token(self):
+        self.assertEqual(self.client.get('/patient_records/changes/?since=abc').status_code, 400)
+        self.assertEqual(self.client.get('/patient_records/changes/?since=-1').status_code, 400)
+
+
+@override_settings(EVENTS_MAX_STREAM_SECONDS=2)
+class RecordEventStreamTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.department = create_department()
+        self.doctor = create_doctor('doctor@example.com', self.department)
+        self.patient = create_patient('patient@example.com', self.department)
+        other = create_department(name='Neurology')
+        self.other_doctor = create_doctor('other.doctor@example.com', other)
+        self.other_patient = create_patient('other.patient@example.com', other)
+        self.headers = {'Authorization': 'Bearer ' + str(RefreshToken.for_user(self.doctor).access_token)}
+
+    async def open_stream(self, **headers):
+        response = await self.async_client.get('/async/patient_records/events/', headers={**self.headers, **headers})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        return response.streaming_content
+
+    async def next_event(self, stream):
+        while True:
+            chunk = (await asyncio.wait_for(anext(stream), 5)).decode()
+            if not chunk.startswith(':'):
+                return dict(line.split(': ', 1) for line in chunk.strip().split('\n'))
+
+    async def finish(self, stream):
+        # Runs out after EVENTS_MAX_STREAM_SECONDS, which unsubscribes
+        async for _ in stream:
+            pass
+
+    async def test_pushes_changes_of_the_department(self):
+        stream = await self.open_stream()
+        ready = await self.next_event(stream)
+        self.assertEqual(ready['event'], 'ready')
+
+        # The other department's record is written first and must not show up
+        await sync_to_async(create_record)(self.other_patient, self.other_doctor)
+        record = await sync_to_async(create_record)(self.patient, self.doctor, diagnostics='Live')
+        notify()  # TestCase never commits, so on_commit does not call it
+        event = await self.next_event(stream)
+        self.assertEqual(event['event'], 'record')
+        self.assertEqual(json.loads(event['data'])['diagnostics'], 'Live')
+        self.assertGreater(int(event['id']), int(ready['id']))
+
+        record_id = record.pk
+        await sync_to_async(record.delete)()
+        notify()
+        event = await self.next_event(stream)
+        self.assertEqual((event['event'], json.loads(event['data'])), ('deleted', {'id': record_id}))
+        await self.finish(stream)
+
+    async def test_resumes_after_last_event_id(self):
+        token = await sync_to_async(latest_seq)()
+        record = await sync_to_async(create_record)(self.patient, self.doctor)
+        await sync_to_async(create_record)(self.other_patient, self.other_doctor)
+
+        stream = await self.open_stream(**{'Last-Event-ID': str(token)})
+        event = await self.next_event(stream)
+        self.assertEqual((event['event'], json.loads(event['data'])['id']), ('record', record.pk))
+        self.assertEqual((await self.next_event(stream))['event'], 'ready')
+        await self.finish(stream)
+
+    async def test_concurrent_first_subscribers_share_the_hub(self):
+        # Both connect while the hub is cold, neither may reset the other
+        first, second = await asyncio.gather(self.open_stream(), self.open_stream())
+        for stream in (first, second):
+            self.assertEqual((await self.next_event(stream))['event'], 'ready')
+        self.assertEqual(len(hub.subscribers[self.department.pk]), 2)
+        self.assertEqual(len(hub.tasks), 2)
+
+        record = await sync_to_async(create_record)(self.patient, self.doctor)
+        notify()
+        for stream in (first, second):
+            self.assertEqual(json.loads((await self.next_event(stream))['data'])['id'], record.pk)
+        await asyncio.gather(self.finish(first), self.finish(second))
+        self.assertEqual((hub.subscribers, hub.tasks), ({}, []))
+
+    async def test_department_joining_during_a_read_misses_nothing(self):
+        stream = await self.open_stream()
+        await self.next_event(stream)
+        # Committed before the read below, which only covers the first department
+        record = await sync_to_async(create_record)(self.other_patient, self.other_doctor)
+        read_events = events.read_events
+
+        def slow_read(department_ids, after):
+            result = read_events(department_ids, after)
+            time.sleep(0.3)
+            return result
+
+        with mock.patch.object(events, 'read_events', slow_read):
+            hub.wake()
+            await asyncio.sleep(0.1)
+            joined = await hub.subscribe(self.other_patient.department_id)
+            await asyncio.sleep(0.4)
+        hub.wake()
+        event = await joined.get(5)
+        self.assertEqual((event.name, event.data['id']), ('record', record.pk))
+        joined.close()
+        await self.finish(stream)
+
+    def test_refused_outside_asgi(self):
+        client = APIClient()
+        authenticate(client, self.doctor)
+        self.assertEqual(client.get('/async/patient_records/events/').status_code, 501)
+        response = self.client.get('/async/patient_records/events/', HTTP_LAST_EVENT_ID='x',
+                                   HTTP_AUTHORIZATION=self.headers['Authorization'])
+        self.assertEqual(response.status_code, 501)
@@ -0,0 +1,80 @@
+import threading
+import time
+
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.utils import aware_utcnow, datetime_from_epoch
+
+
+class BlacklistCache:
+    """
+    In-process copy of the blacklisted refresh token JTIs.
+
+    The first lookup loads the whole blacklist; after that, at most once every
+    `sync_interval` seconds, only rows with a higher id than the last one seen
+    are fetched, so blacklisting done by other workers shows up within that
+    interval. Tokens blacklisted by this process are added immediately.
+    Entries are dropped once the token has expired, at which point the token
+    is rejected by its own `exp` claim anyway.
+    """
+
+    def __init__(self, sync_interval):
+        self.sync_interval = sync_interval
+        self.jtis = {}
+        self.last_id = 0
+        self.synced_at = None
+        self.lock = threading.Lock()
+
+    def sync(self, force=False):
+        now = time.monotonic()
+        if not force and self.synced_at is not None and now - self.synced_at < self.sync_interval:
+            return
+        with self.lock:
+            if not force and self.synced_at is not None and now - self.synced_at < self.sync_interval:
+                return
+            rows = BlacklistedToken.objects.filter(id__gt=self.last_id).order_by('id').values_list(
+                'id', 'token__jti', 'token__expires_at')
+            for row_id, jti, expires_at in rows:
+                self.jtis[jti] = expires_at
+                self.last_id = row_id
+            current = aware_utcnow()
+            for jti in [jti for jti, expires_at in self.jtis.items() if expires_at <= current]:
+                del self.jtis[jti]
+            self.synced_at = now
+
+    def add(self, jti, expires_at):
+        with self.lock:
+            self.jtis[jti] = expires_at
+
+    def __contains__(self, jti):
+        self.sync()
+        return jti in self.jtis
+
+    def clear(self):
+        with self.lock:
+            self.jtis.clear()
+            self.last_id = 0
+            self.synced_at = None
+
+
+blacklist_cache = BlacklistCache(settings.BLACKLIST_SYNC_INTERVAL)
+
+
+class CachedRefreshToken(RefreshToken):
+    """
+    RefreshToken whose blacklist check is answered from `blacklist_cache`
+    instead of a query per verification.
+    """
+
+    def check_blacklist(self):
+        if self.payload[api_settings.JTI_CLAIM] in blacklist_cache:
+            raise TokenError(_("Token is blacklisted"))
+
+    def blacklist(self):
+        result = super().blacklist()
+        blacklist_cache.add(self.payload[api_settings.JTI_CLAIM], datetime_from_epoch(self.payload['exp']))
+        return result
@@ -5,15 +5,44 @@ from apis.serializers import  *
 from django.contrib.auth import authenticate
 from apis.renderers import UserRenderer
 from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.views import TokenRefreshView
+from apis.tokens import CachedRefreshToken
 from rest_framework.permissions import IsAuthenticated
 from .models import *
-from django.shortcuts import get_object_or_404
-from rest_framework import generics
 from django.shortcuts import redirect
+from django.http import HttpResponse, HttpResponseForbidden, StreamingHttpResponse
+from django.conf import settings
+from django.db import transaction
+from apis.pagination import KeysetPagination
+from apis.cache import VersionedCacheMixin
+from apis.conditional import ConditionalGetMixin, make_etag
+from apis.scoping import DepartmentScopedMixin
+from apis.deletion import soft_delete_patient
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+from datetime import timedelta
+from apis.export import EXPORT_FORMATS, export_queryset, iter_export, parse_bound
+from apis.search import search_records
+from apis.changes import changes_since
+from apis.events import notify as notify_record_streams
+from apis.stats import records_added
+from rest_framework.utils.urls import replace_query_param
+from apis.metrics import registry, render_prometheus
 
 
 # Create your views here.
 
+def metrics_view(request):
+    # Prometheus scrape target; per-view stats are recorded by apis.middleware.metrics_middleware
+    if request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+        return HttpResponseForbidden()
+    # Behind a reverse proxy every request comes from its address, only the token tells scrapers apart
+    if settings.METRICS_TOKEN and not constant_time_compare(
+            request.META.get('HTTP_AUTHORIZATION', ''), f'Bearer {settings.METRICS_TOKEN}'):
+        return HttpResponseForbidden()
+    return HttpResponse(render_prometheus(registry.collect()), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 def get_tokens_for_user(user):
   refresh = RefreshToken.for_user(user)
   return {
@@ -58,7 +87,7 @@ class LogoutView(APIView):
         serializer.is_valid(raise_exception=True)
         refresh_token = serializer.validated_data['refresh']
         try:
-            token = RefreshToken(refresh_token)
+            token = CachedRefreshToken(refresh_token)
             token.blacklist()
 
             return Response({"msg": "Logout successful"}, status=status.HTTP_205_RESET_CONTENT)
@@ -67,9 +96,21 @@ class LogoutView(APIView):
 
 
 
+class RefreshView(TokenRefreshView):
+    serializer_class = RefreshSerializer
+    renderer_classes = [UserRenderer]
+
+
+
 # List and Create Departments (Function-Based)
-class DepartmentListCreateView(APIView):
+class DepartmentListCreateView(VersionedCacheMixin, APIView):
+    cache_models = (Department,)
+
     def get(self, request):
+        cached = self.cached_response()
+        if cached is not None:
+            return cached
+
         departments = Department.objects.all()
         serializer = DepartmentSerializer(departments, many=True)
         return Response(serializer.data)
@@ -83,22 +124,38 @@ class DepartmentListCreateView(APIView):
 
 
 
-class PatientRecordView(APIView):
+class PatientRecordView(ConditionalGetMixin, APIView):
     permission_classes = [IsAuthenticated]
     renderer_classes = [UserRenderer]  # Use the custom renderer
 
     def get(self, request, *args, **kwargs):
         doctor = request.user
-        department = doctor.doctorprofile.department
-
-        # Fetch all records where the patient is in the same department as the doctor
-        records = PatientRecords.objects.filter(department=department)
-        
-        if not records.exists():
+        department_id = doctor.doctorprofile.department_id
+
+        # Fetch a page of records where the patient is in the same department as the doctor
+        records = PatientRecords.objects.filter(department_id=department_id)
+        fields = PatientRecordSerializer.get_requested_fields(request)
+
+        # The department's latest entry in the change log identifies the
+        # feed's state, as creates, updates and deletes all add one. It is a
+        # single seek on the (department_id, seq) index, however large the
+        # department. No Last-Modified here, there is no time to give.
+        state = RecordChange.objects.filter(department_id=department_id).order_by('-seq').values_list('seq', flat=True).first()
+        not_modified = self.not_modified(request, etag=make_etag(request.get_full_path(), state))
+        if not_modified:
+            return not_modified
+
+        paginator = KeysetPagination(ordering=('created_date', 'id'))
+        # Only the requested columns are read; the cursor needs created_date
+        records = PatientRecordSerializer.restrict_queryset(records, fields, always=('id', 'created_date'))
+        page = paginator.paginate_queryset(records, request, view=self)
+
+        # An empty first page means the department has no records at all
+        if not page and paginator.cursor_query_param not in request.query_params:
             return Response({"message": "No records exist for your department."}, status=status.HTTP_200_OK)
-        
-        serializer = PatientRecordSerializer(records, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+
+        serializer = PatientRecordSerializer(page, many=True, fields=fields)
+        return paginator.get_paginated_response(serializer.data)
 
     def post(self, request, *args, **kwargs):
         doctor = request.user
@@ -109,47 +166,171 @@ class PatientRecordView(APIView):
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-class PatientDetailView(APIView):
+class PatientRecordBulkCreateView(APIView):
+    permission_classes = [IsAuthenticated]
+    renderer_classes = [UserRenderer]
+
+    def post(self, request, *args, **kwargs):
+        items = request.data
+        if not isinstance(items, list) or not items:
+            return Response({"error": "Expected a non-empty list of records."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > settings.BULK_CREATE_MAX_RECORDS:
+            return Response({"error": f"At most {settings.BULK_CREATE_MAX_RECORDS} records can be created per request."}, status=status.HTTP_400_BAD_REQUEST)
+
+        doctor = request.user.doctorprofile
+        # Records belong to the doctor's department; an unassigned doctor
+        # would otherwise match unassigned patients and fail the insert
+        if doctor.department_id is None:
+            return Response({"error": "You must be assigned to a department to create records."}, status=status.HTTP_400_BAD_REQUEST)
+        results = [None] * len(items)
+        valid = {}
+        for index, item in enumerate(items):
+            serializer = PatientRecordBulkItemSerializer(data=item)
+            if serializer.is_valid():
+                valid[index] = serializer.validated_data
+            else:
+                results[index] = {"index": index, "status": "error", "errors": serializer.errors}
+
+        # One query for every patient referenced in the batch
+        patient_ids = {data['patient'] for data in valid.values()}
+        departments = dict(PatientProfile.objects.filter(pk__in=patient_ids).values_list('pk', 'department_id'))
+
+        records = {}
+        for index, data in valid.items():
+            patient_id = data.pop('patient')
+            if patient_id not in departments:
+                results[index] = {"index": index, "status": "error", "errors": {"patient": ["Patient does not exist."]}}
+            elif departments[patient_id] != doctor.department_id:
+                results[index] = {"index": index, "status": "error", "errors": {"non_field_errors": ["Doctor and patient must be in the same department."]}}
+            else:
+                records[index] = PatientRecords(patient_id=patient_id, doctor=doctor, department_id=doctor.department_id, **data)
+
+        with transaction.atomic():
+            PatientRecords.objects.bulk_create(records.values())
+            # bulk_create skips the signals that keep the department stats
+            records_added(records.values())
+        # and the one that wakes the event streams once the records are committed
+        notify_record_streams()
+
+        for index, record in records.items():
+            results[index] = {"index": index, "status": "created", "record": PatientRecordSerializer(record).data}
+
+        if len(records) == len(items):
+            response_status = status.HTTP_201_CREATED
+        elif records:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+        return Response({"created": len(records), "failed": len(items) - len(records), "results": results}, status=response_status)
+
+class PatientRecordSearchView(APIView):
+    permission_classes = [IsAuthenticated]
+    renderer_classes = [UserRenderer]
+
+    def get(self, request, *args, **kwargs):
+        text = request.query_params.get('q', '').strip()
+        if not text:
+            return Response({"error": "The q parameter is required."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            page = max(int(request.query_params.get('page', 1)), 1)
+            page_size = int(request.query_params.get('page_size', settings.PAGINATION_PAGE_SIZE))
+        except ValueError:
+            return Response({"error": "page and page_size must be integers."}, status=status.HTTP_400_BAD_REQUEST)
+        page_size = min(max(page_size, 1), settings.PAGINATION_MAX_PAGE_SIZE)
+
+        # Best matches first, one query per page
+        records = search_records(request.user.doctorprofile.department_id, text, page_size + 1, (page - 1) * page_size)
+        results = []
+        for record in records[:page_size]:
+            data = PatientRecordSerializer(record).data
+            data['rank'] = record.rank
+            results.append(data)
+
+        next_link = None
+        if len(records) > page_size:
+            next_link = replace_query_param(request.build_absolute_uri(), 'page', page + 1)
+        return Response({"next": next_link, "results": results}, status=status.HTTP_200_OK)
+
+class PatientRecordChangesView(APIView):
+    permission_classes = [IsAuthenticated]
+    renderer_classes = [UserRenderer]
+
+    def get(self, request, *args, **kwargs):
+        # since is the token of the previous response; without one the feed
+        # starts from the beginning, a full sync in pages of limit changes
+        try:
+            since = int(request.query_params.get('since', 0))
+            limit = int(request.query_params.get('limit', settings.PAGINATION_PAGE_SIZE))
+        except ValueError:
+            return Response({"error": "since and limit must be integers."}, status=status.HTTP_400_BAD_REQUEST)
+        if since < 0:
+            return Response({"error": "Invalid since token."}, status=status.HTTP_400_BAD_REQUEST)
+        limit = min(max(limit, 1), settings.PAGINATION_MAX_PAGE_SIZE)
+        fields = PatientRecordSerializer.get_requested_fields(request)
+
+        # Reads only the changes after the token, from the change log's index
+        records, deleted, token, more = changes_since(request.user.doctorprofile.department_id, since, limit, fields)
+        return Response({
+            "token": str(token),
+            "more": more,
+            "changed": PatientRecordSerializer(records, many=True, fields=fields).data,
+            "deleted": deleted,
+        }, status=status.HTTP_200_OK)
+
+class PatientRecordExportView(APIView):
+    permission_classes = [IsAuthenticated]
+    renderer_classes = [UserRenderer]
+
+    def get(self, request, *args, **kwargs):
+        # `format` is taken by DRF's content negotiation, so the export format is `output`
+        export_format = request.query_params.get('output', 'ndjson')
+        if export_format not in EXPORT_FORMATS:
+            return Response({"error": f"Unsupported output format, use one of: {', '.join(EXPORT_FORMATS)}."}, status=status.HTTP_400_BAD_REQUEST)
+
+        bounds = {}
+        for param in ('since', 'until'):
+            if param in request.query_params:
+                bounds[param] = parse_bound(request.query_params[param])
+                if bounds[param] is None:
+                    return Response({"error": f"Invalid {param} date."}, status=status.HTTP_400_BAD_REQUEST)
+
+        rows = export_queryset(request.user.doctorprofile.department_id, **bounds)
+        response = StreamingHttpResponse(iter_export(rows, export_format), content_type=EXPORT_FORMATS[export_format])
+        response['Content-Disposition'] = f'attachment; filename="patient_records.{export_format}"'
+        return response
+
+class PatientDetailView(DepartmentScopedMixin, ConditionalGetMixin, APIView):
     renderer_classes = [UserRenderer]  # Use the custom renderer
+    # Patients without a department are open to every doctor
+    scope_allow_unassigned = True
+    scope_forbidden = {"error": "You do not have permission to {action} this patient profile."}
 
     def get(self, request, pk, *args, **kwargs):
-        doctor = request.user
-        patient = get_object_or_404(PatientProfile, pk=pk)
+        patient = self.get_scoped_object(PatientProfile.objects.select_related('user', 'department'), pk)
 
-        # Allow fetching if the department is the same or NULL
-        if patient.department is None or patient.department == doctor.doctorprofile.department:
-            serializer = PatientProfileSerializer(patient)
-            return Response(serializer.data, status=status.HTTP_200_OK)
-        else:
-            return Response({"error": "You do not have permission to view this patient profile."}, status=status.HTTP_403_FORBIDDEN)
+        # The payload also shows the user's name and the department's name.
+        # No Last-Modified: departments have no timestamp, a rename would not move it.
+        etag = make_etag('patient', pk, patient.updated_at, patient.user.updated_at, patient.department_id, patient.department)
+        not_modified = self.not_modified(request, etag=etag)
+        if not_modified:
+            return not_modified
 
-    def put(self, request, pk, *args, **kwargs):
-        doctor = request.user
-        patient = get_object_or_404(PatientProfile, pk=pk)
+        serializer = PatientProfileSerializer(patient)
+        return Response(serializer.data, status=status.HTTP_200_OK)
 
-        # Allow updating only if the doctor and patient are in the same department
-        if patient.department is None or patient.department == doctor.doctorprofile.department:
-            serializer = PatientProfileSerializer(patient, data=request.data, context={'request': request})
-            if serializer.is_valid():
-                serializer.save()
-                return Response(serializer.data, status=status.HTTP_200_OK)
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-        else:
-            return Response({"error": "You do not have permission to update this patient profile."}, status=status.HTTP_403_FORBIDDEN)
+    def put(self, request, pk, *args, **kwargs):
+        patient = self.get_scoped_object(PatientProfile.objects.select_related('user', 'department'), pk)
+        serializer = PatientProfileSerializer(patient, data=request.data, context={'request': request})
+        if serializer.is_valid():
+            serializer.save()
+            return Response(serializer.data, status=status.HTTP_200_OK)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     def delete(self, request, pk, *args, **kwargs):
-        doctor = request.user
-        patient = get_object_or_404(PatientProfile, pk=pk)
-
-        # Allow deletion if the department is the same or NULL
-        if patient.department is None or patient.department == doctor.doctorprofile.department:
-            user = patient.user
-            patient.delete()
-            user.delete()
-            return Response({"success": "Patient profile and associated user deleted successfully."}, status=status.HTTP_204_NO_CONTENT)
-        else:
-            return Response({"error": "You do not have permission to delete this patient profile."}, status=status.HTTP_403_FORBIDDEN)
-
+        patient = self.get_scoped_object(PatientProfile.objects.select_related('user'), pk)
+        # Only marked here, the records are removed later by purge_deleted
+        soft_delete_patient(patient)
+        return Response({"success": "Patient profile and associated user deleted successfully."}, status=status.HTTP_204_NO_CONTENT)
 
 class DoctorProfileView(APIView):
     permission_classes = [IsAuthenticated]
@@ -186,34 +367,25 @@ class DoctorProfileView(APIView):
     
 
 
-class PatientRecordDetailView(APIView):
+class PatientRecordDetailView(DepartmentScopedMixin, ConditionalGetMixin, APIView):
     permission_classes = [IsAuthenticated]
+    scope_not_found = {"message": "Record does not exist."}
+    scope_forbidden = {"message": "You do not have permission to {action} this record."}
+    scope_actions = dict(DepartmentScopedMixin.scope_actions, GET='access', HEAD='access')
 
     def get(self, request, pk, *args, **kwargs):
-        try:
-            record = PatientRecords.objects.get(pk=pk)
-        except PatientRecords.DoesNotExist:
-            return Response({"message": "Record does not exist."}, status=status.HTTP_404_NOT_FOUND)
+        # Only records of the doctor's department are found
+        record = self.get_scoped_object(PatientRecords.objects.all(), pk)
 
-        # Check if the requesting doctor is in the same department as the patient record
-        doctor = request.user
-        if record.department != doctor.doctorprofile.department:
-            return Response({"message": "You do not have permission to access this record."}, status=status.HTTP_403_FORBIDDEN)
+        not_modified = self.not_modified(request, etag=make_etag('record', pk, record.updated_at), last_modified=record.updated_at)
+        if not_modified:
+            return not_modified
 
         serializer = PatientRecordSerializer(record)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
     def put(self, request, pk, *args, **kwargs):
-        try:
-            record = PatientRecords.objects.get(pk=pk)
-        except PatientRecords.DoesNotExist:
-            return Response({"message": "Record does not exist."}, status=status.HTTP_404_NOT_FOUND)
-
-        # Check if the requesting doctor is in the same department as the patient record
-        doctor = request.user
-        if record.department != doctor.doctorprofile.department:
-            return Response({"message": "You do not have permission to update this record."}, status=status.HTTP_403_FORBIDDEN)
-
+        record = self.get_scoped_object(PatientRecords.objects.all(), pk)
         serializer = PatientRecordSerializer(record, data=request.data, partial=True, context={'request': request})
         if serializer.is_valid():
             serializer.save()
@@ -221,34 +393,38 @@ class PatientRecordDetailView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     def delete(self, request, pk, *args, **kwargs):
-        try:
-            record = PatientRecords.objects.get(pk=pk)
-        except PatientRecords.DoesNotExist:
-            return Response({"message": "Record does not exist."}, status=status.HTTP_404_NOT_FOUND)
-
-        # Check if the requesting doctor is in the same department as the patient record
-        doctor = request.user
-        if record.department != doctor.doctorprofile.department:
-            return Response({"message": "You do not have permission to delete this record."}, status=status.HTTP_403_FORBIDDEN)
-
+        record = self.get_scoped_object(PatientRecords.objects.all(), pk)
         record.delete()
         return Response({"message": "Record deleted successfully."}, status=status.HTTP_204_NO_CONTENT)
     
-class DoctorListView(APIView):
+class DoctorListView(VersionedCacheMixin, APIView):
+    cache_models = (DoctorProfile, User, Department)
+
     def get(self, request, *args, **kwargs):
-        doctors = DoctorProfile.objects.all()
-        serializer = DoctorListSerializer(doctors, many=True)
+        cached = self.cached_response()
+        if cached is not None:
+            return cached
+
+        fields = DoctorListSerializer.get_requested_fields(request)
+        doctors = DoctorListSerializer.setup_eager_loading(DoctorProfile.objects.all())
+        serializer = DoctorListSerializer(doctors, many=True, fields=fields)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
     def post(self, request, *args, **kwargs):
         # Redirect to the login URL (replace with your actual login URL)
         return redirect('register')
 
-class PatientListView(APIView):
+class PatientListView(VersionedCacheMixin, APIView):
+    cache_models = (PatientProfile, User, Department)
+
     def get(self, request, *args, **kwargs):
+        cached = self.cached_response()
+        if cached is not None:
+            return cached
 
-        patients = PatientProfile.objects.all()
-        serializer = PatientListSerializer(patients, many=True)
+        fields = PatientListSerializer.get_requested_fields(request)
+        patients = PatientListSerializer.setup_eager_loading(PatientProfile.objects.all())
+        serializer = PatientListSerializer(patients, many=True, fields=fields)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
     def post(self, request, *args, **kwargs):
@@ -267,12 +443,15 @@ class DepartmentDoctorListView(APIView):
 
         # Ensure the requesting doctor is from the same department
         doctor = request.user.doctorprofile
-        if doctor.department != department:
+        if doctor.department_id != department.pk:
             return Response({"error": "You do not have permission to view doctors in this department."}, status=status.HTTP_403_FORBIDDEN)
 
-        doctors = DoctorProfile.objects.filter(department=department)
-        serializer = DoctorListSerializer(doctors, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        fields = DoctorListSerializer.get_requested_fields(request)
+        doctors = DoctorListSerializer.setup_eager_loading(DoctorProfile.objects.filter(department=department))
+        paginator = KeysetPagination(ordering=('id',))
+        page = paginator.paginate_queryset(doctors, request, view=self)
+        serializer = DoctorListSerializer(page, many=True, fields=fields)
+        return paginator.get_paginated_response(serializer.data)
     
 
 class DepartmentPatientListView(APIView):
@@ -286,9 +465,45 @@ class DepartmentPatientListView(APIView):
 
         # Ensure the requesting doctor is from the same department
         doctor = request.user.doctorprofile
-        if doctor.department != department:
+        if doctor.department_id != department.pk:
             return Response({"error": "You do not have permission to view patients in this department."}, status=status.HTTP_403_FORBIDDEN)
 
-        patients = PatientProfile.objects.filter(department=department)
-        serializer = PatientListSerializer(patients, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
\ No newline at end of file
+        fields = PatientListSerializer.get_requested_fields(request)
+        patients = PatientListSerializer.setup_eager_loading(PatientProfile.objects.filter(department=department))
+        paginator = KeysetPagination(ordering=('id',))
+        page = paginator.paginate_queryset(patients, request, view=self)
+        serializer = PatientListSerializer(page, many=True, fields=fields)
+        return paginator.get_paginated_response(serializer.data)
+
+
+class DepartmentStatsView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, pk, *args, **kwargs):
+        # Admins see every department, doctors their own
+        doctor = getattr(request.user, 'doctorprofile', None)
+        if not request.user.is_admin and (doctor is None or doctor.department_id != pk):
+            return Response({"error": "You do not have permission to view statistics of this department."}, status=status.HTTP_403_FORBIDDEN)
+
+        try:
+            days = int(request.query_params.get('days', 30))
+        except ValueError:
+            return Response({"error": "days must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
+        days = min(max(days, 1), 366)
+
+        # Both reads hit the maintained summary tables (apis/stats.py), never the records
+        try:
+            stats = DepartmentStats.objects.get(pk=pk)
+        except DepartmentStats.DoesNotExist:
+            return Response({"error": "Department not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        today = timezone.localdate()
+        first_day = today - timedelta(days=days - 1)
+        counts = dict(DepartmentDailyRecords.objects.filter(department_id=pk, day__gte=first_day).values_list('day', 'records'))
+
+        data = DepartmentStatsSerializer(stats).data
+        data['records_per_day'] = [
+            {"day": day, "records": counts.get(day, 0)}
+            for day in (first_day + timedelta(days=offset) for offset in range(days))
+        ]
+        return Response(data, status=status.HTTP_200_OK)
@@ -13,4 +13,7 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'greylabs.settings')
 
+# Also serves the long-lived record event streams (apis/events.py), which
+# WSGI workers refuse. Each worker process fans events out to its own
+# streams; see EVENTS_BACKEND for running several.
 application = get_asgi_application()
@@ -2,6 +2,7 @@
 from pathlib import Path
 from datetime import timedelta
 import os
+import tempfile
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -36,6 +37,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'apis.middleware.metrics_middleware',
+    'apis.middleware.replica_routing_middleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -69,21 +72,127 @@ WSGI_APPLICATION = 'greylabs.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
+#
+# SQLite only. The triggers keeping the record search index up to date call
+# apis_decompress(), a function Django registers on its own connections
+# (apis/db.py): records can only be written through Django, or through a
+# sqlite3 connection passed to apis.db.register_functions. Writes from the
+# sqlite3 CLI or manage.py dbshell fail with "no such function".
 
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Keep connections open across requests, checking them before reuse
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 600)),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Read replicas. Reads go to one of DATABASE_REPLICAS and writes to 'default'
+# (apis/routers.py); a user's reads stay on the primary for REPLICA_PIN_SECONDS
+# after they write. Set SQLITE_REPLICA_NAME to a copy of the database file to
+# try it locally.
+DATABASE_REPLICAS = []
+if os.environ.get('SQLITE_REPLICA_NAME'):
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ['SQLITE_REPLICA_NAME'],
+        'CONN_MAX_AGE': DATABASES['default']['CONN_MAX_AGE'],
+        'CONN_HEALTH_CHECKS': True,
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append('replica')
+
+DATABASE_ROUTERS = ['apis.routers.PrimaryReplicaRouter']
+REPLICA_PIN_SECONDS = int(os.environ.get('REPLICA_PIN_SECONDS', 5))
+
+# Applied to every new SQLite connection (apis/db.py). WAL is stored in the
+# database file itself, so the first connection rewrites the header of the
+# checked-in db.sqlite3 and git reports it modified; run with
+# SQLITE_JOURNAL_MODE=DELETE to leave it untouched.
+SQLITE_PRAGMAS = {
+    'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+    'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000)),
+    # Negative cache_size is in KiB
+    'cache_size': -int(os.environ.get('SQLITE_CACHE_SIZE_KB', 64000)),
+    'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+    'temp_store': 'MEMORY',
+}
+
 # JWT Configuration
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'apis.authentication.CachedJWTAuthentication',
     )
 }
 
+# Cache holding the versioned list responses (apis/cache.py) and the replica
+# pins (apis/routers.py). The default, a directory on this host, is shared by
+# every worker and management command; use Redis or Memcached when running on
+# several hosts. LocMemCache is per process: each worker then only sees its
+# own writes invalidate its lists (others stay stale up to an hour), and
+# reads are not sent to replicas since the pins would not reach the other
+# workers.
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', os.path.join(tempfile.gettempdir(), 'greylabs-cache')),
+    }
+}
+
+# Keyset pagination for the department feeds; clients may ask for up to
+# PAGINATION_MAX_PAGE_SIZE rows per page with ?page_size=
+PAGINATION_PAGE_SIZE = int(os.environ.get('PAGINATION_PAGE_SIZE', 100))
+PAGINATION_MAX_PAGE_SIZE = int(os.environ.get('PAGINATION_MAX_PAGE_SIZE', 1000))
+
+# Largest batch accepted by the bulk record endpoint
+BULK_CREATE_MAX_RECORDS = int(os.environ.get('BULK_CREATE_MAX_RECORDS', 500))
+
+# Authenticated users are cached per process with their profile and department
+# (apis/authentication.py). Local changes evict immediately; the TTL bounds how
+# long a change made by another worker can go unnoticed.
+USER_CACHE_MAX_SIZE = int(os.environ.get('USER_CACHE_MAX_SIZE', 10000))
+USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 60))
+
+# Refresh token blacklist checks are served from memory (apis/tokens.py); new
+# blacklist rows from other workers are picked up every this many seconds.
+BLACKLIST_SYNC_INTERVAL = int(os.environ.get('BLACKLIST_SYNC_INTERVAL', 5))
+
+# Threads used by the async login/registration views to hash passwords off the
+# event loop (apis/async_views.py)
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 4))
+
+# Per-view request metrics, scraped from /metrics. Set METRICS_DIR to a
+# directory shared by the gunicorn workers (emptied before startup) so
+# /metrics reports all of them; each worker writes its numbers there at most
+# every METRICS_FLUSH_INTERVAL seconds. Only METRICS_ALLOWED_IPS may scrape,
+# and when METRICS_TOKEN is set only with "Authorization: Bearer <token>"
+# (Prometheus' bearer_token). Set it whenever a reverse proxy runs on an
+# allowed address: the proxied requests all come from there, so without a
+# token /metrics must not be routed through the proxy.
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+METRICS_DIR = os.environ.get('METRICS_DIR') or None
+METRICS_FLUSH_INTERVAL = int(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+METRICS_ALLOWED_IPS = os.environ.get('METRICS_ALLOWED_IPS', '127.0.0.1').split(',')
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN') or None
+
+# Codec for new values of apis.fields.CompressedTextField columns (the
+# PatientRecords texts); values written with any registered codec stay readable
+COMPRESSED_TEXT_CODEC = os.environ.get('COMPRESSED_TEXT_CODEC', 'zlib')
+
+# Server-sent record events (apis/events.py). EVENTS_BACKEND decides how a
+# worker learns of writes: apis.events.LocalBackend only sees its own, set
+# apis.events.PollingBackend with several workers to also check the change
+# log every EVENTS_POLL_INTERVAL seconds. A stream is closed after
+# EVENTS_MAX_STREAM_SECONDS and the client reconnects with Last-Event-ID.
+EVENTS_BACKEND = os.environ.get('EVENTS_BACKEND', 'apis.events.LocalBackend')
+EVENTS_POLL_INTERVAL = float(os.environ.get('EVENTS_POLL_INTERVAL', 1))
+EVENTS_QUEUE_SIZE = int(os.environ.get('EVENTS_QUEUE_SIZE', 1000))
+EVENTS_KEEPALIVE_SECONDS = int(os.environ.get('EVENTS_KEEPALIVE_SECONDS', 15))
+EVENTS_MAX_STREAM_SECONDS = int(os.environ.get('EVENTS_MAX_STREAM_SECONDS', 300))
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
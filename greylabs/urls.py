@@ -2,6 +2,11 @@
 from django.contrib import admin
 from django.urls import path,include
 from apis.views import *
+from apis.async_views import (
+    AsyncUserRegistrationView, AsyncUserLoginView, AsyncDepartmentListView, AsyncDoctorListView,
+    AsyncPatientListView, AsyncPatientRecordView, AsyncPatientRecordDetailView, AsyncPatientDetailView,
+    RecordEventStreamView,
+)
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -9,9 +14,26 @@ urlpatterns = [
     path('register/', UserRegistrationView.as_view(), name='register'),
     path('login/', UserLoginView.as_view(), name='login'),
     path('logout/', LogoutView.as_view(), name='logout'),
+    path('token/refresh/', RefreshView.as_view(), name='token-refresh'),
+    path('metrics', metrics_view, name='metrics'),
+
+    # Native async variants, served without a worker thread under greylabs.asgi
+    path('async/register/', AsyncUserRegistrationView.as_view(), name='async-register'),
+    path('async/login/', AsyncUserLoginView.as_view(), name='async-login'),
+    path('async/departments/', AsyncDepartmentListView.as_view(), name='async-department-list'),
+    path('async/doctors/', AsyncDoctorListView.as_view(), name='async-doctor-list'),
+    path('async/patients/', AsyncPatientListView.as_view(), name='async-patient-list'),
+    path('async/patient_records/', AsyncPatientRecordView.as_view(), name='async-patient-record-list'),
+    path('async/patient_records/<int:pk>/', AsyncPatientRecordDetailView.as_view(), name='async-patient-record-detail'),
+    path('async/patient_records/events/', RecordEventStreamView.as_view(), name='patient-record-events'),
+    path('async/patients/<int:pk>/', AsyncPatientDetailView.as_view(), name='async-patient-detail'),
 
     path('departments/', DepartmentListCreateView.as_view(), name='department-list-create'),
     path('patient_records/', PatientRecordView.as_view(), name='patient-record-list'),
+    path('patient_records/bulk/', PatientRecordBulkCreateView.as_view(), name='patient-record-bulk-create'),
+    path('patient_records/export/', PatientRecordExportView.as_view(), name='patient-record-export'),
+    path('patient_records/search/', PatientRecordSearchView.as_view(), name='patient-record-search'),
+    path('patient_records/changes/', PatientRecordChangesView.as_view(), name='patient-record-changes'),
     path('patients/<int:pk>/', PatientDetailView.as_view(), name='patient-detail'),
     path('doctors/<int:pk>/', DoctorProfileView.as_view(), name='doctor-profile-detail'),
     path('patient_records/<int:pk>/', PatientRecordDetailView.as_view(), name='patient-record-detail'),
@@ -19,4 +41,5 @@ urlpatterns = [
     path('patients/', PatientListView.as_view(), name='patient-list'),
     path('department/<int:pk>/doctors/', DepartmentDoctorListView.as_view(), name='department-doctors'),
     path('department/<int:pk>/patients/', DepartmentPatientListView.as_view(), name='department-patients'),
+    path('department/<int:pk>/stats/', DepartmentStatsView.as_view(), name='department-stats'),
 ]